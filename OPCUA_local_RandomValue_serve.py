@@ -3,26 +3,169 @@
 #   - Weight、Tray1_vol～Tray4_vol：每秒更新為 100～800 的隨機值（彼此不同）
 #   - 保留 m0 結構（Functions / Parameters / Tags）
 #   - 預設 No-Security，可切換 USE_SECURITY=True
+#   - 可選：Simulation 物件下產生 N 個物件 × M 個變數（SIM_OBJECTS / SIM_VARIABLES），
+#     訊號模型 uniform / random_walk / sine / step / noise，每個 tick 以 NumPy 一次算完、一次寫入
+#   - 各 tag group 以絕對 deadline 排程，可設定不同更新頻率（SENSOR_RATE_HZ / SIM_RATES）
+#   - Deadband：每個 tag 可設 absolute / percent deadband，只有變化超過 deadband 才寫入（client 才收到通知）
+#   - 節點（m0 / SensorData / Simulation）由 address space 設定一次建立（opcua_addressspace.py），可用 JSON 或 NodeSet2 XML 覆寫，
+#     並可快取整個 address space 讓重啟只要零點幾秒（OPCUA_ADDRESS_SPACE_CACHE）
+#   - Rolling statistics：SensorData 每個 tag 底下的 Avg / Min / Max / Std_<時間窗> 子變數（例如 Weight/Avg_1m），
+#     逐筆增量更新、不重新掃描（STATS_WINDOWS，見 opcua_stats.py）
+#   - 可選：Waveform 物件下的波形（Double array）tag，高頻取樣以 block 為單位寫入（WAVE_TAGS / WAVE_SAMPLE_RATE / WAVE_BLOCK_SIZE）
+#   - 分片：由 opcua_shards.py 啟動 K 個 process（SHARD_INDEX / SHARD_COUNT / OPCUA_PORT），各自負責一段 Simulation 物件，
+#     只有 shard 0 跑 SensorData / 錄製 / 重播 / 歷史 / 統計 / 波形
+#   - 可錄製 SensorData（RECORD_FILE）或以錄製檔取代亂數重播（REPLAY_FILE / REPLAY_SPEED），格式見 opcua_recorder.py
+#   - 自我診斷：m0/Tags/Diagnostics 底下的 tick 時間 / Write 延遲 / 排程 jitter / session 與 subscription 數 / 通知佇列；
+#     m0/Functions/Profiling（或 SIGUSR1）切換 sampling profiler，不需重啟（見 opcua_diagnostics.py）
 
 import os
+import time
+import signal
 import asyncio
-import random
 from asyncua import Server, ua
+from opcua_addressspace import AddressSpaceSpec, provision
+from opcua_diagnostics import Diagnostics
+from opcua_historian import RingHistory, historize
+from opcua_recorder import Recorder, Recording, replay
+from opcua_shards import shard_range
+from opcua_simulator import SIGNAL_MODELS, SignalBank, Simulator, TickScheduler, parse_deadband
+from opcua_stats import DEFAULT_BUCKETS, DEFAULT_WINDOWS, STAT_FUNCTIONS, RollingStats, parse_windows, stat_names
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 # ---------- Config ----------
 USE_SECURITY = False
+OPCUA_PORT = int(os.environ.get("OPCUA_PORT", "4840"))
 CERT_PATH = os.path.join(BASE_DIR, "server_cert.der")
 PRIVATE_KEY_PATH = os.path.join(BASE_DIR, "server_key.pem")
+
+# 模擬規模（可用環境變數覆寫）：Simulation/Obj0000~ × Var000~，0 表示不建立
+SIM_OBJECTS = int(os.environ.get("SIM_OBJECTS", "0"))
+SIM_VARIABLES = int(os.environ.get("SIM_VARIABLES", "10"))
+# 依序輪流套用在每個變數上的訊號模型（逗號分隔，可選：uniform,random_walk,sine,step,noise）
+SIM_MODELS = os.environ.get("SIM_MODELS", ",".join(SIGNAL_MODELS)).split(",")
+SIM_LOW, SIM_HIGH = 0.0, 100.0
+SIM_SEED = int(os.environ["SIM_SEED"]) if "SIM_SEED" in os.environ else None
+
+# 更新頻率（Hz）：SensorData（Weight/Tray*_vol + m0.Tags.Status）
+SENSOR_RATE_HZ = float(os.environ.get("SENSOR_RATE_HZ", "1.0"))
+# Simulation 物件分成幾個 group，各自的頻率（逗號分隔，例如 "100,10,1"），物件依序輪流分配
+SIM_RATES = [float(r) for r in os.environ.get("SIM_RATES", "1").split(",")]
+
+# 歷史資料（Historian）：OPCUA_HISTORY=1 時把 SensorData 變數存進固定大小的環狀檔案，並支援 HistoryRead
+HISTORIZE = os.environ.get("OPCUA_HISTORY", "0") == "1"
+HISTORY_DIR = os.environ.get("OPCUA_HISTORY_DIR", os.path.join(BASE_DIR, "history"))
+HISTORY_CAPACITY = int(os.environ.get("OPCUA_HISTORY_CAPACITY", "604800"))  # 每個 tag 最多幾筆（1 Hz 約一週）
+
+# 錄製 / 重播：
+#   RECORD_FILE=<path>：把每個 tick 寫入 SensorData 的值錄成 .rec 檔
+#   REPLAY_FILE=<path>：不產生亂數，改以錄製檔的值寫入 SensorData（依 column 名稱對應變數）
+#   REPLAY_SPEED：1 = 原速、N = N 倍速、0 = 越快越好；REPLAY_LOOP=1 播完從頭再來
+RECORD_FILE = os.environ.get("RECORD_FILE")
+REPLAY_FILE = os.environ.get("REPLAY_FILE")
+REPLAY_SPEED = float(os.environ.get("REPLAY_SPEED", "1"))
+REPLAY_LOOP = os.environ.get("REPLAY_LOOP", "0") == "1"
+
+# Deadband（格式："0" = 值有變才寫、"5" = 絕對值、"2%" = 量程的百分比、"off" = 每個 tick 都寫）：
+#   SENSOR_DEADBAND：SensorData 全部 tag 的預設；SENSOR_DEADBANDS：個別 tag，例如 "Weight=5,Tray1_vol=2%"
+#   SIM_DEADBAND：Simulation 全部變數
+SENSOR_DEADBAND = os.environ.get("SENSOR_DEADBAND", "0")
+SENSOR_DEADBANDS = os.environ.get("SENSOR_DEADBANDS", "")
+SIM_DEADBAND = os.environ.get("SIM_DEADBAND", "0")
+
+# Rolling statistics：SensorData 每個 tag 底下建立 <Avg|Min|Max|Std>_<時間窗> 子變數（例如 SensorData/Weight/Avg_1m），
+# 以 STATS_SAMPLE_HZ 取樣 tag 目前的值（含 client 手動寫入的 Temperature）增量更新，每 1 / STATS_RATE_HZ 秒寫入一次（值有變才寫）
+#   STATS_WINDOWS：逗號分隔的時間窗（空字串 = 不建立）；STATS_BUCKETS：每個時間窗切成幾段（解析度 = 時間窗 / STATS_BUCKETS）
+STATS_WINDOWS = parse_windows(os.environ.get("STATS_WINDOWS", DEFAULT_WINDOWS))
+STATS_BUCKETS = int(os.environ.get("STATS_BUCKETS", str(DEFAULT_BUCKETS)))
+STATS_SAMPLE_HZ = float(os.environ.get("STATS_SAMPLE_HZ", str(SENSOR_RATE_HZ)))
+STATS_RATE_HZ = float(os.environ.get("STATS_RATE_HZ", "1"))
+
+# 波形（array）tag：以 WAVE_SAMPLE_RATE 取樣，每 WAVE_BLOCK_SIZE 個取樣寫一次 Objects/Waveform/<name>（Double array），
+# SourceTimestamp = block 第一個取樣的時間，子節點 SampleInterval = 取樣間隔（秒）
+#   WAVE_TAGS：逗號分隔的名稱（空字串 = 不建立）；WAVE_MODEL / WAVE_PERIOD：訊號模型與週期（秒），例如 20 Hz 的 sine
+WAVE_TAGS = [n.strip() for n in os.environ.get("WAVE_TAGS", "").split(",") if n.strip()]
+WAVE_SAMPLE_RATE = float(os.environ.get("WAVE_SAMPLE_RATE", "1000"))
+WAVE_BLOCK_SIZE = int(os.environ.get("WAVE_BLOCK_SIZE", "100"))
+WAVE_MODEL = os.environ.get("WAVE_MODEL", "sine")
+WAVE_PERIOD = float(os.environ.get("WAVE_PERIOD", "0.05"))
+WAVE_LOW, WAVE_HIGH = 100.0, 800.0
+
+# Address space：預設為下面的 m0 / SensorData；OPCUA_ADDRESS_SPACE_FILE 指到的 JSON / NodeSet2 XML 存在時改用它
+# （必須包含 SensorData/Weight、SensorData/Tray1_vol~Tray4_vol、SensorData/Temperature、m0/Tags/Status）
+SENSOR_NAMES = ["Weight", "Tray1_vol", "Tray2_vol", "Tray3_vol", "Tray4_vol"]
+STATS_TAGS = ["Temperature"] + SENSOR_NAMES
+DEFAULT_ADDRESS_SPACE = {
+    "namespace": "http://examples.freeopcua.github.io",
+    "nodes": [
+        {"name": "m0", "children": [
+            {"name": "Functions", "children": [{"name": "EchoEnabled", "value": True, "writable": True}]},
+            {"name": "Parameters", "children": [{"name": "Mode", "value": "demo", "writable": True}]},
+            {"name": "Tags", "children": [{"name": "Status", "value": "running", "writable": True}]},
+        ]},
+        {"name": "SensorData", "children": [
+            {"name": "Temperature", "value": 0.0, "writable": True},  # 保留，不自動更新
+            # 允許手動寫入（即使伺服器會每秒覆寫 Weight/Tray*_vol）
+            {"name": "Weight", "value": 0.0, "writable": True},
+            {"name": "Tray{i}_vol", "repeat": 4, "start": 1, "value": 0.0, "writable": True},
+        ]},
+    ],
+}
+ADDRESS_SPACE_FILE = os.environ.get("OPCUA_ADDRESS_SPACE_FILE", os.path.join(BASE_DIR, "opcua_nodes.json"))
+# 整個 address space 的快取檔（例如 cache/address_space），設定沒變時重啟直接載入；未設定則每次重建
+ADDRESS_SPACE_CACHE = os.environ.get("OPCUA_ADDRESS_SPACE_CACHE")
+
+# 自我診斷：每 1 / DIAG_RATE_HZ 秒更新 m0/Tags/Diagnostics（0 = 不建立）；
+# profiler 以 m0/Functions/Profiling = True / False 或 SIGUSR1 切換，停止時把結果存到 PROFILE_DIR
+DIAG_RATE_HZ = float(os.environ.get("DIAG_RATE_HZ", "1"))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(BASE_DIR, "profiles"))
+
+# 分片（由 opcua_shards.py 設定）：這個 process 是 SHARD_COUNT 個 shard 中的第 SHARD_INDEX 個
+SHARD_INDEX = int(os.environ.get("SHARD_INDEX", "0"))
+SHARD_COUNT = int(os.environ.get("SHARD_COUNT", "1"))
 # ----------------------------
 
+if SHARD_INDEX > 0:
+    # SensorData 與相關功能只在 shard 0，其他 shard 只跑自己那段 Simulation
+    RECORD_FILE = REPLAY_FILE = None
+    HISTORIZE = False
+    STATS_WINDOWS = {}
+    WAVE_TAGS = []
+if SHARD_COUNT > 1 and ADDRESS_SPACE_CACHE:
+    # 每個 shard 的節點不同，各用一個 cache 檔
+    ADDRESS_SPACE_CACHE = f"{ADDRESS_SPACE_CACHE}.shard{SHARD_INDEX}"
+SIM_START, SIM_STOP = shard_range(SIM_OBJECTS, SHARD_COUNT, SHARD_INDEX)
+
+def shard_seed(offset):
+    """Seed of a SignalBank: SIM_SEED + offset on shard 0 (same as unsharded), distinct streams on other shards."""
+    if SIM_SEED is None:
+        return None
+    return SIM_SEED + offset if SHARD_INDEX == 0 else [SIM_SEED, SHARD_INDEX, offset]
+
 async def main():
     server = Server()
-    await server.init()
+    spaces = [AddressSpaceSpec.load(ADDRESS_SPACE_FILE, default=DEFAULT_ADDRESS_SPACE)]
+    if SIM_STOP > SIM_START:
+        # Simulation：N 個物件 × M 個變數（與 SensorData 同一個 namespace）；分片時只建立自己那段（維持全域編號）
+        spaces.append(AddressSpaceSpec({"namespace": DEFAULT_ADDRESS_SPACE["namespace"], "nodes": [
+            {"name": "Simulation", "children": [
+                {"name": "Obj{i:04d}", "repeat": SIM_STOP - SIM_START, "start": SIM_START, "children": [
+                    {"name": "Var{i:03d}", "repeat": SIM_VARIABLES, "value": 0.0, "type": "Double"}]}]}]}))
+    if STATS_WINDOWS:
+        # 掛在 SensorData 的各個變數底下（parent），預設 / JSON / NodeSet2 的 address space 都適用
+        spaces.append(AddressSpaceSpec({"namespace": DEFAULT_ADDRESS_SPACE["namespace"], "nodes": [
+            {"name": child, "parent": f"SensorData/{name}", "value": float("nan"), "type": "Double"}
+            for name in STATS_TAGS for child in stat_names(STATS_WINDOWS)]}))
+    if WAVE_TAGS:
+        spaces.append(AddressSpaceSpec({"namespace": DEFAULT_ADDRESS_SPACE["namespace"], "nodes": [
+            {"name": "Waveform", "children": [
+                {"name": name, "value": [0.0] * WAVE_BLOCK_SIZE, "type": "Double", "children": [
+                    {"name": "SampleInterval", "value": 1.0 / WAVE_SAMPLE_RATE, "type": "Double"}]}
+                for name in WAVE_TAGS]}]}))
+    nodes = await provision(server, *spaces, cache=ADDRESS_SPACE_CACHE)
 
     # endpoint
-    server.set_endpoint("opc.tcp://0.0.0.0:4840/freeopcua/server/")
+    server.set_endpoint(f"opc.tcp://0.0.0.0:{OPCUA_PORT}/freeopcua/server/")
 
     # security
     if not USE_SECURITY:
@@ -42,66 +185,219 @@ async def main():
             print(f"[Warning] Security 失敗：{e} -> No-Security")
             server.set_security_policy([ua.SecurityPolicyType.NoSecurity])
 
+    if HISTORIZE:
+        server.iserver.history_manager.set_storage(RingHistory(HISTORY_DIR, capacity=HISTORY_CAPACITY))
+
     # 基本資訊
     server.set_server_name("Demo OPCUA Server by Afuku AI Nutrition OPCUA DATA")
-    uri = "http://examples.freeopcua.github.io"
-    idx = await server.register_namespace(uri)
-
-    # ---------- m0: 基本功能/參數/標籤（保留結構） ----------
-    m0 = await server.nodes.objects.add_object(idx, "m0")
-    m0_funcs = await m0.add_object(idx, "Functions")
-    m0_params = await m0.add_object(idx, "Parameters")
-    m0_tags = await m0.add_object(idx, "Tags")
-
-    # 佔位變數（可日後替換）
-    m0_echo = await m0_funcs.add_variable(idx, "EchoEnabled", True)
-    m0_mode = await m0_params.add_variable(idx, "Mode", "demo")
-    m0_status = await m0_tags.add_variable(idx, "Status", "running")
-    for v in (m0_echo, m0_mode, m0_status):
-        await v.set_writable()
-
-    # ---------- SensorData ----------
-    sensor = await server.nodes.objects.add_object(idx, "SensorData")
-    var_temp = await sensor.add_variable(idx, "Temperature", 0.0)  # 保留，不自動更新
-    var_weight = await sensor.add_variable(idx, "Weight", 0.0)
-    var_t1 = await sensor.add_variable(idx, "Tray1_vol", 0.0)
-    var_t2 = await sensor.add_variable(idx, "Tray2_vol", 0.0)
-    var_t3 = await sensor.add_variable(idx, "Tray3_vol", 0.0)
-    var_t4 = await sensor.add_variable(idx, "Tray4_vol", 0.0)
-
-    # 允許手動寫入（即使伺服器會每秒覆寫 Weight/Tray*_vol）
-    for v in (var_temp, var_weight, var_t1, var_t2, var_t3, var_t4):
-        await v.set_writable()
-
-    print("[OK] Server @ opc.tcp://localhost:4840/freeopcua/server/")
-    print("[DATA] 觀察：Objects → SensorData → Weight / Tray*_vol（每秒亂數 100~800）")
-
-    async def update_random_values():
-        """每秒更新 Weight 與 Tray1~4 為 100~800 的互異亂數。"""
-        while True:
-            # 產生 5 個互異隨機整數（100~800）
-            w, t1, t2, t3, t4 = random.sample(range(100, 801), 5)
-
-            # 寫入（用 Double 方便 client 當浮點處理）
-            await var_weight.set_value(ua.Variant(float(w), ua.VariantType.Double))
-            await var_t1.set_value(ua.Variant(float(t1), ua.VariantType.Double))
-            await var_t2.set_value(ua.Variant(float(t2), ua.VariantType.Double))
-            await var_t3.set_value(ua.Variant(float(t3), ua.VariantType.Double))
-            await var_t4.set_value(ua.Variant(float(t4), ua.VariantType.Double))
-
-            # m0.Tags.Status 也順便跳動一下（非必要）
-            await m0_status.set_value(f"running@{w}-{t1}-{t2}-{t3}-{t4}")
-
-            await asyncio.sleep(1.0)
+
+    # m0（基本功能/參數/標籤）與 SensorData 已由 address space 建立
+    missing = [p for p in ["m0/Tags/Status", "SensorData/Temperature"] + [f"SensorData/{n}" for n in SENSOR_NAMES]
+               if p not in nodes]
+    if missing:
+        raise ValueError(f"address space 缺少節點：{', '.join(missing)}")
+    m0_status = nodes["m0/Tags/Status"]
+    sensor_vars = {name: nodes[f"SensorData/{name}"] for name in ["Temperature"] + SENSOR_NAMES}
+
+    # ---------- 訊號模擬 ----------
+    scheduler = TickScheduler()
+    simulators = []  # 全部的 Simulator（diagnostics 取 Write 延遲）
+
+    # Weight、Tray1~4：100~800 的整數亂數（uniform）
+    bank = SignalBank(seed=shard_seed(0))
+    for name in SENSOR_NAMES:
+        bank.add("uniform", low=100, high=800, integer=True, name=f"SensorData/{name}")
+    simulator = Simulator(server, bank.build()).bind([sensor_vars[name] for name in SENSOR_NAMES])
+    apply_deadband(simulator, SENSOR_NAMES)
+    simulators.append(simulator)
+    # 重播模式的 recorder 由 make_replay() 依錄製檔實際對應到的 column 建立
+    recorder = Recorder(RECORD_FILE, SENSOR_NAMES, meta={"source": "server"}) if RECORD_FILE and not REPLAY_FILE else None
+
+    async def update_random_values(t):
+        """依 SENSOR_RATE_HZ 以 SignalBank 算出 Weight/Tray1~4，並以一次 Write 寫入。"""
+        values = bank.tick(t)
+        w, t1, t2, t3, t4 = (int(v) for v in values)
+
+        # 一次寫入（Double 方便 client 當浮點處理）；m0.Tags.Status 也順便跳動一下（非必要），
+        # 只在有 tag 超過 deadband 時才更新
+        status = ua.Variant(f"running@{w}-{t1}-{t2}-{t3}-{t4}", ua.VariantType.String)
+        await write_checked(simulator, values, extra=[(m0_status, status)], extra_on_change=True)
+        if recorder is not None:
+            recorder.append(t, values)
+
+    replay_task = None
+    if REPLAY_FILE:
+        replay_task, recorder = make_replay(server, Recording(REPLAY_FILE), sensor_vars, RECORD_FILE)
+    elif SHARD_INDEX == 0:
+        scheduler.add_group("sensor", SENSOR_RATE_HZ, update_random_values)
+
+    # Simulation：N 個物件 × M 個變數，物件依序分配到 SIM_RATES 的各個 group
+    if SIM_STOP > SIM_START:
+        groups = [(SignalBank(seed=shard_seed(g + 1)), []) for g in range(len(SIM_RATES))]
+        for i in range(SIM_START, SIM_STOP):
+            group_bank, group_nodes = groups[i % len(SIM_RATES)]
+            for j in range(SIM_VARIABLES):
+                model = SIM_MODELS[(i * SIM_VARIABLES + j) % len(SIM_MODELS)].strip()
+                path = f"Simulation/Obj{i:04d}/Var{j:03d}"
+                group_bank.add(model, low=SIM_LOW, high=SIM_HIGH, name=path)
+                group_nodes.append(nodes[path])
+        for rate, (group_bank, group_nodes) in zip(SIM_RATES, groups):
+            if not group_nodes:
+                continue
+            group_sim = Simulator(server, group_bank.build()).bind(group_nodes)
+            deadband = parse_deadband(SIM_DEADBAND)
+            if deadband is not None:
+                group_sim.set_deadband(*deadband)
+            simulators.append(group_sim)
+            scheduler.add_group(f"sim@{rate:g}Hz", rate, make_sim_tick(group_sim))
+        shard = f"（shard {SHARD_INDEX}/{SHARD_COUNT}：Obj{SIM_START:04d}~Obj{SIM_STOP - 1:04d}）" if SHARD_COUNT > 1 else ""
+        print(f"[OK] Simulation：{SIM_STOP - SIM_START} objects × {SIM_VARIABLES} variables{shard}"
+              f"（模型：{', '.join(SIM_MODELS)}；頻率：{', '.join(f'{r:g} Hz' for r in SIM_RATES)}）")
+
+    # Rolling statistics：取樣與寫入分成兩個 group（取樣跟著 tag 的更新頻率，寫入 1 Hz 就夠）
+    if STATS_WINDOWS:
+        stats = RollingStats(len(STATS_TAGS), STATS_WINDOWS, buckets=STATS_BUCKETS)
+        stats_sim = Simulator(server).bind([nodes[f"SensorData/{name}/{child}"]
+                                            for name in STATS_TAGS for child in stats.names()]).set_deadband()
+        simulators.append(stats_sim)
+        scheduler.add_group("stats-sample", STATS_SAMPLE_HZ,
+                            make_stats_sample(server, stats, [sensor_vars[name] for name in STATS_TAGS]))
+        scheduler.add_group("stats", STATS_RATE_HZ, make_stats_publish(stats, stats_sim))
+        print(f"[OK] Rolling statistics：SensorData/<tag>/{'|'.join(STAT_FUNCTIONS)}_<{'|'.join(STATS_WINDOWS)}>"
+              f"（{STATS_SAMPLE_HZ:g} Hz 取樣）")
+
+    # Waveform：每個 block 一次算出、一次寫入全部波形 tag
+    if WAVE_TAGS:
+        wave_bank = SignalBank(seed=shard_seed(len(SIM_RATES) + 1))
+        for name in WAVE_TAGS:
+            wave_bank.add(WAVE_MODEL, low=WAVE_LOW, high=WAVE_HIGH, period=WAVE_PERIOD, name=f"Waveform/{name}")
+        wave_sim = Simulator(server, wave_bank.build()).bind([nodes[f"Waveform/{name}"] for name in WAVE_TAGS])
+        simulators.append(wave_sim)
+        scheduler.add_group("waveform", WAVE_SAMPLE_RATE / WAVE_BLOCK_SIZE, make_wave_tick(wave_sim))
+        print(f"[OK] Waveform：{', '.join(WAVE_TAGS)}（{WAVE_SAMPLE_RATE:g} Hz 取樣，每 {WAVE_BLOCK_SIZE} 點寫一次）")
+
+    # Diagnostics：最後加入，每個 group 都有自己的節點
+    diagnostics = None
+    if DIAG_RATE_HZ > 0:
+        diagnostics = Diagnostics(server, scheduler, simulators, profile_dir=PROFILE_DIR,
+                                  label=f"shard{SHARD_INDEX}" if SHARD_COUNT > 1 else "")
+        if not await diagnostics.create(nodes, DIAG_RATE_HZ, DEFAULT_ADDRESS_SPACE["namespace"]):
+            diagnostics = None
+
+    print(f"[OK] Server @ opc.tcp://localhost:{OPCUA_PORT}/freeopcua/server/")
+    if REPLAY_FILE:
+        print(f"[DATA] 觀察：Objects → SensorData（重播 {REPLAY_FILE}，速度 {REPLAY_SPEED:g}×）")
+    elif SHARD_INDEX == 0:
+        print("[DATA] 觀察：Objects → SensorData → Weight / Tray*_vol（每秒亂數 100~800）")
+    if recorder is not None:
+        print(f"[OK] 錄製 SensorData -> {RECORD_FILE}")
 
     try:
         async with server:
-            # 背景任務：定時更新亂數
-            task = asyncio.create_task(update_random_values())
-            await task  # 永不返回
+            if HISTORIZE:
+                await historize(server, sensor_vars, count=HISTORY_CAPACITY)
+                print(f"[OK] Historian：SensorData 歷史資料存於 {HISTORY_DIR}（每個 tag 最多 {HISTORY_CAPACITY} 筆）")
+            if diagnostics is not None and hasattr(signal, "SIGUSR1"):
+                asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, diagnostics.request_toggle)
+            # 背景任務：依各 group 頻率定時更新亂數；重播模式下同時跑 replay
+            task = asyncio.create_task(scheduler.run())
+            if replay_task is not None:
+                await replay_task()
+                print("[OK] 重播完畢，SensorData 維持最後的值")
+            await task
+            await asyncio.Event().wait()  # 沒有任何 group 時也保持 server 運作
     except Exception as e:
         print(f"[Error] Server 運行時發生錯誤：{e}")
         raise
+    finally:
+        if recorder is not None:
+            recorder.close()
+        if diagnostics is not None:
+            # Ctrl+C 結束時正在跑的 profile 也存檔
+            diagnostics.stop_profiler()
+
+def make_sim_tick(simulator):
+    async def tick(t):
+        await write_checked(simulator, simulator.bank.tick(t))
+    return tick
+
+def make_stats_sample(server, stats, variables):
+    nodeids = [v.nodeid for v in variables]
+
+    async def tick(t):
+        # 直接讀 address space 裡目前的值（不經過 session），取樣的就是 client 看到的值
+        values = []
+        for nodeid in nodeids:
+            v = server.read_attribute_value(nodeid).Value
+            values.append(float(v.Value) if v is not None and isinstance(v.Value, (int, float)) else float("nan"))
+        stats.add(t, values)
+    return tick
+
+def make_stats_publish(stats, simulator):
+    async def tick(t):
+        await write_checked(simulator, stats.aggregate(t).reshape(-1))
+    return tick
+
+def make_wave_tick(simulator):
+    interval = 1.0 / WAVE_SAMPLE_RATE
+
+    async def tick(t):
+        # 這次 tick 寫入剛結束的這一段：[t - block 長度, t)
+        t0 = t - WAVE_BLOCK_SIZE * interval
+        results = await simulator.write_blocks(simulator.bank.block(t0, WAVE_BLOCK_SIZE, interval), t0)
+        bad = [r for r in results if not r.is_good()]
+        if bad:
+            print(f"[Warning] {len(bad)} 個波形節點寫入失敗：{bad[0]}")
+    return tick
+
+def make_replay(server, recording, variables, record_file=None):
+    """
+    Bind the recording's columns to SensorData variables by name; return (replay coroutine function, Recorder or None).
+    record_file：把重播寫入的值再錄一次，column 與實際寫入的相同（錄製檔中對應得到變數的 column）。
+    """
+    columns = [i for i, name in enumerate(recording.names) if name in variables]
+    skipped = [name for name in recording.names if name not in variables]
+    if skipped:
+        print(f"[Warning] 錄製檔中找不到對應變數的 column（略過）：{', '.join(skipped)}")
+    names = [recording.names[i] for i in columns]
+    player = Simulator(server).bind([variables[name] for name in names])
+    apply_deadband(player, names)
+    recorder = Recorder(record_file, names, meta={"source": "server", "replay": REPLAY_FILE}) if record_file else None
+    print(f"[OK] 重播 {REPLAY_FILE}：{len(recording)} 列 × {len(columns)} 個 tag")
+
+    async def write(row):
+        values = row[columns]
+        await write_checked(player, values)
+        if recorder is not None:
+            recorder.append(time.time(), values)
+
+    async def run():
+        await replay(recording, write, speed=REPLAY_SPEED, loop=REPLAY_LOOP)
+    return run, recorder
+
+def apply_deadband(simulator, names):
+    """Apply SENSOR_DEADBAND / SENSOR_DEADBANDS to a simulator bound to the SensorData variables ``names``."""
+    default = parse_deadband(SENSOR_DEADBAND)
+    overrides = {}
+    for item in filter(None, (x.strip() for x in SENSOR_DEADBANDS.split(","))):
+        name, _, value = item.partition("=")
+        overrides[name.strip()] = parse_deadband(value)
+    unknown = set(overrides) - set(names)
+    if unknown:
+        print(f"[Warning] SENSOR_DEADBANDS 中找不到的 tag（略過）：{', '.join(sorted(unknown))}")
+    bands = [overrides.get(name, default) for name in names]
+    if all(b is None for b in bands):
+        return
+    # 個別設定 "off" 的 tag 以 -1 表示（任何變化、包含相同值都寫入）
+    simulator.set_deadband([-1.0 if b is None else b[0] for b in bands], [0.0 if b is None else b[1] for b in bands])
+    print("[OK] Deadband：" + ", ".join(f"{n}={'off' if b is None else (f'{b[1]:g}%' if b[1] else f'{b[0]:g}')}"
+                                       for n, b in zip(names, bands)))
+
+async def write_checked(simulator, values, extra=(), extra_on_change=False):
+    results = await simulator.write(values, extra=extra, extra_on_change=extra_on_change)
+    bad = [r for r in results if not r.is_good()]
+    if bad:
+        print(f"[Warning] {len(bad)} 個節點寫入失敗：{bad[0]}")
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,439 @@
+# benchmark.py
+"""
+Load / latency benchmark for the OPC UA server and vue_flask_api.py.
+
+啟動本機的 OPC UA server 與 Flask API（或用 --no-start 連到已在執行的），
+在固定時間內同時跑 K 個模擬 client：
+  - OPC UA reader：持續以一次批次 Read 讀取 SensorData
+  - OPC UA subscriber：訂閱 SensorData，統計收到 / 遺漏 / 延遲的更新
+  - HTTP poller：持續 GET /data（keep-alive 連線）
+最後輸出 throughput、p50/p95/p99 latency、各 process 的 CPU / RSS，並存成 JSON 方便跨 commit 比較。
+
+用法：
+    python benchmark.py --duration 30 --readers 4 --subscribers 4 --pollers 16
+    python benchmark.py --no-start --opcua-url opc.tcp://192.168.0.10:4840/freeopcua/server/
+"""
+
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlparse
+
+import numpy as np
+from asyncua import Client
+
+from opcua_historian import to_epoch
+from opcua_session import TagMap
+
+try:
+    import psutil  # optional：有的話用它取 CPU / RSS（跨平台）
+except ImportError:
+    psutil = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# ---------- Config ----------
+SERVER_SCRIPT = os.path.join(BASE_DIR, "OPCUA_local_RandomValue_serve.py")
+API_SCRIPT = os.path.join(BASE_DIR, "vue_flask_api.py")
+OPCUA_URL = "opc.tcp://localhost:4840/freeopcua/server/"
+API_URL = "http://localhost:5000"
+RESULTS_DIR = os.path.join(BASE_DIR, "bench_results")
+SAMPLE_INTERVAL = 0.5   # CPU / RSS 取樣間隔（秒）
+STARTUP_TIMEOUT = 60.0  # 等待 server / API 啟動的上限（秒）
+# ----------------------------
+
+SENSOR_TAGS = {
+    "weight": ["0:Objects", "2:SensorData", "2:Weight"],
+    "tray1": ["0:Objects", "2:SensorData", "2:Tray1_vol"],
+    "tray2": ["0:Objects", "2:SensorData", "2:Tray2_vol"],
+    "tray3": ["0:Objects", "2:SensorData", "2:Tray3_vol"],
+    "tray4": ["0:Objects", "2:SensorData", "2:Tray4_vol"],
+}
+
+
+# -------------------------
+# Helpers
+# -------------------------
+def latency_summary(samples, duration):
+    """Throughput and latency percentiles (ms) for a list of per-request latencies in seconds."""
+    arr = np.asarray(samples, dtype=np.float64) * 1000.0
+    summary = {"count": int(arr.size), "throughput": arr.size / duration if duration else 0.0}
+    if arr.size:
+        p50, p95, p99 = np.percentile(arr, [50, 95, 99])
+        summary.update({"mean_ms": float(arr.mean()), "p50_ms": float(p50), "p95_ms": float(p95),
+                        "p99_ms": float(p99), "max_ms": float(arr.max())})
+    return summary
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                             capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def wait_for_port(host, port, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1.0):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def wait_for_http(url, timeout):
+    parsed = urlparse(url)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=2.0)
+            conn.request("GET", "/status")
+            if conn.getresponse().status == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+class ProcessSampler:
+    """
+    Sample CPU% and RSS of child processes in a background thread (psutil or /proc).
+    每個 process 連同其子程序一起計算（Flask debug reloader 實際服務的是子程序）。
+    """
+
+    def __init__(self, pids):
+        self.pids = pids  # {label: pid}
+        self.samples = {label: {"cpu": [], "rss": []} for label in pids}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._clk = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(2.0)
+
+    def _cpu_rss(self, pid):
+        if psutil is not None:
+            root = psutil.Process(pid)
+            cpu = rss = 0
+            for p in [root] + root.children(recursive=True):
+                t = p.cpu_times()
+                cpu += t.user + t.system
+                rss += p.memory_info().rss
+            return cpu, rss
+        stats = {}
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                try:
+                    with open(f"/proc/{entry}/stat") as f:
+                        stats[int(entry)] = f.read().rsplit(")", 1)[1].split()
+                except OSError:
+                    pass
+        tree, frontier = {pid}, [pid]
+        while frontier:
+            parent = frontier.pop()
+            children = [p for p, fields in stats.items() if int(fields[1]) == parent and p not in tree]
+            tree.update(children)
+            frontier.extend(children)
+        cpu = sum(int(stats[p][11]) + int(stats[p][12]) for p in tree if p in stats) / self._clk
+        rss = sum(int(stats[p][21]) for p in tree if p in stats) * os.sysconf("SC_PAGE_SIZE")
+        return cpu, rss
+
+    def _run(self):
+        last = {}
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            now = time.time()
+            for label, pid in self.pids.items():
+                try:
+                    cpu, rss = self._cpu_rss(pid)
+                except Exception:
+                    continue
+                if label in last:
+                    t_prev, cpu_prev = last[label]
+                    self.samples[label]["cpu"].append(100.0 * (cpu - cpu_prev) / max(now - t_prev, 1e-6))
+                self.samples[label]["rss"].append(rss)
+                last[label] = (now, cpu)
+
+    def summary(self):
+        result = {}
+        for label, s in self.samples.items():
+            cpu, rss = s["cpu"], s["rss"]
+            result[label] = {
+                "cpu_avg_pct": float(np.mean(cpu)) if cpu else None,
+                "cpu_max_pct": float(np.max(cpu)) if cpu else None,
+                "rss_max_mb": float(np.max(rss)) / 2 ** 20 if rss else None,
+                "rss_last_mb": float(rss[-1]) / 2 ** 20 if rss else None,
+            }
+        return result
+
+
+# -------------------------
+# Clients
+# -------------------------
+async def opcua_reader(url, stop_at, result):
+    """One OPC UA client reading all SensorData tags in one batched Read per iteration."""
+    async with Client(url=url) as client:
+        tags = TagMap(SENSOR_TAGS)
+        await tags.resolve(client)
+        while time.time() < stop_at:
+            t0 = time.perf_counter()
+            try:
+                await tags.read(client)
+                result["latencies"].append(time.perf_counter() - t0)
+            except Exception as e:
+                result["errors"][type(e).__name__] = result["errors"].get(type(e).__name__, 0) + 1
+
+
+class _SubHandler:
+    def __init__(self, result, late_after):
+        self.result = result
+        self.late_after = late_after
+        self.seen = set()
+
+    def datachange_notification(self, node, val, data):
+        now = time.time()
+        if node.nodeid not in self.seen:
+            # 訂閱後的第一個通知是目前值，SourceTimestamp 是上次變化的時間，不算進延遲 / 筆數
+            self.seen.add(node.nodeid)
+            return
+        self.result["received"] += 1
+        ts = data.monitored_item.Value.SourceTimestamp
+        if ts is not None:
+            delay = now - to_epoch(ts)
+            self.result["delays"].append(delay)
+            if delay > self.late_after:
+                self.result["late"] += 1
+
+
+async def opcua_subscriber(url, stop_at, interval_ms, late_after, result):
+    """One OPC UA client subscribed to all SensorData tags."""
+    async with Client(url=url) as client:
+        tags = TagMap(SENSOR_TAGS)
+        await tags.resolve(client)
+        sub = await client.create_subscription(interval_ms, _SubHandler(result, late_after))
+        await sub.subscribe_data_change([client.get_node(n) for n in tags.nodeids.values()])
+        result["started_at"] = time.time()
+        await asyncio.sleep(max(stop_at - time.time(), 0))
+        await sub.delete()
+
+
+def http_poller(api_url, stop_at, result):
+    """One HTTP client polling /data over a keep-alive connection."""
+    parsed = urlparse(api_url)
+    conn = None
+    while time.time() < stop_at:
+        t0 = time.perf_counter()
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=10.0)
+            conn.request("GET", "/data")
+            resp = conn.getresponse()
+            body = resp.read()
+            elapsed = time.perf_counter() - t0
+            if resp.status != 200 or b'"error"' in body:
+                result["errors"]["http_error"] = result["errors"].get("http_error", 0) + 1
+            else:
+                result["latencies"].append(elapsed)
+        except Exception as e:
+            result["errors"][type(e).__name__] = result["errors"].get(type(e).__name__, 0) + 1
+            if conn is not None:
+                conn.close()
+            conn = None
+    if conn is not None:
+        conn.close()
+
+
+def _new_result():
+    return {"latencies": [], "errors": {}}
+
+
+def _merge(results):
+    merged = {"latencies": [], "errors": {}}
+    for r in results:
+        merged["latencies"].extend(r["latencies"])
+        for k, v in r["errors"].items():
+            merged["errors"][k] = merged["errors"].get(k, 0) + v
+    return merged
+
+
+# -------------------------
+# Main
+# -------------------------
+def start_process(script, env_overrides, log_path):
+    env = os.environ.copy()
+    env.setdefault("PYTHONIOENCODING", "utf-8")
+    env.update(env_overrides)
+    log = open(log_path, "w", encoding="utf-8")
+    proc = subprocess.Popen([sys.executable, script], stdout=log, stderr=subprocess.STDOUT, env=env, cwd=BASE_DIR)
+    proc._bench_log = log
+    return proc
+
+
+def stop_process(proc):
+    if proc is None:
+        return
+    try:
+        proc.terminate()
+        proc.wait(timeout=5)
+    except Exception:
+        proc.kill()
+    proc._bench_log.close()
+
+
+async def run_opcua_clients(args, stop_at, readers, subscribers):
+    tasks = [opcua_reader(args.opcua_url, stop_at, r) for r in readers]
+    tasks += [opcua_subscriber(args.opcua_url, stop_at, args.sub_interval, args.late_after, s) for s in subscribers]
+    outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+    return [f"{type(o).__name__}: {o}" for o in outcomes if isinstance(o, Exception)]
+
+
+def run(args):
+    os.makedirs(args.output, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    server = api = None
+    pids = {}
+    try:
+        if not args.no_start:
+            server_env = {"SENSOR_RATE_HZ": str(args.rate), "SIM_OBJECTS": str(args.sim_objects),
+                          "SIM_VARIABLES": str(args.sim_variables)}
+            server = start_process(args.server_script, server_env, os.path.join(args.output, f"{stamp}_server.log"))
+            pids["server"] = server.pid
+            parsed = urlparse(args.opcua_url)
+            if not wait_for_port(parsed.hostname, parsed.port or 4840, STARTUP_TIMEOUT):
+                raise RuntimeError("OPC UA server 沒有在時限內啟動")
+            if args.pollers:
+                api = start_process(args.api_script, {"OPCUA_DATA_MODE": args.data_mode},
+                                    os.path.join(args.output, f"{stamp}_api.log"))
+                pids["api"] = api.pid
+        if args.pollers and not wait_for_http(args.api_url, STARTUP_TIMEOUT):
+            raise RuntimeError("Flask API 沒有在時限內啟動")
+        time.sleep(args.warmup)
+
+        print(f"[OK] benchmark：{args.readers} readers / {args.subscribers} subscribers / "
+              f"{args.pollers} pollers，{args.duration:g} 秒")
+        sampler = ProcessSampler(pids).start()
+        started = time.time()
+        stop_at = started + args.duration
+
+        poller_results = [_new_result() for _ in range(args.pollers)]
+        threads = [threading.Thread(target=http_poller, args=(args.api_url, stop_at, r), daemon=True)
+                   for r in poller_results]
+        for t in threads:
+            t.start()
+
+        reader_results = [_new_result() for _ in range(args.readers)]
+        sub_results = [{"received": 0, "late": 0, "delays": [], "started_at": None}
+                       for _ in range(args.subscribers)]
+        client_errors = asyncio.run(run_opcua_clients(args, stop_at, reader_results, sub_results))
+
+        for t in threads:
+            t.join(args.duration + 15)
+        elapsed = time.time() - started
+        sampler.stop()
+    finally:
+        stop_process(api)
+        stop_process(server)
+
+    readers = _merge(reader_results)
+    pollers = _merge(poller_results)
+    delays = [d for s in sub_results for d in s["delays"]]
+    expected = sum((stop_at - s["started_at"]) * args.rate * len(SENSOR_TAGS)
+                   for s in sub_results if s["started_at"])
+    received = sum(s["received"] for s in sub_results)
+
+    report = {
+        "timestamp": stamp,
+        "commit": git_commit(),
+        "config": {k: v for k, v in vars(args).items()},
+        "elapsed": elapsed,
+        "opcua_read": dict(latency_summary(readers["latencies"], elapsed), errors=readers["errors"]),
+        "http_data": dict(latency_summary(pollers["latencies"], elapsed), errors=pollers["errors"]),
+        "subscription": {
+            "received": received,
+            "expected": int(expected),
+            # uniform 整數亂數偶爾會與前一次相同（不會觸發通知），因此 dropped 是估計值
+            "dropped": max(int(expected) - received, 0),
+            "late": sum(s["late"] for s in sub_results),
+            "delay": latency_summary(delays, elapsed),
+        },
+        "processes": sampler.summary(),
+        "client_errors": client_errors,
+    }
+    path = os.path.join(args.output, f"{stamp}_{report['commit'] or 'nogit'}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print_report(report)
+    print(f"[OK] 結果已存檔：{path}")
+    return report
+
+
+def _fmt(summary):
+    if not summary.get("count"):
+        return "no samples"
+    return (f"{summary['throughput']:.1f}/s  p50 {summary['p50_ms']:.2f} ms  p95 {summary['p95_ms']:.2f} ms  "
+            f"p99 {summary['p99_ms']:.2f} ms  (n={summary['count']})")
+
+
+def print_report(report):
+    print(f"  OPC UA read   : {_fmt(report['opcua_read'])}  errors={report['opcua_read']['errors']}")
+    print(f"  HTTP /data    : {_fmt(report['http_data'])}  errors={report['http_data']['errors']}")
+    sub = report["subscription"]
+    print(f"  subscription  : received {sub['received']} / expected {sub['expected']}  "
+          f"dropped {sub['dropped']}  late {sub['late']}  delay {_fmt(sub['delay'])}")
+    for label, p in report["processes"].items():
+        if p["cpu_avg_pct"] is None:
+            print(f"  {label:<13} : no samples")
+            continue
+        print(f"  {label:<13} : CPU avg {p['cpu_avg_pct']:.1f}%  max {p['cpu_max_pct']:.1f}%  "
+              f"RSS max {p['rss_max_mb']:.1f} MB")
+    for err in report["client_errors"]:
+        print(f"[Warning] client 錯誤：{err}")
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Load / latency benchmark for the OPC UA server and Flask API")
+    p.add_argument("--duration", type=float, default=30.0, help="測試秒數")
+    p.add_argument("--warmup", type=float, default=2.0, help="啟動後等待幾秒再開始量測")
+    p.add_argument("--readers", type=int, default=4, help="OPC UA 直接讀取的 client 數")
+    p.add_argument("--subscribers", type=int, default=4, help="OPC UA subscription client 數")
+    p.add_argument("--pollers", type=int, default=8, help="HTTP /data 輪詢 client 數")
+    p.add_argument("--rate", type=float, default=1.0, help="server 的 SENSOR_RATE_HZ")
+    p.add_argument("--sim-objects", type=int, default=0, help="server 的 SIM_OBJECTS")
+    p.add_argument("--sim-variables", type=int, default=10, help="server 的 SIM_VARIABLES")
+    p.add_argument("--sub-interval", type=float, default=100.0, help="subscription publishing interval（ms）")
+    p.add_argument("--late-after", type=float, default=1.0, help="通知延遲超過幾秒算 late")
+    p.add_argument("--data-mode", default="poll", choices=("poll", "subscribe"), help="Flask API 的 OPCUA_DATA_MODE")
+    p.add_argument("--no-start", action="store_true", help="不啟動 server / API，直接連線到已在執行的")
+    p.add_argument("--server-script", default=SERVER_SCRIPT)
+    p.add_argument("--api-script", default=API_SCRIPT)
+    p.add_argument("--opcua-url", default=OPCUA_URL)
+    p.add_argument("--api-url", default=API_URL)
+    p.add_argument("--output", default=RESULTS_DIR, help="結果 JSON 的存放資料夾")
+    return p.parse_args(argv)
+
+
+if __name__ == "__main__":
+    try:
+        run(parse_args())
+    except KeyboardInterrupt:
+        print("[Terminated_by_user] 使用者終止 benchmark")
+    except Exception as e:
+        print(f"[Error] benchmark 失敗：{e}")
+        sys.exit(1)
@@ -0,0 +1,313 @@
+# opcua_addressspace.py
+"""
+Declarative address space for the demo servers: objects / variables from a JSON config or a NodeSet2 XML file.
+
+- AddressSpaceSpec：JSON（或 dict）描述的節點樹，展開成 AddNodesItem 以一次 AddNodes 建立全部節點；
+  writable 直接寫在 AccessLevel 屬性，不再每個變數 await 一次 set_writable()。
+  NodeSet2 XML 交給 asyncua 的 XmlImporter 匯入
+- provision()：取代 server.init()，初始化 server、註冊 namespace、建立一個或多個 spec 的節點，回傳 {browse path: Node}
+- 可選的 cache：第一次啟動時把整個 address space（標準節點 + 自訂節點）存成 shelve；之後 spec 沒變就
+  lazy-load（只有被存取的節點才反序列化），連 asyncua 自己建立標準節點的時間都省掉
+
+JSON 格式：
+    {
+      "namespace": "http://examples.freeopcua.github.io",
+      "nodes": [
+        {"name": "SensorData", "children": [
+          {"name": "Weight", "value": 0.0, "type": "Double", "writable": true},
+          {"name": "Tray{i}_vol", "repeat": 4, "start": 1, "value": 0.0, "writable": true}
+        ]}
+      ]
+    }
+  - 有 "value" 或 "type" 的是 variable（type 為 VariantType 名稱，例如 Double / Int32 / Boolean / String，
+    省略時由 value 推斷），其餘是 object；兩者都可以有 "children"
+  - "repeat": N 展開成 N 個節點，name 中的 {i} 依序代入 start..start+N-1（可加格式，例如 "Obj{i:04d}"）
+  - NodeId 固定為 ns=<namespace>;s=<路徑以 "." 串接>（例如 SensorData.Weight），重啟後不變
+  - 最上層節點可加 "parent": "<browse path>"，掛在同一次 provision() 中先前的 spec 已建立的節點底下
+    （例如 {"name": "Avg_1m", "parent": "SensorData/Weight", "type": "Double"}）
+
+用法：
+    space = AddressSpaceSpec.load(ADDRESS_SPACE_FILE, default=DEFAULT_ADDRESS_SPACE)
+    nodes = await provision(server, space, cache=ADDRESS_SPACE_CACHE)
+    var_weight = nodes["SensorData/Weight"]
+"""
+
+import copy
+import hashlib
+import json
+import os
+import pickle
+import shelve
+import time
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import asyncua
+from asyncua import ua
+
+DEFAULT_NAMESPACE = "http://examples.freeopcua.github.io"
+NODESET_NS = "{http://opcfoundation.org/UA/2011/03/UANodeSet.xsd}"
+
+
+class AddressSpaceSpec:
+    """Node tree of the server's own namespace, from a JSON-style dict or a NodeSet2 XML file."""
+
+    def __init__(self, spec: Optional[dict] = None, xml_path=None):
+        self.spec = spec
+        self.xml_path = xml_path
+
+    @classmethod
+    def load(cls, path, default: Optional[dict] = None) -> "AddressSpaceSpec":
+        """Load ``path`` (.json or NodeSet2 .xml); fall back to ``default`` if the file is missing."""
+        if path and os.path.exists(path):
+            if path.lower().endswith(".xml"):
+                print(f"[OK] 載入 address space（NodeSet2）：{path}")
+                return cls(xml_path=path)
+            with open(path, "r", encoding="utf-8") as f:
+                spec = json.load(f)
+            print(f"[OK] 載入 address space 設定：{path}")
+            return cls(spec)
+        return cls(default)
+
+    def key(self) -> str:
+        """Hash of everything the built address space depends on (cache key)."""
+        h = hashlib.sha256(asyncua.__version__.encode())
+        if self.xml_path:
+            with open(self.xml_path, "rb") as f:
+                h.update(f.read())
+        else:
+            h.update(json.dumps(self.spec, sort_keys=True).encode())
+        return h.hexdigest()
+
+    def namespaces(self) -> List[str]:
+        """Namespace URIs to register, in order (their server indexes are passed to nodeids() / items())."""
+        if self.xml_path:
+            root = ET.parse(self.xml_path).getroot()
+            uris = [uri.text for uri in root.iter(f"{NODESET_NS}Uri")]
+            # 與 XmlImporter 相同：開頭是標準 namespace 時略過（asyncua 的 XmlExporter 會把它寫進去）
+            return uris[1:] if uris[:1] == ["http://opcfoundation.org/UA/"] else uris
+        return [self.spec.get("namespace", DEFAULT_NAMESPACE)]
+
+    def walk(self) -> Iterator[Tuple[str, str, dict]]:
+        """Yield ``(path, parent_path, node)`` for every node of a JSON spec, parents first."""
+        def walk(nodes, parent):
+            for node in nodes:
+                count = node.get("repeat")
+                if count is None:
+                    names = [node["name"]]
+                else:
+                    start = node.get("start", 0)
+                    names = [node["name"].format(i=i) for i in range(start, start + count)]
+                for name in names:
+                    path = f"{parent}/{name}" if parent else name
+                    yield path, parent, node
+                    yield from walk(node.get("children", ()), path)
+        for node in self.spec.get("nodes", ()):
+            yield from walk([node], node.get("parent", ""))
+
+    def nodeids(self, indexes: List[int]) -> Dict[str, ua.NodeId]:
+        """{browse path: NodeId} of every object / variable, without creating anything."""
+        if self.xml_path:
+            return _nodeset_paths(self.xml_path, indexes)
+        idx = indexes[0]
+        return {path: ua.NodeId(path.replace("/", "."), idx) for path, _, _ in self.walk()}
+
+    def items(self, indexes: List[int], parents: Optional[Dict[str, ua.NodeId]] = None) -> List[ua.AddNodesItem]:
+        """AddNodesItems for the whole JSON spec, parents before children (``parents``: existing nodes by path)."""
+        idx = indexes[0]
+        items = []
+        own = set()
+        for path, parent, node in self.walk():
+            name = path.rsplit("/", 1)[-1]
+            own.add(path)
+            if parent and parent not in own:
+                # "parent" 指到的既有節點
+                if not parents or parent not in parents:
+                    raise ValueError(f"節點 {path} 的 parent 不存在：{parent}")
+                parent_id = parents[parent]
+                ref = ua.ObjectIds.HasComponent
+            elif parent:
+                parent_id = ua.NodeId(parent.replace("/", "."), idx)
+                ref = ua.ObjectIds.HasComponent
+            else:
+                parent_id = ua.NodeId(ua.ObjectIds.ObjectsFolder)
+                ref = ua.ObjectIds.Organizes
+            nodeid = ua.NodeId(path.replace("/", "."), idx)
+            if "value" in node or "type" in node:
+                items.append(_variable_item(nodeid, ua.QualifiedName(name, idx), parent_id, ref, node))
+            else:
+                items.append(_object_item(nodeid, ua.QualifiedName(name, idx), parent_id, ref))
+        return items
+
+    async def create(self, server, indexes: List[int],
+                     parents: Optional[Dict[str, ua.NodeId]] = None) -> Dict[str, ua.NodeId]:
+        """Create the nodes in ``server`` (one AddNodes call for a JSON spec) and return nodeids()."""
+        if self.xml_path:
+            await server.import_xml(self.xml_path)
+            return self.nodeids(indexes)
+        items = self.items(indexes, parents)
+        results = await server.iserver.isession.add_nodes(items)
+        bad = [(item, r) for item, r in zip(items, results) if not r.StatusCode.is_good()]
+        if bad:
+            item, r = bad[0]
+            raise ValueError(f"{len(bad)} 個節點建立失敗，例如 {item.RequestedNewNodeId.to_string()}：{r.StatusCode}")
+        return self.nodeids(indexes)
+
+
+def _object_item(nodeid, qname, parent_id, ref) -> ua.AddNodesItem:
+    item = ua.AddNodesItem()
+    item.RequestedNewNodeId = nodeid
+    item.BrowseName = qname
+    item.NodeClass = ua.NodeClass.Object
+    item.ParentNodeId = parent_id
+    item.ReferenceTypeId = ua.NodeId(ref)
+    item.TypeDefinition = ua.NodeId(ua.ObjectIds.BaseObjectType)
+    attrs = ua.ObjectAttributes()
+    attrs.EventNotifier = 0
+    attrs.Description = ua.LocalizedText(qname.Name)
+    attrs.DisplayName = ua.LocalizedText(qname.Name)
+    attrs.WriteMask = 0
+    attrs.UserWriteMask = 0
+    item.NodeAttributes = attrs
+    return item
+
+
+def _variable_item(nodeid, qname, parent_id, ref, node) -> ua.AddNodesItem:
+    vtype = getattr(ua.VariantType, node["type"]) if "type" in node else None
+    value = node.get("value")
+    if value is None and vtype is not None:
+        value = ua.get_default_value(vtype)
+    variant = ua.Variant(value, vtype)
+    item = ua.AddNodesItem()
+    item.RequestedNewNodeId = nodeid
+    item.BrowseName = qname
+    item.NodeClass = ua.NodeClass.Variable
+    item.ParentNodeId = parent_id
+    item.ReferenceTypeId = ua.NodeId(ref)
+    item.TypeDefinition = ua.NodeId(ua.ObjectIds.BaseDataVariableType)
+    attrs = ua.VariableAttributes()
+    attrs.Description = ua.LocalizedText(qname.Name)
+    attrs.DisplayName = ua.LocalizedText(qname.Name)
+    attrs.DataType = ua.NodeId(getattr(ua.ObjectIds, variant.VariantType.name))
+    attrs.Value = variant
+    if isinstance(value, (list, tuple)):
+        attrs.ValueRank = ua.ValueRank.OneDimension
+        attrs.ArrayDimensions = [0]
+    else:
+        attrs.ValueRank = ua.ValueRank.Scalar
+    attrs.WriteMask = 0
+    attrs.UserWriteMask = 0
+    attrs.Historizing = False
+    access = ua.AccessLevel.CurrentRead.mask
+    if node.get("writable"):
+        access |= ua.AccessLevel.CurrentWrite.mask
+    attrs.AccessLevel = access
+    attrs.UserAccessLevel = access
+    item.NodeAttributes = attrs
+    return item
+
+
+def _nodeset_paths(path, indexes: List[int]) -> Dict[str, ua.NodeId]:
+    """{browse path: NodeId} of the objects / variables under the Objects folder in a NodeSet2 file."""
+    root = ET.parse(path).getroot()
+    aliases = {a.get("Alias"): a.text for a in root.iter(f"{NODESET_NS}Alias")}
+    nodes = {}
+    for tag in ("UAObject", "UAVariable"):
+        for el in root.iter(f"{NODESET_NS}{tag}"):
+            parent = el.get("ParentNodeId")
+            nodes[el.get("NodeId")] = (el.get("BrowseName").split(":", 1)[-1], aliases.get(parent, parent))
+
+    def remap(text) -> ua.NodeId:
+        # NodeSet2 的 ns=k 指檔案內 NamespaceUris 的第 k 個，換成 server 上的 index
+        nodeid = ua.NodeId.from_string(text)
+        if nodeid.NamespaceIndex:
+            nodeid = ua.NodeId(nodeid.Identifier, indexes[nodeid.NamespaceIndex - 1], nodeid.NodeIdType)
+        return nodeid
+
+    objects = ua.NodeId(ua.ObjectIds.ObjectsFolder)
+    paths = {}
+    for nodeid, (name, parent) in nodes.items():
+        parts = [name]
+        while parent in nodes:
+            name, parent = nodes[parent]
+            parts.append(name)
+        if parent is not None and remap(parent) == objects:
+            paths["/".join(reversed(parts))] = remap(nodeid)
+    return paths
+
+
+# -------------------------
+# Server init + cache
+# -------------------------
+async def provision(server, *spaces: AddressSpaceSpec, cache=None) -> Dict[str, object]:
+    """
+    Initialize ``server`` (instead of ``await server.init()``) and build ``spaces`` in order; return {browse path: Node}.
+
+    cache：shelve 檔案路徑（None = 不使用）。spec（與 asyncua 版本）沒變時直接載入，否則建立後寫入。
+    """
+    key = hashlib.sha256("".join(space.key() for space in spaces).encode()).hexdigest()
+    cached = bool(cache) and _cache_valid(cache, key)
+    start = time.perf_counter()
+    await server.init(Path(cache) if cached else None)
+    nodeids = {}
+    for space in spaces:
+        indexes = [await server.register_namespace(uri) for uri in space.namespaces()]
+        if cached:
+            nodeids.update(space.nodeids(indexes))
+        else:
+            nodeids.update(await space.create(server, indexes, nodeids))
+    nodes = {path: server.get_node(nodeid) for path, nodeid in nodeids.items()}
+    source = "cache" if cached else "建立"
+    print(f"[OK] Address space：{len(nodes)} 個節點（{source}，{time.perf_counter() - start:.2f} s）")
+    if cache and not cached:
+        try:
+            count = save_cache(server, cache, key)
+            print(f"[OK] Address space cache：{count} 個節點 -> {cache}（下次啟動直接載入）")
+        except Exception as e:
+            print(f"[Warning] 無法寫入 address space cache：{e}")
+    return nodes
+
+
+def _meta_path(cache) -> str:
+    return f"{cache}.json"
+
+
+def _cache_valid(cache, key) -> bool:
+    try:
+        with open(_meta_path(cache), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return meta.get("key") == key and (os.path.isfile(cache) or os.path.isfile(f"{cache}.db"))
+
+
+def save_cache(server, cache, key) -> int:
+    """
+    Store the whole address space of an initialized (not yet started) server as a shelve for ``provision``.
+    """
+    cache = str(cache)
+    directory = os.path.dirname(cache)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # 先刪 meta：寫到一半中斷時 cache 一定視為無效
+    for suffix in (".json", "", ".db", ".dat", ".dir", ".bak"):
+        if os.path.exists(cache + suffix):
+            os.remove(cache + suffix)
+    aspace = server.iserver.aspace
+    count = 0
+    with shelve.open(cache, "n", protocol=pickle.HIGHEST_PROTOCOL) as shelf:
+        for nodeid in list(aspace.keys()):
+            ndata = aspace[nodeid]
+            if ndata.call is not None:
+                # method callback 不能序列化；server.init() 會重新掛上標準節點的 callback
+                ndata = copy.copy(ndata)
+                ndata.call = None
+            shelf[nodeid.to_string()] = ndata
+            count += 1
+    if not os.path.isfile(cache) and not os.path.isfile(f"{cache}.db"):
+        # dbm.dumb（Windows 等沒有 gdbm 的環境）只產生 .dat / .dir，asyncua 以 <cache> 檔是否存在判斷有無 shelf
+        open(cache, "wb").close()
+    with open(_meta_path(cache), "w", encoding="utf-8") as f:
+        json.dump({"key": key, "nodes": count, "asyncua": asyncua.__version__}, f)
+    return count
@@ -0,0 +1,200 @@
+# opcua_codec.py
+"""
+Tag selection, content negotiation and compact encodings for the /data endpoint (Flask and aiohttp).
+
+- match_tags()：?tags=weight,tray*,Obj0003/ 的選擇（fnmatch 萬用字元；以 "/" 結尾視為前綴）
+- negotiate()：依 Accept header（或 ?format=）選 JSON / MessagePack / columnar binary
+  （MessagePack 需要 msgpack 套件，沒有安裝時不提供；有 orjson 時 JSON 用它序列化）
+- encode_columnar()：名稱只出現一次，後接 float64 值、float64 時間戳與 quality 三個連續陣列
+- compress()：Accept-Encoding 含 gzip 且 body 超過 COMPRESS_MIN_BYTES 時壓縮
+
+columnar layout（little-endian，陣列皆 8-byte 對齊，瀏覽器可直接 new Float64Array(buf, offset, count)）：
+    header   COLUMNAR_HEADER：magic b"OPCD"、version、flags（bit0 = full）、count、seq、names 區塊長度
+    names    UTF-8，以 "\\n" 分隔，補 0 到 8 的倍數
+    values   float64[count]（非數值 / quality 不是 good 的 tag 為 NaN）
+    times    float64[count]（SourceTimestamp，epoch 秒；沒有為 NaN）
+    quality  uint8[count]（0 = good、1 = uncertain、2 = bad、3 = 無資料）
+"""
+
+import fnmatch
+import gzip
+import json
+import re
+import struct
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import msgpack  # optional：沒有安裝時不提供 application/msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson  # optional：有的話 JSON 序列化快很多
+except ImportError:
+    orjson = None
+
+# ---------- Config ----------
+COMPRESS_MIN_BYTES = 1024  # 小於這個大小不壓縮（壓縮的 header 與 CPU 成本不划算）
+COMPRESS_LEVEL = 5         # gzip level（1 最快、9 最小）
+# ----------------------------
+
+CONTENT_TYPES = {
+    "json": "application/json",
+    "msgpack": "application/msgpack",
+    "columnar": "application/vnd.opcua-fetch.columnar",
+}
+# Accept 中也接受的別名
+_ACCEPT_ALIASES = {
+    "application/json": "json",
+    "application/msgpack": "msgpack",
+    "application/x-msgpack": "msgpack",
+    "application/vnd.msgpack": "msgpack",
+    "application/vnd.opcua-fetch.columnar": "columnar",
+    "application/octet-stream": "columnar",
+}
+COLUMNAR_MAGIC = b"OPCD"
+COLUMNAR_VERSION = 1
+COLUMNAR_HEADER = struct.Struct("<4sHHIQI4x")  # 32 bytes
+QUALITY_CODES = {"good": 0, "uncertain": 1, "bad": 2}
+QUALITY_MISSING = 3
+
+
+class NotAcceptable(ValueError):
+    """Raised when none of the media types in the Accept header can be produced (HTTP 406)."""
+
+
+def available_formats() -> List[str]:
+    return [fmt for fmt in CONTENT_TYPES if fmt != "msgpack" or msgpack is not None]
+
+
+def match_tags(names: Sequence[str], query: str) -> List[str]:
+    """
+    Names selected by a comma-separated ``query`` of exact names, fnmatch patterns (``tray*``) or prefixes
+    ending in ``/``, in the order of ``names``; raise ValueError for a term that matches nothing.
+    """
+    terms = [t.strip() for t in query.split(",") if t.strip()]
+    selected = set()
+    for term in terms:
+        if term.endswith("/"):
+            term += "*"
+        if any(c in term for c in "*?["):
+            # 區分大小寫（fnmatch.filter 在 Windows 會忽略大小寫）
+            pattern = re.compile(fnmatch.translate(term))
+            matched = [name for name in names if pattern.match(name)]
+        else:
+            matched = [term] if term in names else []
+        if not matched:
+            raise ValueError(f"no tag matches {term!r}")
+        selected.update(matched)
+    return [name for name in names if name in selected]
+
+
+def negotiate(accept: Optional[str], fmt: Optional[str] = None) -> str:
+    """
+    Pick the response format: ``fmt`` (?format=) if given, otherwise the Accept media type with the highest q
+    we can produce (earlier wins on ties). No Accept / ``*/*`` -> json.
+    """
+    if fmt:
+        if fmt not in available_formats():
+            raise NotAcceptable(f"unsupported format: {fmt!r} (choose from {', '.join(available_formats())})")
+        return fmt
+    if not accept:
+        return "json"
+    choices = []
+    for i, part in enumerate(accept.split(",")):
+        media, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        media = media.strip().lower()
+        if q <= 0:
+            continue
+        if media in ("*/*", "application/*"):
+            choices.append((-q, i, "json"))
+        elif _ACCEPT_ALIASES.get(media) in available_formats():
+            choices.append((-q, i, _ACCEPT_ALIASES[media]))
+    if not choices:
+        raise NotAcceptable(f"none of {accept!r} is available "
+                            f"({', '.join(CONTENT_TYPES[f] for f in available_formats())})")
+    return min(choices)[2]
+
+
+def encode(body, fmt: str) -> bytes:
+    """Serialize a JSON-style ``body`` as json / msgpack."""
+    if fmt == "msgpack":
+        return msgpack.packb(body, use_bin_type=True, default=str)
+    if orjson is not None:
+        try:
+            return orjson.dumps(body, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(body, separators=(",", ":"), default=str).encode()
+
+
+def _epoch(iso: Optional[str]) -> float:
+    if not iso:
+        return np.nan
+    ts = datetime.fromisoformat(iso)
+    if ts.tzinfo is None:
+        # asyncua 的時間戳是 UTC（沒有 tzinfo 時不能當成本地時間）
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.timestamp()
+
+
+def encode_columnar(entries: Dict[str, Optional[dict]], seq: int, full=True) -> bytes:
+    """Columnar binary body for ``entries`` ({key: snapshot entry or None}), see the module docstring."""
+    names = list(entries)
+    count = len(names)
+    rows = list(entries.values())
+    nan = float("nan")
+    values = np.array([e["value"] if e is not None and e["quality"] == "good" and isinstance(e["value"], (int, float))
+                       else nan for e in rows], dtype=np.float64).reshape(count)
+    quality = np.array([QUALITY_MISSING if e is None else QUALITY_CODES.get(e["quality"], QUALITY_CODES["bad"])
+                        for e in rows], dtype=np.uint8).reshape(count)
+    # 同一次更新的 tag 時間戳大多相同：每個字串只解析一次
+    stamps = [None if e is None else e.get("source_timestamp") for e in rows]
+    epochs = {iso: _epoch(iso) for iso in set(stamps)}
+    times = np.array([epochs[iso] for iso in stamps], dtype=np.float64).reshape(count)
+    blob = "\n".join(names).encode("utf-8")
+    blob += b"\0" * (-len(blob) % 8)
+    header = COLUMNAR_HEADER.pack(COLUMNAR_MAGIC, COLUMNAR_VERSION, 1 if full else 0, count, seq, len(blob))
+    return b"".join((header, blob, values.astype("<f8").tobytes(), times.astype("<f8").tobytes(), quality.tobytes()))
+
+
+def decode_columnar(data: bytes) -> dict:
+    """Inverse of encode_columnar() (Python clients / debugging)."""
+    magic, version, flags, count, seq, names_len = COLUMNAR_HEADER.unpack_from(data)
+    if magic != COLUMNAR_MAGIC or version != COLUMNAR_VERSION:
+        raise ValueError(f"not a columnar /data body (magic {magic!r}, version {version})")
+    offset = COLUMNAR_HEADER.size
+    names = data[offset:offset + names_len].rstrip(b"\0").decode("utf-8").split("\n") if count else []
+    offset += names_len
+    values = np.frombuffer(data, "<f8", count, offset)
+    times = np.frombuffer(data, "<f8", count, offset + 8 * count)
+    quality = np.frombuffer(data, np.uint8, count, offset + 16 * count)
+    return {"seq": seq, "full": bool(flags & 1), "names": names, "values": values, "times": times, "quality": quality}
+
+
+def compress(body: bytes, accept_encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+    """gzip ``body`` if the client accepts it and it is large enough; return (body, Content-Encoding or None)."""
+    if len(body) < COMPRESS_MIN_BYTES or not accept_encoding:
+        return body, None
+    codings = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = params.strip()[2:] if params.strip().startswith("q=") else "1"
+        try:
+            codings[coding.strip().lower()] = float(q)
+        except ValueError:
+            codings[coding.strip().lower()] = 0.0
+    if codings.get("gzip", codings.get("*", 0.0)) <= 0:
+        return body, None
+    return gzip.compress(body, COMPRESS_LEVEL), "gzip"
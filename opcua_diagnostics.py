@@ -0,0 +1,268 @@
+# opcua_diagnostics.py
+"""
+Self-diagnostics of the random-value server as OPC UA variables, plus an on-demand sampling profiler.
+
+- Diagnostics：每 1 / DIAG_RATE_HZ 秒把 server 自己的狀態寫到 m0/Tags/Diagnostics 底下（Double，值有變才寫）：
+    Sessions / Subscriptions / MonitoredItems：目前的 client session、subscription 與 monitored item 數
+    NotificationQueue：subscription 中等待 Publish 的通知數；Unacknowledged：已送出但 client 還沒 ack 的 Publish 結果
+    WriteLatency_ms：這個週期內最長的一次 Write service 呼叫（全部 Simulator）
+    Groups/<group>/TickDuration_ms、Jitter_ms：這個週期內該 group 最長的 tick 執行時間與最大的排程延遲
+                   （實際開始時間 - deadline），Ticks / Missed / Overruns：累計次數
+- SamplingProfiler：背景 thread 以 PROFILE_HZ 取樣 event loop thread 的 call stack（不需要額外套件，
+  也不需要重啟 server），停止時存成 collapsed stack 檔（flamegraph.pl / speedscope 可直接開啟），並印出 self time 最多的函式
+- 開關：寫入 m0/Functions/Profiling = True / False，或送 SIGUSR1（Linux：kill -USR1 <pid>）切換；
+  最多跑 PROFILE_MAX_SECONDS 秒自動停止；以 Ctrl+C 結束 server 時正在跑的 profile 也會存檔
+
+用法：
+    diagnostics = Diagnostics(server, scheduler, simulators, profile_dir="profiles")
+    await diagnostics.create(nodes, rate_hz=1.0)   # 在 provision() 與其他 group 加入之後、server 啟動前
+"""
+
+import os
+import re
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from asyncua import ua
+
+from opcua_addressspace import DEFAULT_NAMESPACE, AddressSpaceSpec
+from opcua_simulator import Simulator, TickScheduler
+
+# ---------- Config ----------
+PROFILE_HZ = float(os.environ.get("PROFILE_HZ", "100"))                   # 取樣頻率
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", "600"))  # 忘了關也會自動停止
+PROFILE_MAX_DEPTH = 128  # 每個 stack 最多記錄幾層
+PROFILE_TOP = 10         # 停止時印出 self time 前幾名
+# ----------------------------
+
+DIAGNOSTICS_PATH = "m0/Tags/Diagnostics"
+PROFILING_SWITCH = "m0/Functions/Profiling"
+SERVER_VALUES = ("Sessions", "Subscriptions", "MonitoredItems", "NotificationQueue", "Unacknowledged",
+                 "WriteLatency_ms")
+GROUP_VALUES = ("TickDuration_ms", "Jitter_ms", "Ticks", "Missed", "Overruns")
+
+
+def server_counts(server) -> Dict[str, int]:
+    """
+    Session / subscription / queue counts from asyncua's internal state.
+
+    asyncua 沒有公開這些數字，讀的是內部屬性；版本不同找不到時該項為 0，不影響 server。
+    """
+    iserver = server.iserver
+    internal = getattr(getattr(iserver, "isession", None), "session_id", None)
+    counts = {"Sessions": len(getattr(iserver, "_external_sessions", {})),
+              "Subscriptions": 0, "MonitoredItems": 0, "NotificationQueue": 0, "Unacknowledged": 0}
+    # server 自己的 subscription（例如 historian）不算
+    for sub in list(getattr(iserver.subscription_service, "subscriptions", {}).values()):
+        if getattr(sub, "session_id", None) == internal:
+            continue
+        counts["Subscriptions"] += 1
+        counts["MonitoredItems"] += len(getattr(sub.monitored_item_srv, "_monitored_items", {}))
+        counts["NotificationQueue"] += (sum(len(q) for q in getattr(sub, "_triggered_datachanges", {}).values())
+                                        + sum(len(q) for q in getattr(sub, "_triggered_events", {}).values())
+                                        + len(getattr(sub, "_triggered_statuschanges", ())))
+        counts["Unacknowledged"] += len(getattr(sub, "_not_acknowledged_results", {}))
+    return counts
+
+
+def node_name(name) -> str:
+    """Scheduler group name as a browse name, e.g. sim@0.5Hz -> sim_0_5Hz."""
+    return re.sub(r"[^0-9A-Za-z_]+", "_", name).strip("_")
+
+
+class SamplingProfiler:
+    """Statistical profiler: a background thread samples the stack of one thread (default: the main thread)."""
+
+    def __init__(self, hz=PROFILE_HZ, thread_id: Optional[int] = None):
+        self.interval = 1.0 / hz
+        self.thread_id = thread_id or threading.main_thread().ident
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started: Optional[float] = None
+        self.stopped: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def elapsed(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.stopped or time.time()) - self.started
+
+    def start(self):
+        if self.running:
+            return
+        self.stacks.clear()
+        self.samples = 0
+        self.started = time.time()
+        self.stopped = None
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.stopped = time.time()
+
+    def _run(self):
+        labels = {}  # code object -> 標籤（同一個函式只格式化一次）
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and len(stack) < PROFILE_MAX_DEPTH:
+                code = frame.f_code
+                label = labels.get(code)
+                if label is None:
+                    label = labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                stack.append(label)
+                frame = frame.f_back
+            del frame
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def top(self, n=PROFILE_TOP) -> List[tuple]:
+        """[(function, self samples)] of the ``n`` functions most often on top of the stack."""
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return leaves.most_common(n)
+
+    def dump(self, path) -> str:
+        """Write the samples as collapsed stacks ("caller;callee count" per line) and return ``path``."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+class Diagnostics:
+    """Publish scheduler / Write / session diagnostics under m0/Tags and drive the profiler switch."""
+
+    def __init__(self, server, scheduler: TickScheduler, simulators: Sequence[Simulator] = (),
+                 profile_dir="profiles", label=""):
+        self.server = server
+        self.scheduler = scheduler
+        self.simulators = list(simulators)
+        self.profile_dir = profile_dir
+        self.label = label  # 加在 profile 檔名上（例如 shard1）
+        self.profiler = SamplingProfiler()
+        self.publisher: Optional[Simulator] = None
+        self.switch: Optional[ua.NodeId] = None
+        self.profile_file: Optional[ua.NodeId] = None
+        self._toggle = False
+
+    def spec(self, existing: Dict[str, object], namespace=DEFAULT_NAMESPACE) -> AddressSpaceSpec:
+        """Diagnostics variables under m0/Tags (and the profiling switch under m0/Functions unless it exists)."""
+        groups = [{"name": node_name(g.name), "children": [{"name": v, "value": 0.0} for v in GROUP_VALUES]}
+                  for g in self.scheduler.groups]
+        nodes = [{"name": "Diagnostics", "parent": "m0/Tags", "children": [
+            *({"name": v, "value": 0.0} for v in SERVER_VALUES),
+            {"name": "ProfileFile", "value": ""},
+            {"name": "Groups", "children": groups},
+        ]}]
+        if PROFILING_SWITCH not in existing:
+            nodes.append({"name": "Profiling", "parent": "m0/Functions", "value": False, "writable": True})
+        return AddressSpaceSpec({"namespace": namespace, "nodes": nodes})
+
+    async def create(self, nodes: Dict[str, object], rate_hz=1.0, namespace=DEFAULT_NAMESPACE) -> bool:
+        """
+        Add the "diagnostics" group (``rate_hz``) to the scheduler and create the nodes of every group;
+        False (nothing added) when m0/Tags or m0/Functions is missing from the address space.
+
+        節點在 provision() 之後另外建立（不進 address space cache），group 的組合改變時不會讓 cache 失效。
+        """
+        missing = [p for p in ("m0/Tags", "m0/Functions") if p not in nodes]
+        if missing:
+            print(f"[Warning] address space 缺少 {', '.join(missing)}，不建立 diagnostics 節點")
+            return False
+        self.scheduler.add_group("diagnostics", rate_hz, self.tick)
+        parents = {path: node.nodeid for path, node in nodes.items()}
+        space = self.spec(nodes, namespace)
+        nodeids = await space.create(self.server, [await self.server.register_namespace(namespace)], parents)
+        self.switch = nodeids.get(PROFILING_SWITCH, parents.get(PROFILING_SWITCH))
+        self.profile_file = nodeids[f"{DIAGNOSTICS_PATH}/ProfileFile"]
+        paths = [f"{DIAGNOSTICS_PATH}/{v}" for v in SERVER_VALUES]
+        paths += [f"{DIAGNOSTICS_PATH}/Groups/{node_name(g.name)}/{v}" for g in self.scheduler.groups
+                  for v in GROUP_VALUES]
+        self.publisher = Simulator(self.server).bind([nodeids[p] for p in paths]).set_deadband()
+        print(f"[OK] Diagnostics：{DIAGNOSTICS_PATH}（{len(paths)} 個變數）；profiler 開關 {PROFILING_SWITCH}"
+              + ("，或 SIGUSR1" if hasattr(signal, "SIGUSR1") else ""))
+        return True
+
+    def request_toggle(self):
+        """Start / stop the profiler on the next tick (signal handler)."""
+        self._toggle = True
+
+    def sample(self) -> np.ndarray:
+        """Current values in publisher order."""
+        counts = server_counts(self.server)
+        latency = max((sim.take_latency() for sim in self.simulators), default=0.0)
+        values = [counts[v] for v in SERVER_VALUES[:-1]] + [latency * 1000.0]
+        for group in self.scheduler.groups:
+            duration, lateness = group.take_peaks()
+            values += [duration * 1000.0, lateness * 1000.0, group.ticks, group.missed, group.overruns]
+        return np.array(values, dtype=np.float64)
+
+    async def tick(self, t):
+        await self._update_profiler()
+        if self.publisher is not None:
+            await self.publisher.write(self.sample())
+
+    async def _update_profiler(self):
+        running = self.profiler.running
+        wanted = running
+        if self.switch is not None:
+            value = self.server.read_attribute_value(self.switch).Value
+            wanted = bool(value.Value) if value is not None else False
+        if self._toggle:
+            self._toggle = False
+            wanted = not running
+        if running and wanted and self.profiler.elapsed() >= PROFILE_MAX_SECONDS:
+            print(f"[Warning] profiler 已跑 {PROFILE_MAX_SECONDS:g} 秒，自動停止")
+            wanted = False
+        if wanted == running:
+            return
+        if wanted:
+            self.profiler.start()
+            print(f"[OK] Profiler 開始（{PROFILE_HZ:g} Hz 取樣）")
+        else:
+            await self._write(self.profile_file, self.stop_profiler(), ua.VariantType.String)
+        await self._write(self.switch, wanted, ua.VariantType.Boolean)
+
+    def stop_profiler(self) -> Optional[str]:
+        """Stop the profiler (if running), dump it under profile_dir and return the file path."""
+        if not self.profiler.running:
+            return None
+        self.profiler.stop()
+        suffix = f"-{self.label}" if self.label else ""
+        path = os.path.join(self.profile_dir, f"profile-{time.strftime('%Y%m%d-%H%M%S')}{suffix}.folded")
+        try:
+            self.profiler.dump(path)
+        except OSError as e:
+            print(f"[Error] 無法寫入 profile：{e}")
+            return None
+        print(f"[OK] Profiler 停止：{self.profiler.samples} 個取樣（{self.profiler.elapsed():.1f} s）-> {path}")
+        for label, count in self.profiler.top():
+            print(f"    {count / max(self.profiler.samples, 1):6.1%}  {label}")
+        return path
+
+    async def _write(self, nodeid, value, variant_type):
+        if nodeid is None or value is None:
+            return
+        await self.server.write_attribute_value(nodeid, ua.DataValue(ua.Variant(value, variant_type)))
@@ -0,0 +1,400 @@
+# opcua_gateway.py
+"""
+Fan-out gateway over many OPC UA endpoints (one controller / server each).
+
+- Endpoint：一個 server 的 OpcuaSession + TagMap + TagSubscription + CircuitBreaker；
+  波形（array）tag 另有一個 TagMap（waves），不進 subscription / /data，只在被要求時讀取；
+  rolling statistics（每個 tag 底下的 Avg_1m 等子節點）同樣另有一個 TagMap（stats），key 為 "<tag>/<子節點名稱>"
+- Gateway：同時對所有 endpoint 讀取（各自的 timeout），合併成一個 namespaced view：
+  key 為 "<endpoint>/<tag>"（只有一個未命名 endpoint 時就是 tag 本身，與單一 server 時相同）
+- CircuitBreaker：連續失敗達門檻就 open，期間直接回傳錯誤不再等待；reset_timeout 後放一個 request 試探
+
+一台 PLC 掛掉只會讓它自己的 tag 變成 None（quality "bad"），不會拖慢其他 endpoint 的回應。
+prefix=False 的 endpoint（例如同一個模擬的各個 shard，見 opcua_shards.py）key 不加 endpoint 名稱，
+多個 endpoint 合起來就像一台 server（key 不可重複）。
+
+endpoint 設定檔（JSON list，預設 opcua_endpoints.json）：
+    [
+      {"name": "line1", "url": "opc.tcp://10.0.0.11:4840/freeopcua/server/",
+       "tags": {"weight": "0:Objects/2:SensorData/2:Weight"}, "timeout": 2.0},
+      {"name": "line2", "url": "opc.tcp://10.0.0.12:4840/freeopcua/server/", "tags": "line2_tags.json",
+       "waves": {"weight": "0:Objects/2:Waveform/2:Weight"}}
+    ]
+    tags / waves 可以是 dict、tag 設定檔路徑，或省略（使用預設）
+"""
+
+import asyncio
+import concurrent.futures
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+from opcua_session import (
+    REQUEST_TIMEOUT, STATE_CONNECTING, STATE_IDLE, OpcuaSession, TagMap, TagSubscription, datavalue_entry,
+    is_connection_error, load_tags, parse_browse_path,
+)
+
+# ---------- Config ----------
+BREAKER_FAILURES = 3         # 連續失敗幾次就 open
+BREAKER_RESET_TIMEOUT = 10.0  # open 後多久放一個 request 試探（秒）
+KEY_SEPARATOR = "/"          # namespaced key：<endpoint>/<tag>
+WAVE_INTERVAL = "SampleInterval"  # 波形變數底下記錄取樣間隔（秒）的子節點
+# ----------------------------
+
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"
+BREAKER_HALF_OPEN = "half_open"
+
+
+class CircuitOpen(ConnectionError):
+    """Raised instead of calling an endpoint whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=BREAKER_FAILURES, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = BREAKER_CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.opened_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """True if a request may be sent now (closed, or the single half-open probe)."""
+        with self._lock:
+            if self.state == BREAKER_CLOSED:
+                return True
+            if self.state == BREAKER_OPEN and time.time() - self.opened_at >= self.reset_timeout:
+                self.state = BREAKER_HALF_OPEN
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            if self.state != BREAKER_CLOSED:
+                print(f"[OK] endpoint {self.name}: circuit closed")
+            self.state = BREAKER_CLOSED
+            self.failures = 0
+
+    def failure(self, error):
+        with self._lock:
+            self.failures += 1
+            self.last_error = f"{type(error).__name__}: {error}"
+            if self.state == BREAKER_HALF_OPEN or (self.state == BREAKER_CLOSED
+                                                  and self.failures >= self.failure_threshold):
+                if self.state == BREAKER_CLOSED:
+                    self.trips += 1
+                    print(f"[Warning] endpoint {self.name}: 連續失敗 {self.failures} 次，circuit open"
+                          f"（{self.reset_timeout:g}s 後重試）：{self.last_error}")
+                self.state = BREAKER_OPEN
+                self.opened_at = time.time()
+
+    def status(self) -> dict:
+        return {"state": self.state, "failures": self.failures, "trips": self.trips, "last_error": self.last_error}
+
+
+class Endpoint:
+    """One OPC UA server: session, tag map, subscription snapshot and circuit breaker."""
+
+    def __init__(self, name, url, tags: Dict[str, Sequence[str]], timeout=REQUEST_TIMEOUT, session_name="gateway",
+                 waves: Optional[Dict[str, Sequence[str]]] = None, stats: Sequence[str] = (), prefix=True,
+                 stat_tags: Optional[Sequence[str]] = None):
+        self.name = name
+        self.prefix = prefix
+        self.url = url
+        self.timeout = float(timeout)
+        self.label = name or "default"  # metrics / log 用
+        self.session = OpcuaSession(url, timeout=self.timeout,
+                                    name=f"{session_name}[{name}]" if name else session_name)
+        self.tags = TagMap(tags)
+        self.session.add_on_connect(self.tags.refresh)
+        self.subscription = TagSubscription(self.session, self.tags).attach()
+        # 波形 tag（連同 SampleInterval 子節點，"<tag>/SampleInterval"）第一次讀取時才解析，
+        # server 沒有這些節點時不會每次連線都警告
+        self.wave_tags = list(waves or {})
+        self.waves = TagMap(_with_children(waves or {}, [WAVE_INTERVAL]))
+        # rolling statistics：每個 tag（或 stat_tags 指定的 tag）底下名稱為 stats 的子節點（同樣第一次讀取時才解析）
+        self.stat_names = list(stats)
+        self.stat_tags = [t for t in (tags if stat_tags is None else stat_tags) if t in tags] if self.stat_names else []
+        self.stats = TagMap(_with_children({t: tags[t] for t in self.stat_tags}, self.stat_names, parents=False))
+        self.breaker = CircuitBreaker(self.label)
+
+    def key(self, tag) -> str:
+        return f"{self.name}{KEY_SEPARATOR}{tag}" if self.name and self.prefix else tag
+
+    @property
+    def keys(self) -> List[str]:
+        return [self.key(tag) for tag in self.tags.names]
+
+    def namespaced(self, entries: Dict[str, Optional[dict]]) -> Dict[str, Optional[dict]]:
+        return {self.key(tag): e for tag, e in entries.items()} if self.name and self.prefix else dict(entries)
+
+    def error_entries(self, error: str, tagmap: Optional[TagMap] = None) -> Dict[str, dict]:
+        now = time.time()
+        names = (tagmap or self.tags).names
+        return {self.key(tag): {"value": None, "quality": "bad", "source_timestamp": None, "server_timestamp": None,
+                                "received_at": now, "error": error} for tag in names}
+
+    def snapshot(self) -> Dict[str, Optional[dict]]:
+        return self.namespaced(self.subscription.get(self.tags.names))
+
+    def fresh(self, max_staleness) -> bool:
+        age = self.subscription.age()
+        return age is not None and age <= max_staleness
+
+    async def read(self, timeout=None, tagmap: Optional[TagMap] = None) -> Dict[str, Optional[dict]]:
+        """
+        One batched Read of all tags (or all entries of ``tagmap``, e.g. stats) on this endpoint's session loop,
+        bounded by ``timeout`` (default / upper limit: the endpoint timeout).
+        """
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        tagmap = tagmap or self.tags
+        if not tagmap.names:
+            return {}
+
+        async def read_entries():
+            # 正在連線時最多等到 timeout；已知斷線（等待重連中）則直接失敗，不拖慢其他 endpoint
+            if self.session.state in (STATE_IDLE, STATE_CONNECTING):
+                await self.session.wait_connected_async(timeout)
+            result = await self.session.call(tagmap.read)
+            return {tag: datavalue_entry(dv) for tag, dv in result.items()}
+
+        return self.namespaced(await asyncio.wait_for(read_entries(), timeout))
+
+    def status(self) -> dict:
+        status = self.session.status()
+        status["tags"] = {self.key(tag): nodeid.to_string() for tag, nodeid in self.tags.nodeids.items()}
+        status["snapshot_age"] = self.subscription.age()
+        status["notifications"] = self.subscription.notifications
+        status["breaker"] = self.breaker.status()
+        return status
+
+
+class Gateway:
+    """Merged, namespaced view over several Endpoints, read concurrently with per-endpoint timeouts."""
+
+    def __init__(self, endpoints: Sequence[Endpoint]):
+        names = [ep.name for ep in endpoints]
+        if len(endpoints) > 1 and (not all(names) or len(set(names)) != len(names)):
+            raise ValueError("multiple endpoints need unique, non-empty names")
+        self.endpoints = list(endpoints)
+        self._by_key: Dict[str, tuple] = {}
+        self._by_wave_key: Dict[str, tuple] = {}
+        self._stat_keys: List[str] = []
+        for ep in self.endpoints:
+            for tag in ep.tags.names:
+                key = ep.key(tag)
+                if key in self._by_key:
+                    raise ValueError(f"tag {key} is defined by endpoints {self._by_key[key][0].label} and {ep.label}")
+                self._by_key[key] = (ep, tag)
+            for tag in ep.wave_tags:
+                self._by_wave_key[ep.key(tag)] = (ep, tag)
+            self._stat_keys.extend(ep.key(tag) for tag in ep.stat_tags)
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._by_key)
+
+    @property
+    def wave_names(self) -> List[str]:
+        return list(self._by_wave_key)
+
+    @property
+    def stat_names(self) -> List[str]:
+        """Keys of the tags that have rolling statistics."""
+        return list(self._stat_keys)
+
+    def find(self, key, waves=False):
+        """Return ``(endpoint, tag)`` for a namespaced (waveform) key, or ``(None, None)``."""
+        return (self._by_wave_key if waves else self._by_key).get(key, (None, None))
+
+    def add_listener(self, callback: Callable[[Dict[str, dict]], None]):
+        """Subscription changes of every endpoint, with namespaced keys."""
+        for ep in self.endpoints:
+            ep.subscription.add_listener(lambda changes, ep=ep: callback(ep.namespaced(changes)))
+
+    # -------------------------
+    # Lifecycle
+    # -------------------------
+    def start(self):
+        """Start every session on its own background loop (sync servers, e.g. Flask)."""
+        for ep in self.endpoints:
+            ep.session.start()
+        return self
+
+    async def start_async(self):
+        """Run every session on the current loop (async servers, e.g. aiohttp)."""
+        for ep in self.endpoints:
+            await ep.session.start_async()
+        return self
+
+    async def stop_async(self):
+        await asyncio.gather(*(ep.session.stop_async() for ep in self.endpoints))
+
+    def wait_connected(self, timeout):
+        """Wait until every endpoint is connected, at most ``timeout`` seconds in total."""
+        deadline = time.time() + timeout
+        for ep in self.endpoints:
+            ep.session.wait_connected(max(deadline - time.time(), 0))
+
+    async def wait_connected_async(self, timeout):
+        await asyncio.gather(*(ep.session.wait_connected_async(timeout) for ep in self.endpoints))
+
+    # -------------------------
+    # Reads
+    # -------------------------
+    def split_fresh(self, max_staleness, endpoints: Optional[Sequence[Endpoint]] = None):
+        """Split ``endpoints`` (default: all) into (subscription snapshot is fresh, needs a direct read)."""
+        fresh, stale = [], []
+        for ep in self.endpoints if endpoints is None else endpoints:
+            (fresh if ep.fresh(max_staleness) else stale).append(ep)
+        return fresh, stale
+
+    def snapshot(self, endpoints: Optional[Sequence[Endpoint]] = None) -> Dict[str, Optional[dict]]:
+        result = {}
+        for ep in self.endpoints if endpoints is None else endpoints:
+            result.update(ep.snapshot())
+        return result
+
+    def read(self, endpoints: Optional[Sequence[Endpoint]] = None, stats=False) -> Dict[str, Optional[dict]]:
+        """
+        Read ``endpoints`` (default: all) concurrently from a sync thread; blocks at most the longest timeout.
+        stats=True：讀取 rolling statistics 子節點（key 為 "<tag>/<stat>"）而不是 tag 本身。
+        """
+        endpoints = self.endpoints if endpoints is None else endpoints
+        result, futures = {}, {}
+        for ep in endpoints:
+            tagmap = ep.stats if stats else ep.tags
+            if not ep.breaker.allow():
+                result.update(ep.error_entries(f"circuit open: {ep.breaker.last_error}", tagmap))
+                continue
+            ep.session.start()
+            futures[ep] = asyncio.run_coroutine_threadsafe(ep.read(tagmap=tagmap), ep.session.loop)
+        if futures:
+            concurrent.futures.wait(list(futures.values()), timeout=max(ep.timeout for ep in futures) + 0.5)
+        for ep, fut in futures.items():
+            try:
+                entries = fut.result(timeout=0)
+            except Exception as e:
+                fut.cancel()
+                result.update(self._failed(ep, e, ep.stats if stats else ep.tags))
+            else:
+                ep.breaker.success()
+                result.update(entries)
+        return result
+
+    async def read_async(self, endpoints: Optional[Sequence[Endpoint]] = None, timeout=None,
+                         stats=False) -> Dict[str, Optional[dict]]:
+        """Same as read() for sessions running on the current loop; ``timeout`` caps every endpoint timeout."""
+        endpoints = self.endpoints if endpoints is None else endpoints
+        result, calls = {}, []
+        for ep in endpoints:
+            if ep.breaker.allow():
+                calls.append(ep)
+            else:
+                result.update(ep.error_entries(f"circuit open: {ep.breaker.last_error}", ep.stats if stats else None))
+        outcomes = await asyncio.gather(*(ep.read(timeout, ep.stats if stats else None) for ep in calls),
+                                        return_exceptions=True)
+        for ep, outcome in zip(calls, outcomes):
+            if isinstance(outcome, BaseException):
+                result.update(self._failed(ep, outcome, ep.stats if stats else None))
+            else:
+                ep.breaker.success()
+                result.update(outcome)
+        return result
+
+    @staticmethod
+    def _failed(ep: Endpoint, error, tagmap: Optional[TagMap] = None) -> Dict[str, dict]:
+        if isinstance(error, (asyncio.TimeoutError, concurrent.futures.TimeoutError)):
+            error = TimeoutError("no response within the endpoint timeout")
+        ep.breaker.failure(error)
+        return ep.error_entries(f"{type(error).__name__}: {error}", tagmap)
+
+    @staticmethod
+    def _settle(ep: Endpoint, error):
+        """Count a failed on-demand call against the breaker only if the endpoint did not answer."""
+        if is_connection_error(error) or isinstance(error, concurrent.futures.TimeoutError):
+            ep.breaker.failure(error)
+        else:
+            # endpoint 有回應，只是這個 request 失敗（例如波形節點不存在、不支援 HistoryRead）：不算 endpoint 故障
+            ep.breaker.success()
+
+    def call(self, key, fn, waves=False):
+        """
+        Run ``fn(client, tagmap, tag)`` on the endpoint owning ``key`` (sync), through its breaker.
+        waves=True：key 是波形 tag，tagmap 為該 endpoint 的 waves。
+        """
+        ep, tag = self.find(key, waves)
+        tagmap = ep.waves if waves else ep.tags
+        if not ep.breaker.allow():
+            raise CircuitOpen(f"endpoint {ep.label} circuit open: {ep.breaker.last_error}")
+        try:
+            result = ep.session.run(lambda client: fn(client, tagmap, tag))
+        except Exception as e:
+            self._settle(ep, e)
+            raise
+        ep.breaker.success()
+        return result
+
+    async def call_async(self, key, fn, waves=False):
+        ep, tag = self.find(key, waves)
+        tagmap = ep.waves if waves else ep.tags
+        if not ep.breaker.allow():
+            raise CircuitOpen(f"endpoint {ep.label} circuit open: {ep.breaker.last_error}")
+        try:
+            result = await ep.session.call(lambda client: fn(client, tagmap, tag))
+        except Exception as e:
+            self._settle(ep, e)
+            raise
+        ep.breaker.success()
+        return result
+
+    def status(self) -> dict:
+        return {ep.label: ep.status() for ep in self.endpoints}
+
+
+def _with_children(tags: Dict[str, Sequence[str]], children: Sequence[str], parents=True) -> Dict[str, List[str]]:
+    """Browse paths of ``<tag>/<child>`` for every child (same namespace as the tag), plus the tags if ``parents``."""
+    paths = {}
+    for tag, path in tags.items():
+        path = parse_browse_path(path)
+        ns = path[-1].split(":", 1)[0] if ":" in path[-1] else "0"
+        if parents:
+            paths[tag] = path
+        for child in children:
+            paths[f"{tag}/{child}"] = path + [f"{ns}:{child}"]
+    return paths
+
+
+def load_endpoints(path, default_url, default_tags: Dict[str, Sequence[str]], session_name="gateway",
+                   default_waves: Optional[Dict[str, Sequence[str]]] = None, stats: Sequence[str] = ()) -> List[Endpoint]:
+    """
+    Build Endpoints from a JSON list (see module docstring); without the file, one unnamed endpoint
+    at ``default_url`` with ``default_tags`` / ``default_waves`` (same keys as a single-server setup).
+    stats：每個 tag 底下 rolling statistics 子節點的名稱（所有 endpoint 相同）。
+    """
+    if not path or not os.path.exists(path):
+        return [Endpoint("", default_url, default_tags, session_name=session_name, waves=default_waves, stats=stats)]
+    with open(path, encoding="utf-8") as f:
+        raw = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    endpoints = []
+
+    def tag_config(value, default):
+        if value is None:
+            return default
+        if isinstance(value, str):
+            return load_tags(os.path.join(base, value), default)
+        return {name: parse_browse_path(p) for name, p in value.items()}
+
+    for item in raw:
+        endpoints.append(Endpoint(item.get("name", ""), item["url"], tag_config(item.get("tags"), default_tags),
+                                  timeout=item.get("timeout", REQUEST_TIMEOUT), session_name=session_name,
+                                  waves=tag_config(item.get("waves"), default_waves), stats=stats))
+    print(f"[OK] 載入 endpoint 設定：{path}（{len(endpoints)} 個 endpoint）")
+    return endpoints
@@ -0,0 +1,241 @@
+# opcua_historian.py
+"""
+Bounded on-disk history for historized OPC UA variables.
+
+- RingBuffer：每個 tag 一個固定大小的 memory-mapped 檔案（timestamp / value / status），
+  寫滿後覆蓋最舊的資料，磁碟與記憶體用量固定；以 np.searchsorted 做時間區間查詢
+- RingHistory：asyncua 的 HistoryStorageInterface 實作，server 的 HistoryRead 直接由它回應
+- downsample()：把大量原始資料壓成 min / max / avg bucket（給 /history 使用）
+
+用法（server 端）：
+    history = RingHistory(HISTORY_DIR, capacity=HISTORY_CAPACITY)
+    server.iserver.history_manager.set_storage(history)
+    ...
+    async with server:
+        await historize(server, {"Weight": var_weight, ...})
+"""
+
+import dataclasses
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from asyncua import ua
+from asyncua.server.history import HistoryStorageInterface
+
+MAGIC = b"OPCHIST1"
+HEADER_SIZE = 64
+HEADER_DTYPE = np.dtype([("magic", "S8"), ("capacity", "<u8"), ("head", "<u8"), ("count", "<u8")])
+RECORD_DTYPE = np.dtype([("t", "<f8"), ("v", "<f8"), ("s", "<u4")])
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# asyncua 1.x 的 DataValue 欄位叫 StatusCode_，較新版本叫 StatusCode
+_STATUS_FIELD = "StatusCode_" if "StatusCode_" in {f.name for f in dataclasses.fields(ua.DataValue)} else "StatusCode"
+
+
+def to_epoch(dt: Optional[datetime]) -> Optional[float]:
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return (dt - EPOCH).total_seconds()
+
+
+def from_epoch(t: float) -> datetime:
+    return EPOCH + timedelta(seconds=float(t))
+
+
+class RingBuffer:
+    """Fixed-capacity, append-only time series stored in one memory-mapped file."""
+
+    def __init__(self, path, capacity):
+        self.path = path
+        exists = os.path.exists(path)
+        if exists:
+            header = np.memmap(path, dtype=HEADER_DTYPE, mode="r+", shape=(1,))
+            if header["magic"][0] != MAGIC:
+                raise ValueError(f"Not a history ring file: {path}")
+            capacity = int(header["capacity"][0])
+        else:
+            with open(path, "wb") as f:
+                f.truncate(HEADER_SIZE + capacity * RECORD_DTYPE.itemsize)
+            header = np.memmap(path, dtype=HEADER_DTYPE, mode="r+", shape=(1,))
+            header["magic"][0] = MAGIC
+            header["capacity"][0] = capacity
+        self.header = header
+        self.capacity = capacity
+        self.records = np.memmap(path, dtype=RECORD_DTYPE, mode="r+", offset=HEADER_SIZE, shape=(capacity,))
+
+    def __len__(self):
+        return int(self.header["count"][0])
+
+    def append(self, t, v, s=0):
+        head = int(self.header["head"][0])
+        self.records[head] = (t, v, s)
+        self.header["head"][0] = (head + 1) % self.capacity
+        self.header["count"][0] = min(len(self) + 1, self.capacity)
+
+    def _segments(self):
+        """Return the stored records as up to two time-ordered slices (oldest first)."""
+        count, head = len(self), int(self.header["head"][0])
+        if count < self.capacity:
+            return [self.records[:count]]
+        return [self.records[head:], self.records[:head]]
+
+    def query(self, t0=None, t1=None) -> np.ndarray:
+        """Records with t0 <= t <= t1 (None = open ended), oldest first, as a copied array."""
+        parts = []
+        for seg in self._segments():
+            ts = seg["t"]
+            lo = 0 if t0 is None else np.searchsorted(ts, t0, side="left")
+            hi = len(seg) if t1 is None else np.searchsorted(ts, t1, side="right")
+            if hi > lo:
+                parts.append(np.array(seg[lo:hi]))
+        if not parts:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        return np.concatenate(parts)
+
+    def flush(self):
+        self.header.flush()
+        self.records.flush()
+
+
+def _safe_name(name) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", str(name)).strip("_")
+
+
+class RingHistory(HistoryStorageInterface):
+    """
+    asyncua history backend: one RingBuffer per historized node, so disk / memory use stays bounded.
+    """
+
+    def __init__(self, directory, capacity=604800, max_history_data_response_size=10000):
+        super().__init__(max_history_data_response_size)
+        self.directory = directory
+        self.capacity = capacity
+        self.names: Dict[ua.NodeId, str] = {}
+        self.buffers: Dict[ua.NodeId, RingBuffer] = {}
+
+    def register_name(self, node_id: ua.NodeId, name: str):
+        """Use ``name`` (instead of the NodeId string) as the file name for this node."""
+        self.names[node_id] = _safe_name(name)
+
+    async def init(self):
+        os.makedirs(self.directory, exist_ok=True)
+
+    async def new_historized_node(self, node_id, period, count=0):
+        # set_storage() 通常在 server.init() 之後才呼叫，init() 不一定會被呼叫到
+        os.makedirs(self.directory, exist_ok=True)
+        name = self.names.get(node_id) or _safe_name(node_id.to_string())
+        path = os.path.join(self.directory, f"{name}.ring")
+        self.buffers[node_id] = RingBuffer(path, count or self.capacity)
+
+    async def save_node_value(self, node_id, datavalue):
+        buf = self.buffers.get(node_id)
+        if buf is None:
+            return
+        try:
+            value = float(datavalue.Value.Value)
+        except (TypeError, ValueError, AttributeError):
+            value = float("nan")
+        t = to_epoch(datavalue.SourceTimestamp or datavalue.ServerTimestamp or datetime.now(timezone.utc))
+        status = datavalue.StatusCode.value if datavalue.StatusCode is not None else 0
+        buf.append(t, value, status)
+
+    def query(self, node_id, t0=None, t1=None) -> np.ndarray:
+        buf = self.buffers.get(node_id)
+        return buf.query(t0, t1) if buf is not None else np.empty(0, dtype=RECORD_DTYPE)
+
+    async def read_node_history(self, node_id, start, end, nb_values):
+        cont = None
+        if node_id not in self.buffers:
+            return [], cont
+        t0, t1 = to_epoch(start), to_epoch(end)
+        win_epoch = to_epoch(ua.get_win_epoch())
+        # 與 asyncua HistoryDict 相同的語意：start/end 為 win epoch（未指定）時代表開放區間
+        t0 = None if t0 is None or t0 == win_epoch else t0
+        t1 = None if t1 is None or t1 == win_epoch else t1
+        reverse = False
+        if t0 is None and t1 is not None:
+            reverse = True
+        elif t0 is not None and t1 is not None and t0 > t1:
+            t0, t1, reverse = t1, t0, True
+        elif t0 is None and t1 is None:
+            reverse = True
+        records = self.query(node_id, t0, t1)
+        if reverse:
+            records = records[::-1]
+        if nb_values and len(records) > nb_values:
+            records = records[:nb_values]
+        if len(records) > self.max_history_data_response_size:
+            cont = from_epoch(records[self.max_history_data_response_size]["t"])
+            records = records[:self.max_history_data_response_size]
+        return [_datavalue(r) for r in records], cont
+
+    async def new_historized_event(self, source_id, evtypes, period, count=0):
+        # 只存 data change；event 歷史不支援（save_event 忽略、read_event_history 回傳空的）
+        print(f"[Warning] Historian：不支援 event 歷史，{source_id} 的 event 不會被保存")
+
+    async def save_event(self, event):
+        pass
+
+    async def read_event_history(self, source_id, start, end, nb_values, evfilter):
+        return [], None
+
+    async def stop(self):
+        for buf in self.buffers.values():
+            buf.flush()
+
+
+def _datavalue(record) -> ua.DataValue:
+    ts = from_epoch(record["t"])
+    kwargs = {_STATUS_FIELD: ua.StatusCode(int(record["s"])), "SourceTimestamp": ts, "ServerTimestamp": ts}
+    return ua.DataValue(ua.Variant(float(record["v"]), ua.VariantType.Double), **kwargs)
+
+
+async def historize(server, nodes_by_name: Dict[str, object], history: Optional[RingHistory] = None,
+                    period=timedelta(days=7), count=0):
+    """Register readable file names and start historizing ``{name: node}`` on ``server``."""
+    history = history or server.iserver.history_manager.storage
+    if isinstance(history, RingHistory):
+        for name, node in nodes_by_name.items():
+            history.register_name(node.nodeid, name)
+    await server.historize_node_data_change(list(nodes_by_name.values()), period=period, count=count)
+
+
+# -------------------------
+# Downsampling
+# -------------------------
+def downsample(t: np.ndarray, v: np.ndarray, t0: float, t1: float, max_points: int) -> Tuple[str, List[dict]]:
+    """
+    Return ``("raw", [{t, value}])`` if there are at most ``max_points`` samples,
+    otherwise ``("buckets", [{t, min, max, avg, count}])`` with ``max_points`` equal-width time buckets.
+    """
+    if len(t) <= max_points:
+        return "raw", [{"t": float(ti), "value": (None if np.isnan(vi) else float(vi))}
+                       for ti, vi in zip(t.tolist(), v.tolist())]
+    edges = np.linspace(t0, t1, max_points + 1)
+    starts = np.searchsorted(t, edges[:-1], side="left")
+    ends = np.searchsorted(t, edges[1:], side="left")
+    ends[-1] = len(t)
+    counts = ends - starts
+    keep = counts > 0
+    starts, counts, bucket_t = starts[keep], counts[keep], edges[:-1][keep]
+    # 相鄰且非空的 bucket 之間不會有資料，reduceat 的區段剛好就是各 bucket
+    vmin = np.fmin.reduceat(v, starts)
+    vmax = np.fmax.reduceat(v, starts)
+    valid = ~np.isnan(v)
+    vsum = np.add.reduceat(np.where(valid, v, 0.0), starts)
+    nvalid = np.add.reduceat(valid.astype(np.int64), starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg = vsum / nvalid
+    return "buckets", [
+        {"t": float(bt), "min": _num(mn), "max": _num(mx), "avg": _num(av), "count": int(c)}
+        for bt, mn, mx, av, c in zip(bucket_t.tolist(), vmin.tolist(), vmax.tolist(), avg.tolist(), counts.tolist())
+    ]
+
+
+def _num(x):
+    return None if x != x else x  # NaN -> None
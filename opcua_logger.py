@@ -0,0 +1,481 @@
+# opcua_logger.py
+"""
+High-throughput logging of subscription notifications: bounded in-memory buffer, batched writes, rotation.
+
+- BatchSubscription：asyncua Subscription，一個 Publish response 的全部 DataChange 通知一次轉成 NumPy 陣列
+  （asyncua 的 handler 模式每個通知建立一個 task、約 12 µs；這裡每個通知不到 1 µs）
+- SampleBuffer：預先配置的 (tag, t, value, quality) 陣列（雙緩衝），session loop 寫入、writer thread 整批取走
+- DataLogger：writer thread 每 FLUSH_INTERVAL 秒（或累積 FLUSH_ROWS 筆）把 buffer 一次寫成一個 transaction / chunk，
+  檔案超過 ROTATE_BYTES 或開啟超過 ROTATE_SECONDS 秒就換新檔
+- 背壓：buffer 滿時 put() 在 publish callback 裡等待，asyncua 在 callback 結束前不會送下一個 Publish request，
+  通知留在 server 端的 monitored item queue，而不是讓 logger 的記憶體無限成長
+- 兩種儲存格式：
+    SqliteSink：samples(tag_id, t, value, quality) + tags(id, name)，WAL、一個 flush 一個 transaction；
+                insert 時不建索引，換檔時才建立 (tag_id, t) 索引
+    ColumnarSink（.opclog）：append-only 的 columnar chunk，格式見下；可直接 np.frombuffer / memmap 讀取
+
+.opclog 格式（little-endian）：
+    header（64 bytes）：magic "OPCLOG01"、meta_len（uint64）
+    meta（JSON：names / created / source），補 0 到 8 的倍數
+    chunk：count（uint64）、tag uint32[count]、t float64[count]、value float64[count]、quality uint8[count]，
+           每個陣列補 0 到 8 的倍數；寫到一半中斷的最後一個 chunk 讀取時略過
+quality：0 = good、1 = uncertain、2 = bad（與 /data 的 columnar 格式相同）；非數值的 value 存成 NaN（SQLite 為 NULL）
+
+查看：
+    python opcua_logger.py info logs/datafetch-20260101-120000.opclog
+"""
+
+import argparse
+import asyncio
+import copy
+import json
+import os
+import sqlite3
+import struct
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from asyncua import ua
+from asyncua.common.subscription import Subscription
+
+from opcua_historian import to_epoch
+
+# ---------- Config ----------
+BUFFER_ROWS = 1_000_000        # buffer 容量（筆）；雙緩衝，每筆 21 bytes × 2
+FLUSH_ROWS = 100_000           # 累積這麼多筆就立即寫入
+FLUSH_INTERVAL = 1.0           # 最多每幾秒寫入一次（秒）
+ROTATE_BYTES = 256 * 1024 ** 2  # 檔案超過這個大小就換新檔
+ROTATE_SECONDS = 3600.0        # 檔案開啟超過這麼久就換新檔（秒）
+BACKPRESSURE_POLL = 0.05       # buffer 滿時多久檢查一次是否有空間（秒）
+MAX_NOTIFICATIONS_PER_PUBLISH = 65536  # 一個 Publish response 最多帶幾個通知（越大 round-trip 越少）
+# ----------------------------
+
+LOG_MAGIC = b"OPCLOG01"
+LOG_HEADER = struct.Struct("<8sQ48x")  # 64 bytes
+CHUNK_HEADER = struct.Struct("<Q")
+SAMPLE_DTYPES = (np.uint32, np.float64, np.float64, np.uint8)  # tag, t, value, quality
+
+
+def _pad(n) -> int:
+    return -n % 8
+
+
+# -------------------------
+# Subscription
+# -------------------------
+class BatchSubscription(Subscription):
+    """
+    Subscription handing all DataChange notifications of a publish response to ``on_batch`` at once,
+    as ``(tags, t, values, quality)`` arrays; status changes still go to ``handler``.
+    """
+
+    def __init__(self, server, params, handler, index: Dict[ua.NodeId, int], on_batch):
+        super().__init__(server, params, handler)
+        self.index = index        # NodeId -> logger 的 tag index
+        self.on_batch = on_batch  # async (tags, t, values, quality)
+        self.columns: Dict[int, int] = {}  # client handle -> tag index
+        self.samples = 0
+
+    async def publish_callback(self, publish_result):
+        message = publish_result.NotificationMessage
+        rest = []
+        for notification in message.NotificationData or ():
+            if isinstance(notification, ua.DataChangeNotification):
+                batch = self.decode(notification.MonitoredItems, time.time())
+                self.samples += len(batch[0])
+                # buffer 滿時在這裡等待：下一個 Publish request 延後送出（背壓）
+                await self.on_batch(*batch)
+            else:
+                rest.append(notification)
+        # 其餘通知（status change）與 sequence number 等記錄交給 asyncua；不能改原本的 result，ack 依它決定
+        forwarded = copy.copy(publish_result)
+        forwarded.NotificationMessage = copy.copy(message)
+        forwarded.NotificationMessage.NotificationData = rest if message.NotificationData is not None else None
+        await super().publish_callback(forwarded)
+
+    def _column(self, handle) -> int:
+        data = self._monitored_items.get(handle)
+        column = self.index.get(data.node.nodeid, -1) if data is not None and data.node is not None else -1
+        if column >= 0:
+            self.columns[handle] = column
+        return column
+
+    def decode(self, items, received_at) -> Tuple[np.ndarray, ...]:
+        """MonitoredItemNotifications -> (tags, t, values, quality) arrays (unknown handles dropped)."""
+        columns = self.columns
+        tags = np.array([columns[it.ClientHandle] if it.ClientHandle in columns else self._column(it.ClientHandle)
+                         for it in items], dtype=np.int64)
+        dvs = [it.Value for it in items]
+        raw = [dv.Value.Value if dv.Value is not None else None for dv in dvs]
+        try:
+            values = np.array(raw, dtype=np.float64)
+        except (TypeError, ValueError):
+            # 字串 / array 等非數值：存 NaN
+            values = np.array([float(v) if isinstance(v, (int, float)) else np.nan for v in raw])
+        t = np.array([to_epoch(dv.SourceTimestamp or dv.ServerTimestamp) or received_at for dv in dvs])
+        codes = np.array([dv.StatusCode.value if dv.StatusCode is not None else 0 for dv in dvs], dtype=np.uint32)
+        # StatusCode severity（bit 30-31）：0 good、1 uncertain、2 / 3 bad
+        quality = np.minimum(codes >> 30, 2).astype(np.uint8)
+        keep = tags >= 0
+        if not keep.all():
+            return tags[keep], t[keep], values[keep], quality[keep]
+        return tags, t, values, quality
+
+
+async def create_batch_subscription(client, interval_ms, handler, index: Dict[ua.NodeId, int],
+                                    on_batch) -> BatchSubscription:
+    """Same parameters as ``client.create_subscription()``, but with a BatchSubscription."""
+    params = ua.CreateSubscriptionParameters()
+    params.RequestedPublishingInterval = interval_ms
+    params.RequestedLifetimeCount = 10000
+    params.RequestedMaxKeepAliveCount = client.get_keepalive_count(interval_ms)
+    params.MaxNotificationsPerPublish = MAX_NOTIFICATIONS_PER_PUBLISH
+    params.PublishingEnabled = True
+    params.Priority = 0
+    # asyncua 2.x 的 Subscription 接 session，1.x 接 uaclient
+    subscription = BatchSubscription(getattr(client.uaclient, "session", client.uaclient), params, handler, index,
+                                     on_batch)
+    await subscription.init()
+    return subscription
+
+
+# -------------------------
+# Buffer
+# -------------------------
+class SampleBuffer:
+    """Bounded double buffer of samples: put() from any thread, take() from the single writer thread."""
+
+    def __init__(self, capacity=BUFFER_ROWS):
+        self.capacity = int(capacity)
+        self._arrays = [[np.empty(self.capacity, dtype) for dtype in SAMPLE_DTYPES] for _ in range(2)]
+        self._active = 0
+        self._n = 0
+        self._lock = threading.Lock()
+        self.ready = threading.Event()  # 累積到 flush_rows 時通知 writer
+        self.flush_rows = FLUSH_ROWS
+        self.peak = 0
+
+    def __len__(self):
+        return self._n
+
+    def put(self, tags, t, values, quality, start=0) -> int:
+        """Copy samples ``start:`` into the buffer as far as they fit; return how many were taken."""
+        with self._lock:
+            count = min(len(tags) - start, self.capacity - self._n)
+            if count > 0:
+                end = self._n + count
+                for array, column in zip(self._arrays[self._active], (tags, t, values, quality)):
+                    array[self._n:end] = column[start:start + count]
+                self._n = end
+                self.peak = max(self.peak, end)
+            if self._n >= self.flush_rows:
+                self.ready.set()
+            return max(count, 0)
+
+    def take(self) -> Tuple[np.ndarray, ...]:
+        """Swap buffers and return views of the filled part (valid until the next take())."""
+        with self._lock:
+            arrays, n = self._arrays[self._active], self._n
+            self._active ^= 1
+            self._n = 0
+            self.ready.clear()
+        return tuple(array[:n] for array in arrays)
+
+
+# -------------------------
+# Sinks
+# -------------------------
+class SqliteSink:
+    """SQLite file: one transaction per flush; the (tag_id, t) index is built when the file is closed."""
+
+    suffix = ".sqlite"
+
+    def __init__(self, path, names: Sequence[str], meta: Optional[dict] = None):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        try:
+            self._init(names, meta)
+        except Exception:
+            self.conn.close()
+            raise
+
+    def _init(self, names, meta):
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS tags (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS samples "
+                              "(tag_id INTEGER NOT NULL, t REAL NOT NULL, value REAL, quality INTEGER NOT NULL)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self.conn.executemany("INSERT OR REPLACE INTO tags VALUES (?, ?)", enumerate(names))
+            self.conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                                  [(k, json.dumps(v, ensure_ascii=False)) for k, v in (meta or {}).items()])
+
+    @property
+    def size(self) -> int:
+        return sum(os.path.getsize(p) for p in (self.path, self.path + "-wal") if os.path.exists(p))
+
+    def write(self, tags, t, values, quality):
+        # NaN 由 sqlite3 存成 NULL
+        with self.conn:
+            self.conn.executemany("INSERT INTO samples VALUES (?, ?, ?, ?)",
+                                  zip(tags.tolist(), t.tolist(), values.tolist(), quality.tolist()))
+
+    def close(self):
+        with self.conn:
+            self.conn.execute("CREATE INDEX IF NOT EXISTS samples_tag_t ON samples (tag_id, t)")
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.conn.close()
+
+
+class ColumnarSink:
+    """Append-only .opclog file: one columnar chunk per flush (see the module docstring)."""
+
+    suffix = ".opclog"
+
+    def __init__(self, path, names: Sequence[str], meta: Optional[dict] = None):
+        self.path = path
+        meta = dict(meta or {})
+        meta["names"] = list(names)
+        meta_bytes = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+        self._file = open(path, "wb")
+        self._file.write(LOG_HEADER.pack(LOG_MAGIC, len(meta_bytes)))
+        self._file.write(meta_bytes + b"\0" * _pad(len(meta_bytes)))
+        self._file.flush()
+        self.size = self._file.tell()
+
+    def write(self, tags, t, values, quality):
+        parts = [CHUNK_HEADER.pack(len(tags))]
+        for column, dtype in zip((tags, t, values, quality), SAMPLE_DTYPES):
+            data = np.asarray(column, dtype=np.dtype(dtype).newbyteorder("<")).tobytes()
+            parts += [data, b"\0" * _pad(len(data))]
+        chunk = b"".join(parts)
+        self._file.write(chunk)
+        self._file.flush()
+        self.size += len(chunk)
+
+    def close(self):
+        self._file.close()
+
+
+SINKS = {"sqlite": SqliteSink, "columnar": ColumnarSink}
+
+
+def read_log_meta(path) -> Tuple[dict, int]:
+    """(meta, offset of the first chunk) of a .opclog file."""
+    with open(path, "rb") as f:
+        magic, meta_len = LOG_HEADER.unpack(f.read(LOG_HEADER.size))
+        if magic != LOG_MAGIC:
+            raise ValueError(f"Not a .opclog file: {path}")
+        meta = json.loads(f.read(meta_len).decode("utf-8"))
+    return meta, LOG_HEADER.size + meta_len + _pad(meta_len)
+
+
+def iter_log_chunks(path) -> Iterator[Tuple[np.ndarray, ...]]:
+    """Yield ``(tags, t, values, quality)`` per chunk of a .opclog file (views of a memmap)."""
+    _, offset = read_log_meta(path)
+    size = os.path.getsize(path)
+    if size <= offset:
+        return
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    while offset + CHUNK_HEADER.size <= size:
+        (count,) = CHUNK_HEADER.unpack_from(data, offset)
+        pos = offset + CHUNK_HEADER.size
+        columns = []
+        for dtype in SAMPLE_DTYPES:
+            nbytes = count * np.dtype(dtype).itemsize
+            columns.append(np.frombuffer(data, np.dtype(dtype).newbyteorder("<"), count, pos)
+                           if pos + nbytes <= size else None)
+            pos += nbytes + _pad(nbytes)
+        if pos > size or any(c is None for c in columns):
+            # 寫到一半中斷的 chunk
+            return
+        yield tuple(columns)
+        offset = pos
+
+
+def read_log(path) -> dict:
+    """Whole .opclog file as {"names", "tags", "t", "values", "quality"} (concatenated copies)."""
+    meta, _ = read_log_meta(path)
+    chunks = list(iter_log_chunks(path))
+    columns = [np.concatenate([c[i] for c in chunks]) if chunks else np.empty(0, dtype)
+               for i, dtype in enumerate(SAMPLE_DTYPES)]
+    return dict(zip(("tags", "t", "values", "quality"), columns), names=meta["names"], meta=meta)
+
+
+# -------------------------
+# Writer
+# -------------------------
+class DataLogger:
+    """Buffer + writer thread + rotating sink files under ``directory``."""
+
+    def __init__(self, names: Sequence[str], directory, fmt="sqlite", prefix="datafetch", meta: Optional[dict] = None,
+                 capacity=BUFFER_ROWS, flush_interval=FLUSH_INTERVAL, rotate_bytes=ROTATE_BYTES,
+                 rotate_seconds=ROTATE_SECONDS):
+        if fmt not in SINKS:
+            raise ValueError(f"Unknown log format: {fmt} (choose from {', '.join(SINKS)})")
+        self.names = list(names)
+        self.directory = directory
+        self.sink_class = SINKS[fmt]
+        self.prefix = prefix
+        self.meta = dict(meta or {})
+        self.buffer = SampleBuffer(capacity)
+        self.flush_interval = flush_interval
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.sink = None
+        self.opened_at = 0.0
+        self.files: List[str] = []
+        self.received = 0
+        self.written = 0
+        self.flushes = 0
+        self.last_flush = 0.0       # 最近一次寫入花的時間（秒）
+        self.backpressure = 0.0     # 因 buffer 滿而等待的累計時間（秒）
+        self.errors = 0
+        self.dropped = 0            # 寫入失敗或 writer thread 已結束而丟棄的筆數
+        self._writer_lost = False
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="datafetch-writer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=30.0):
+        """Write what is buffered, close the current file and stop the writer thread."""
+        self._stopping.set()
+        self.buffer.ready.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+
+    @property
+    def writing(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    async def put(self, tags, t, values, quality):
+        """Add a batch from a session loop; waits (backpressure) while the buffer is full."""
+        self.received += len(tags)
+        done = self.buffer.put(tags, t, values, quality)
+        if done < len(tags):
+            waited = time.perf_counter()
+            self.buffer.ready.set()
+            while done < len(tags) and not self._stopping.is_set():
+                if not self.writing:
+                    # writer thread 已結束：不再等（否則 publish callback 永遠卡住），剩下的丟棄並計數
+                    if not self._writer_lost:
+                        self._writer_lost = True
+                        print("[Error] datafetch：writer thread 已結束，buffer 滿時丟棄新資料")
+                    self.dropped += len(tags) - done
+                    break
+                await asyncio.sleep(BACKPRESSURE_POLL)
+                done += self.buffer.put(tags, t, values, quality, start=done)
+            self.backpressure += time.perf_counter() - waited
+
+    def stats(self) -> dict:
+        return {"received": self.received, "written": self.written, "buffered": len(self.buffer),
+                "buffer_peak": self.buffer.peak, "flushes": self.flushes, "last_flush": self.last_flush,
+                "backpressure": self.backpressure, "errors": self.errors, "dropped": self.dropped,
+                "file": self.sink.path if self.sink else None}
+
+    def _open(self):
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(self.directory, f"{self.prefix}-{stamp}{self.sink_class.suffix}")
+        n = 1
+        while os.path.exists(path):
+            path = os.path.join(self.directory, f"{self.prefix}-{stamp}-{n}{self.sink_class.suffix}")
+            n += 1
+        meta = {**self.meta, "created": datetime.now(timezone.utc).isoformat()}
+        self.sink = self.sink_class(path, self.names, meta)
+        self.opened_at = time.time()
+        self.files.append(path)
+        print(f"[OK] datafetch：寫入 {path}")
+
+    def _close(self):
+        """Close the current file; a failing close (e.g. disk full while indexing) is logged, not raised."""
+        sink, self.sink = self.sink, None
+        if sink is None:
+            return
+        start = time.perf_counter()
+        try:
+            sink.close()
+        except Exception as e:
+            self.errors += 1
+            print(f"[Error] datafetch：關閉 {sink.path} 失敗：{e}")
+            return
+        print(f"[OK] datafetch：關閉 {sink.path}（{time.perf_counter() - start:.2f} s）")
+
+    def _flush(self):
+        batch = self.buffer.take()
+        count = len(batch[0])
+        if not count:
+            return
+        start = time.perf_counter()
+        try:
+            if self.sink is None:
+                self._open()
+            self.sink.write(*batch)
+        except Exception as e:
+            # 開檔 / 寫入失敗（例如磁碟滿）：這批丟棄並記錄，下次 flush 換新檔再試
+            self.errors += 1
+            self.dropped += count
+            print(f"[Error] datafetch：寫入 {count} 筆失敗：{e}")
+            self._close()
+            return
+        self.written += count
+        self.flushes += 1
+        self.last_flush = time.perf_counter() - start
+        if self.sink.size >= self.rotate_bytes or time.time() - self.opened_at >= self.rotate_seconds:
+            self._close()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self.buffer.ready.wait(self.flush_interval)
+            try:
+                self._flush()
+                if self.sink is not None and time.time() - self.opened_at >= self.rotate_seconds:
+                    self._close()
+            except Exception as e:
+                # writer thread 不能結束（put() 靠它騰出空間）：記錄後繼續
+                self.errors += 1
+                print(f"[Error] datafetch：writer 失敗：{e}")
+        try:
+            self._flush()
+        finally:
+            self._close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect datafetch log files (.opclog / .sqlite)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    info = sub.add_parser("info", help="print a summary of a log file")
+    info.add_argument("path")
+    args = parser.parse_args()
+    if args.path.endswith(SqliteSink.suffix):
+        conn = sqlite3.connect(args.path)
+        names = [name for _, name in conn.execute("SELECT id, name FROM tags ORDER BY id")]
+        rows, t0, t1 = conn.execute("SELECT COUNT(*), MIN(t), MAX(t) FROM samples").fetchone()
+        conn.close()
+    else:
+        log = read_log(args.path)
+        names, rows = log["names"], len(log["t"])
+        t0, t1 = (float(log["t"].min()), float(log["t"].max())) if rows else (None, None)
+    span = (t1 - t0) if rows else 0.0
+    print(json.dumps({
+        "path": args.path,
+        "rows": rows,
+        "tags": len(names),
+        "start": datetime.fromtimestamp(t0, timezone.utc).isoformat() if rows else None,
+        "duration_s": span,
+        "samples_per_s": rows / span if span > 0 else None,
+        "bytes": os.path.getsize(args.path),
+    }, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
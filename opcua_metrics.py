@@ -0,0 +1,205 @@
+# opcua_metrics.py
+"""
+Minimal, low-overhead Prometheus-style metrics (Counter / Gauge / Histogram) and text exposition.
+
+不依賴 prometheus_client：每次 observe 只有一次 bisect + 一次加法（持 lock），
+開著也不會影響負載下的效能。/metrics 以 REGISTRY.render() 輸出 text format 0.0.4。
+
+用法：
+    REQUESTS = Counter("http_requests_total", "HTTP requests", ("endpoint",))
+    REQUESTS.inc(endpoint="/data")
+    LATENCY = Histogram("opcua_operation_seconds", "OPC UA op latency", ("op",))
+    with LATENCY.time(op="read"):
+        ...
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# 預設 latency bucket（秒）：0.5 ms ~ 10 s
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels_text(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List["_Metric"] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in list(self.metrics):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames: Sequence[str] = (), registry: Optional[Registry] = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels) -> Tuple:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(labels[n] for n in self.labelnames)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self._header() + [f"{self.name}{_labels_text(self.labelnames, k)} {_num(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+        self._functions: Dict[Tuple, Callable[[], Optional[float]]] = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount=1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn: Callable[[], Optional[float]], **labels):
+        """Evaluate ``fn()`` at render time (None = omit the sample)."""
+        self._functions[self._key(labels)] = fn
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, fn in list(self._functions.items()):
+            try:
+                value = fn()
+            except Exception:
+                value = None
+            if value is not None:
+                items.append((key, value))
+        return self._header() + [f"{self.name}{_labels_text(self.labelnames, k)} {_num(v)}" for k, v in items]
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames: Sequence[str] = (), buckets=DEFAULT_BUCKETS,
+                 registry: Optional[Registry] = REGISTRY):
+        super().__init__(name, documentation, labelnames, registry)
+        self.bounds = tuple(sorted(buckets))
+        # key -> [per-bucket counts..., +Inf count, sum]
+        self._series: Dict[Tuple, List[float]] = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect_left(self.bounds, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.bounds) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def time(self, **labels) -> _Timer:
+        return _Timer(self, labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._series.items()]
+        lines = self._header()
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.bounds + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = 'le="' + _num(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels_text(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels_text(self.labelnames, key)} {_num(series[-1])}")
+            lines.append(f"{self.name}_count{_labels_text(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+# -------------------------
+# Shared OPC UA client metrics（opcua_session 使用）
+# -------------------------
+OPCUA_OP_SECONDS = Histogram("opcua_operation_seconds", "OPC UA client operation latency in seconds", ("op",))
+OPCUA_ERRORS = Counter("opcua_errors_total", "OPC UA client errors by operation and exception type",
+                       ("op", "exception"))
+NODEID_CACHE = Counter("opcua_nodeid_cache_total", "NodeId cache lookups on read (hit / miss)", ("result",))
@@ -0,0 +1,307 @@
+# opcua_recorder.py
+"""
+Record SensorData streams into a compact columnar binary file and replay them.
+
+檔案格式（.rec，little-endian）：
+    header（64 bytes）：magic "OPCREC01" / block_rows / n_cols / count / meta_len
+    meta（JSON，names / paths / source / created），補齊到 64 bytes 的倍數
+    data：連續的 block，每個 block 為 (1 + n_tags) 個 column × block_rows 個 float64
+          column 0 = timestamp（epoch 秒），column 1.. = 各 tag 的值
+    每個 block 內是 columnar，整個檔案可直接 np.memmap 成 (n_blocks, n_cols, block_rows) 陣列，
+    錄製 / 讀取都不會為每個 sample 產生 Python 物件（未滿的最後一個 block 以 NaN 補齊）
+
+- Recorder：append(t, values) 寫入記憶體中的 block，滿了（或 flush()）才寫檔
+- Recording：以 memmap 開啟錄製檔，依 block 讀出 (t, values)
+- replay()：以 1×、N× 或越快越好（speed=0）的速度，把錄製檔逐列交給 write callback
+
+錄製（client 端，對任何 OPC UA server 訂閱）：
+    python opcua_recorder.py record --out recordings/line1.rec [--url ...] [--tags-file opcua_tags.json]
+查看：
+    python opcua_recorder.py info recordings/line1.rec
+重播：由 OPCUA_local_RandomValue_serve.py 以 REPLAY_FILE / REPLAY_SPEED 環境變數執行
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from opcua_historian import to_epoch
+
+MAGIC = b"OPCREC01"
+HEADER_SIZE = 64
+HEADER_DTYPE = np.dtype([("magic", "S8"), ("block_rows", "<u8"), ("n_cols", "<u8"), ("count", "<u8"),
+                         ("meta_len", "<u8")])
+COUNT_OFFSET = 24  # header 中 count 欄位的 byte offset
+ALIGN = 64
+
+# ---------- Config ----------
+BLOCK_ROWS = 1024       # 每個 block 的列數（越大寫檔次數越少，未 flush 時遺失的資料也越多）
+FLUSH_INTERVAL = 5.0    # Recorder 至少每幾秒把未滿的 block 寫進檔案（秒）
+REPORT_INTERVAL = 10.0  # replay 進度多久印一次（秒）
+# ----------------------------
+
+
+def _data_offset(meta_len) -> int:
+    return int(math.ceil((HEADER_SIZE + meta_len) / ALIGN) * ALIGN)
+
+
+class Recorder:
+    """Append-only writer: rows go into an in-memory columnar block, written out one block at a time."""
+
+    def __init__(self, path, names: Sequence[str], block_rows=BLOCK_ROWS, meta: Optional[dict] = None):
+        self.path = path
+        self.names = list(names)
+        self.block_rows = int(block_rows)
+        self.n_cols = len(self.names) + 1
+        meta = dict(meta or {})
+        meta.setdefault("created", datetime.now(timezone.utc).isoformat())
+        meta["names"] = self.names
+        meta_bytes = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+        self.data_offset = _data_offset(len(meta_bytes))
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "wb+")
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header["magic"], header["block_rows"], header["n_cols"] = MAGIC, self.block_rows, self.n_cols
+        header["meta_len"] = len(meta_bytes)
+        self._file.write(header.tobytes().ljust(HEADER_SIZE, b"\0"))
+        self._file.write(meta_bytes.ljust(self.data_offset - HEADER_SIZE, b"\0"))
+
+        self.count = 0  # 已 append 的列數
+        self._buf = np.full((self.n_cols, self.block_rows), np.nan)
+        self._row = 0   # 目前 block 內的位置
+        self._lock = threading.Lock()
+        self._flushed_at = time.time()
+
+    def append(self, t, values):
+        """Add one row: ``t`` (epoch seconds) and ``values`` aligned with ``names``."""
+        with self._lock:
+            self._buf[0, self._row] = t
+            self._buf[1:, self._row] = values
+            self._row += 1
+            self.count += 1
+            if self._row == self.block_rows:
+                self._write_block()
+                self._buf.fill(np.nan)
+                self._row = 0
+            elif time.time() - self._flushed_at >= FLUSH_INTERVAL:
+                self._write_block()
+
+    def flush(self):
+        with self._lock:
+            if self._row:
+                self._write_block()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+    def _write_block(self):
+        # 目前 block 的位置：以「已完整寫入的 block 數」決定；未滿的 block 之後會在同一位置覆寫
+        block = (self.count - self._row) // self.block_rows
+        self._file.seek(self.data_offset + block * self.n_cols * self.block_rows * 8)
+        self._file.write(self._buf.astype("<f8", copy=False).tobytes())
+        self._file.seek(COUNT_OFFSET)
+        self._file.write(np.uint64(self.count).tobytes())
+        self._file.flush()
+        self._flushed_at = time.time()
+
+
+class Recording:
+    """Memory-mapped, read-only view of a .rec file."""
+
+    def __init__(self, path):
+        self.path = path
+        header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+        if len(header) == 0 or header["magic"][0] != MAGIC:
+            raise ValueError(f"Not a recording file: {path}")
+        self.block_rows = int(header["block_rows"][0])
+        self.n_cols = int(header["n_cols"][0])
+        self.count = int(header["count"][0])
+        meta_len = int(header["meta_len"][0])
+        with open(path, "rb") as f:
+            f.seek(HEADER_SIZE)
+            self.meta = json.loads(f.read(meta_len).decode("utf-8"))
+        self.names: List[str] = self.meta["names"]
+        n_blocks = int(math.ceil(self.count / self.block_rows))
+        self.blocks = np.memmap(path, dtype="<f8", mode="r", offset=_data_offset(meta_len),
+                                shape=(n_blocks, self.n_cols, self.block_rows)) if n_blocks else \
+            np.empty((0, self.n_cols, self.block_rows))
+
+    def __len__(self):
+        return self.count
+
+    def iter_blocks(self) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Yield ``(t[k], values[k, n_tags])`` per block (views into the memmap, last block trimmed)."""
+        for b in range(len(self.blocks)):
+            rows = min(self.block_rows, self.count - b * self.block_rows)
+            block = self.blocks[b]
+            yield block[0, :rows], block[1:, :rows].T
+
+    def column(self, name) -> np.ndarray:
+        """All samples of one tag as a contiguous array (copied)."""
+        c = self.names.index(name) + 1
+        return self.blocks[:, c, :].reshape(-1)[:self.count].copy()
+
+    @property
+    def t(self) -> np.ndarray:
+        return self.blocks[:, 0, :].reshape(-1)[:self.count].copy()
+
+    def info(self) -> dict:
+        t = self.t
+        span = float(t[-1] - t[0]) if len(t) > 1 else 0.0
+        return {
+            "path": self.path,
+            "rows": self.count,
+            "tags": self.names,
+            "start": datetime.fromtimestamp(t[0], timezone.utc).isoformat() if len(t) else None,
+            "duration_s": span,
+            "rate_hz": (len(t) - 1) / span if span > 0 else None,
+            "bytes": os.path.getsize(self.path),
+            "meta": {k: v for k, v in self.meta.items() if k != "names"},
+        }
+
+
+async def replay(recording: Recording, write: Callable[[np.ndarray], Awaitable[None]], speed=1.0, loop=False,
+                 report_interval=REPORT_INTERVAL):
+    """
+    Call ``await write(values_row)`` for every recorded row, paced by the recorded timestamps / ``speed``.
+
+    speed=1 為原速、N 為 N 倍速、0 為越快越好（不等待，但每列仍讓出 event loop）。
+    以絕對 deadline 排程：寫入較慢時不會累積漂移，落後時直接追趕。
+    """
+    if len(recording) == 0:
+        print(f"[Warning] 錄製檔沒有資料：{recording.path}")
+        return
+    aio_loop = asyncio.get_running_loop()
+    rows_done, passes = 0, 0
+    reported_at = started = aio_loop.time()
+    while True:
+        start = aio_loop.time()
+        t_first = None
+        for t_block, values_block in recording.iter_blocks():
+            if t_first is None:
+                t_first = float(t_block[0])
+            for t, values in zip(t_block.tolist(), values_block):
+                if speed > 0:
+                    delay = start + (t - t_first) / speed - aio_loop.time()
+                    await asyncio.sleep(max(delay, 0))
+                else:
+                    await asyncio.sleep(0)
+                await write(values)
+                rows_done += 1
+                now = aio_loop.time()
+                if now - reported_at >= report_interval:
+                    print(f"[OK] replay：{rows_done} 列，{rows_done / (now - started):.0f} rows/s")
+                    reported_at = now
+        passes += 1
+        if not loop:
+            break
+    elapsed = aio_loop.time() - started
+    print(f"[OK] replay 結束：{rows_done} 列（{passes} 次），{elapsed:.1f}s")
+
+
+# -------------------------
+# Client-side recording
+# -------------------------
+DEFAULT_URL = "opc.tcp://localhost:4840/freeopcua/server/"
+DEFAULT_TAGS = {
+    name: ["0:Objects", "2:SensorData", f"2:{name}"]
+    for name in ("Temperature", "Weight", "Tray1_vol", "Tray2_vol", "Tray3_vol", "Tray4_vol")
+}
+
+
+class SubscriptionRecorder:
+    """
+    Feed a Recorder from TagSubscription notifications: one row per publish response.
+
+    同一個 publish response 的 datachange 會在同一輪 event loop 內連續送達，
+    以 call_soon 在該輪結束時寫入一列（每個 tag 取最新值），而不是每個通知一列。
+    """
+
+    def __init__(self, recorder: Recorder, tag_names: Sequence[str], loop: asyncio.AbstractEventLoop):
+        self.recorder = recorder
+        self.index = {name: i for i, name in enumerate(tag_names)}
+        self.values = np.full(len(tag_names), np.nan)
+        self.loop = loop
+        self._pending = False
+        self._t = None
+
+    def on_change(self, changes: Dict[str, dict]):
+        for name, entry in changes.items():
+            i = self.index.get(name)
+            if i is None or entry is None:
+                continue
+            value = entry["value"]
+            self.values[i] = float(value) if isinstance(value, (int, float)) and entry["quality"] == "good" else np.nan
+            ts = entry["source_timestamp"]
+            t = to_epoch(datetime.fromisoformat(ts)) if ts else entry["received_at"]
+            self._t = t if self._t is None else max(self._t, t)
+        if not self._pending:
+            self._pending = True
+            self.loop.call_soon(self._commit)
+
+    def _commit(self):
+        self._pending = False
+        self.recorder.append(self._t, self.values)
+        self._t = None
+
+
+def record_main(args):
+    from opcua_session import OpcuaSession, TagMap, TagSubscription, load_tags
+
+    tags = load_tags(args.tags_file, DEFAULT_TAGS) if args.tags_file else DEFAULT_TAGS
+    # column 名稱用 browse name（例如 Weight），重播時才能對應回 SensorData 的變數
+    names = list(tags)
+    columns = [str(path[-1]).split(":", 1)[-1] for path in tags.values()]
+    session = OpcuaSession(args.url, name="recorder")
+    tagmap = TagMap(tags)
+    session.add_on_connect(tagmap.refresh)
+    subscription = TagSubscription(session, tagmap, interval_ms=args.interval_ms).attach()
+    recorder = Recorder(args.out, columns, meta={"source": "client", "url": args.url,
+                                                 "paths": ["/".join(p) for p in tags.values()]})
+    session.start()
+    sub_recorder = SubscriptionRecorder(recorder, names, session.loop)
+    subscription.add_listener(sub_recorder.on_change)
+    print(f"[OK] 錄製 {len(names)} 個 tag -> {args.out}（Ctrl+C 結束）")
+    deadline = time.time() + args.duration if args.duration else None
+    try:
+        while deadline is None or time.time() < deadline:
+            time.sleep(max(min(1.0, deadline - time.time()), 0) if deadline else 1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        session.stop()
+        recorder.close()
+        print(f"[OK] 錄製結束：{recorder.count} 列 -> {args.out}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record / inspect SensorData recordings (.rec)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rec = sub.add_parser("record", help="subscribe to an OPC UA server and record its tags")
+    rec.add_argument("--url", default=DEFAULT_URL)
+    rec.add_argument("--out", required=True)
+    rec.add_argument("--tags-file", help="JSON {name: browse path}（預設 SensorData 的 6 個變數）")
+    rec.add_argument("--interval-ms", type=int, default=100, help="subscription publishing interval")
+    rec.add_argument("--duration", type=float, default=0, help="seconds to record (0 = until Ctrl+C)")
+    info = sub.add_parser("info", help="print a summary of a recording")
+    info.add_argument("path")
+    args = parser.parse_args()
+    if args.command == "record":
+        record_main(args)
+    else:
+        print(json.dumps(Recording(args.path).info(), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
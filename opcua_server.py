@@ -3,10 +3,13 @@
 # 提供變數：Temperature (°C), Weight (g), Tray1~Tray4_vol (ml)
 # 預設為 No-Security endpoint（開發測試最簡單）
 # 若要開啟 Security，將 USE_SECURITY = True 並提供憑證與私鑰路徑
+# 節點由 address space 設定一次建立（預設見 DEFAULT_ADDRESS_SPACE，可用 JSON / NodeSet2 XML 覆寫，見 opcua_addressspace.py）
 
 import os
 import asyncio
 from asyncua import Server, ua
+from opcua_addressspace import AddressSpaceSpec, provision
+from opcua_historian import RingHistory, historize
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -15,11 +18,34 @@ USE_SECURITY = False  # <- 改成 True 可啟用 server 端憑證/安全端點
 # 若 USE_SECURITY == True，請指定以下兩個檔案路徑（可用 openssl 產生）
 CERT_PATH = os.path.join(BASE_DIR, "server_cert.der")   # 可以是 .der 或 .pem
 PRIVATE_KEY_PATH = os.path.join(BASE_DIR, "server_key.pem")
+
+# 歷史資料（Historian）：OPCUA_HISTORY=1 時把 SensorData 變數存進固定大小的環狀檔案，並支援 HistoryRead
+HISTORIZE = os.environ.get("OPCUA_HISTORY", "0") == "1"
+HISTORY_DIR = os.environ.get("OPCUA_HISTORY_DIR", os.path.join(BASE_DIR, "history"))
+HISTORY_CAPACITY = int(os.environ.get("OPCUA_HISTORY_CAPACITY", "604800"))  # 每個 tag 最多幾筆（1 Hz 約一週）
+
+# Address space：OPCUA_ADDRESS_SPACE_FILE 指到的 JSON / NodeSet2 XML 存在時取代下面的預設
+# 允許 Client 寫入（writable）
+DEFAULT_ADDRESS_SPACE = {
+    "namespace": "http://examples.freeopcua.github.io",
+    "nodes": [
+        {"name": "SensorData", "children": [
+            {"name": "Temperature", "value": 0.0, "writable": True},
+            {"name": "Weight", "value": 0.0, "writable": True},
+            {"name": "Tray{i}_vol", "repeat": 4, "start": 1, "value": 0.0, "writable": True},
+        ]},
+    ],
+}
+ADDRESS_SPACE_FILE = os.environ.get("OPCUA_ADDRESS_SPACE_FILE", os.path.join(BASE_DIR, "opcua_nodes.json"))
+# 整個 address space 的快取檔（例如 cache/address_space），設定沒變時重啟直接載入；未設定則每次重建
+ADDRESS_SPACE_CACHE = os.environ.get("OPCUA_ADDRESS_SPACE_CACHE")
 # ----------------------------
 
 async def main():
     server = Server()
-    await server.init()
+    # 初始化並建立節點（一次 AddNodes；有 cache 時直接載入）
+    space = AddressSpaceSpec.load(ADDRESS_SPACE_FILE, default=DEFAULT_ADDRESS_SPACE)
+    nodes = await provision(server, space, cache=ADDRESS_SPACE_CACHE)
 
     # 設定 endpoint（對外綁定 0.0.0.0）
     server.set_endpoint("opc.tcp://0.0.0.0:4840/freeopcua/server/")
@@ -50,27 +76,15 @@ async def main():
             server.set_security_policy([ua.SecurityPolicyType.NoSecurity])
             print("[Warning] 已退回 No-Security 模式以維持 server 可用性")
 
+    if HISTORIZE:
+        server.iserver.history_manager.set_storage(RingHistory(HISTORY_DIR, capacity=HISTORY_CAPACITY))
+
     # 基本資訊
     server.set_server_name("Demo OPCUA Server by Afuku WISE AI Nutrition OPCUA DATA")
-    uri = "http://examples.freeopcua.github.io"
-    idx = await server.register_namespace(uri)
-
-    # 建立物件與變數
-    obj = await server.nodes.objects.add_object(idx, "SensorData")
-    var_temp = await obj.add_variable(idx, "Temperature", 0.0)
-    var_weight = await obj.add_variable(idx, "Weight", 0.0)
-    var_tray1_vol = await obj.add_variable(idx, "Tray1_vol", 0.0)
-    var_tray2_vol = await obj.add_variable(idx, "Tray2_vol", 0.0)
-    var_tray3_vol = await obj.add_variable(idx, "Tray3_vol", 0.0)
-    var_tray4_vol = await obj.add_variable(idx, "Tray4_vol", 0.0)
 
-    # 允許 Client 寫入（關鍵）
-    await var_temp.set_writable()
-    await var_weight.set_writable()
-    await var_tray1_vol.set_writable()
-    await var_tray2_vol.set_writable()
-    await var_tray3_vol.set_writable()
-    await var_tray4_vol.set_writable()
+    # SensorData 底下的變數（歷史資料用）
+    sensor_vars = {path.split("/", 1)[1]: node for path, node in nodes.items()
+                   if path.startswith("SensorData/") and path.count("/") == 1}
 
     # 啟動 server（async context）
     print("[OK] OPC UA Server 已啟動於 opc.tcp://localhost:4840/freeopcua/server/")
@@ -78,6 +92,9 @@ async def main():
 
     try:
         async with server:
+            if HISTORIZE:
+                await historize(server, sensor_vars, count=HISTORY_CAPACITY)
+                print(f"[OK] Historian：SensorData 歷史資料存於 {HISTORY_DIR}（每個 tag 最多 {HISTORY_CAPACITY} 筆）")
             # server 啟動後維持運行（你可以在此做週期性寫入示範）
             while True:
                 await asyncio.sleep(1)
@@ -0,0 +1,759 @@
+# opcua_session.py
+"""
+Long-lived OPC UA client session shared by the HTTP API / data fetch scripts.
+
+- 一個 asyncua.Client 常駐在背景 thread 的 event loop 上，所有 request 共用
+- 斷線（server 重啟、網路中斷）時自動以 exponential backoff 重連
+- 提供連線狀態（state / reconnects / last_error）給 /status 等 endpoint 使用
+
+- TagMap：tag 名稱 -> browse path 的 NodeId 快取，一次 TranslateBrowsePaths 解析、一次 Read 讀全部
+- TagSubscription：以一個 subscription 監看 TagMap 的全部 tag，在記憶體維護最新 snapshot
+- Broadcaster：把 subscription 的變化扇出給多個 stream client（慢的 client 只會合併成最新值，不會拖慢別人）
+- ChangeTracker：每個 tag 的值 / quality 改變時配一個遞增的 seq（給 /data 的 ETag 與 ?since=<seq> 差量使用）
+- SingleFlight：同時間相同的 request 合併成一次 upstream 讀取（async server 模式使用）
+
+用法：
+    session = OpcuaSession("opc.tcp://localhost:4840/freeopcua/server/")
+    tags = TagMap({"weight": ["0:Objects", "2:SensorData", "2:Weight"]})
+    session.add_on_connect(tags.refresh)
+    session.start()
+    values = session.run(tags.read_values)
+
+也可以跑在呼叫端既有的 event loop 上（例如 aiohttp），不另開 thread：
+    await session.start_async()
+    values = await session.call(tags.read_values)
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from asyncua import Client, ua
+
+from opcua_metrics import NODEID_CACHE, OPCUA_ERRORS, OPCUA_OP_SECONDS
+
+# ---------- Config ----------
+REQUEST_TIMEOUT = 4.0     # 單一 OPC UA request 的逾時（秒）
+KEEPALIVE_INTERVAL = 2.0  # 多久讀一次 ServerStatus.State 確認連線仍存活（秒）
+BACKOFF_MIN = 0.5         # 重連等待的起始秒數
+BACKOFF_MAX = 30.0        # 重連等待的上限秒數
+# asyncua Client 自己檢查 server 存活的間隔（秒，asyncua 預設 1.0）；
+# 上千個 tag 的 request 會讓 server 好幾秒無法回應，這時要放寬，否則會誤判斷線
+WATCHDOG_INTERVAL = 1.0
+MISSING_TAG_REPORT = 5    # 解析 tag 時最多逐一列出幾個找不到的 tag（其餘只印數量）
+# ----------------------------
+
+# 連線狀態
+STATE_IDLE = "idle"
+STATE_CONNECTING = "connecting"
+STATE_CONNECTED = "connected"
+STATE_DISCONNECTED = "disconnected"
+
+# 視為「連線已壞」並觸發重連的例外
+CONNECTION_ERRORS = (OSError, ConnectionError, asyncio.TimeoutError)
+# 代表 session / secure channel 已失效的 status；其他 Bad status（型別不符、不支援 HistoryRead 等）
+# 只是單一 request 失敗，直接丟給呼叫端，不重建 session
+CONNECTION_STATUS_CODES = frozenset((
+    ua.StatusCodes.BadSessionIdInvalid, ua.StatusCodes.BadSessionClosed, ua.StatusCodes.BadSessionNotActivated,
+    ua.StatusCodes.BadSecureChannelClosed, ua.StatusCodes.BadSecureChannelIdInvalid,
+    ua.StatusCodes.BadConnectionClosed, ua.StatusCodes.BadServerNotConnected, ua.StatusCodes.BadNotConnected,
+    ua.StatusCodes.BadCommunicationError, ua.StatusCodes.BadNoCommunication, ua.StatusCodes.BadServerHalted,
+    ua.StatusCodes.BadShutdown,
+))
+
+
+def is_connection_error(exc: BaseException) -> bool:
+    """True if ``exc`` means the connection / session is gone (reconnect), not just a failed request."""
+    if isinstance(exc, CONNECTION_ERRORS):
+        return True
+    return isinstance(exc, ua.UaStatusCodeError) and exc.code in CONNECTION_STATUS_CODES
+
+
+class SessionUnavailable(ConnectionError):
+    """Raised when a request is made while the session is not connected."""
+
+
+class OpcuaSession:
+    def __init__(self, url, timeout=REQUEST_TIMEOUT, keepalive=KEEPALIVE_INTERVAL,
+                 backoff_min=BACKOFF_MIN, backoff_max=BACKOFF_MAX, name="opcua", watchdog=WATCHDOG_INTERVAL):
+        self.url = url
+        self.timeout = timeout
+        self.watchdog = watchdog
+        self.keepalive = keepalive
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.name = name
+
+        self.client: Optional[Client] = None
+        self.state = STATE_IDLE
+        self.connected_since: Optional[float] = None
+        self.reconnects = 0
+        self.last_error: Optional[str] = None
+        # 最後一次確認連線正常的時間（keepalive 或 request 成功）
+        self.last_alive: Optional[float] = None
+
+        # 每次（重新）連線成功後要執行的 coroutine（例如解析 NodeId、建立 subscription）
+        self._on_connect: List[Callable[[Client], Awaitable[Any]]] = []
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._ready = threading.Event()
+        # 與 _ready 同步，給同一個 loop 上的 coroutine 等待（start_async 模式）
+        self._up: Optional[asyncio.Event] = None
+        self._lost: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    # -------------------------
+    # Lifecycle
+    # -------------------------
+    def start(self):
+        """Start the background loop thread (idempotent)."""
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return self
+            self._stopping = False
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._run_loop, name=f"{self.name}-session", daemon=True)
+            self._thread.start()
+        return self
+
+    async def start_async(self):
+        """
+        Run the session on the current event loop instead of a background thread.
+        HTTP handler 與 asyncua client 共用同一個 loop；請求用 ``await session.call(fn)``。
+        """
+        if self._task is not None and not self._task.done():
+            return self
+        self._stopping = False
+        self._loop = asyncio.get_running_loop()
+        self._lost = asyncio.Event()
+        self._up = asyncio.Event()
+        self._task = self._loop.create_task(self._supervise())
+        return self
+
+    async def stop_async(self):
+        await self._shutdown()
+        self._task = None
+        self._loop = None
+
+    async def wait_connected_async(self, timeout=None) -> bool:
+        """Await until connected (only on the session loop)."""
+        if self.state == STATE_CONNECTED:
+            return True
+        try:
+            await asyncio.wait_for(self._up.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def stop(self, timeout=2.0):
+        if self._loop is None:
+            return
+        self._stopping = True
+        fut = asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop)
+        try:
+            fut.result(timeout)
+        except Exception:
+            pass
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+        self._loop = None
+
+    def add_on_connect(self, callback: Callable[[Client], Awaitable[Any]]):
+        """Register a coroutine function called with the client after every (re)connect."""
+        self._on_connect.append(callback)
+        # 已經連上的話立即補跑一次
+        if self.state == STATE_CONNECTED and self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._run_on_connect(callback), self._loop)
+
+    @property
+    def loop(self) -> Optional[asyncio.AbstractEventLoop]:
+        return self._loop
+
+    def wait_connected(self, timeout=None) -> bool:
+        return self._ready.wait(timeout)
+
+    def status(self) -> dict:
+        return {
+            "name": self.name,
+            "url": self.url,
+            "state": self.state,
+            "connected_since": self.connected_since,
+            "uptime": (time.time() - self.connected_since) if self.connected_since else None,
+            "reconnects": self.reconnects,
+            "last_error": self.last_error,
+            "last_alive": self.last_alive,
+        }
+
+    # -------------------------
+    # Requests
+    # -------------------------
+    def run(self, fn: Callable[[Client], Awaitable[Any]], timeout=None):
+        """
+        Run ``fn(client)`` on the session loop from any (sync) thread and return its result.
+        Raises SessionUnavailable if the session is not connected.
+        """
+        if self._loop is None:
+            self.start()
+        if self.state != STATE_CONNECTED:
+            # 剛啟動或重連中：最多等一個 request timeout
+            self._ready.wait(self.timeout)
+        fut = asyncio.run_coroutine_threadsafe(self.call(fn), self._loop)
+        return fut.result(timeout if timeout is not None else self.timeout + 1.0)
+
+    async def call(self, fn: Callable[[Client], Awaitable[Any]]):
+        """Same as run() but awaited from inside the session loop."""
+        client = self.client
+        if self.state != STATE_CONNECTED or client is None:
+            OPCUA_ERRORS.inc(op="request", exception=SessionUnavailable.__name__)
+            raise SessionUnavailable(f"OPC UA session {self.state}: {self.last_error or self.url}")
+        try:
+            result = await asyncio.wait_for(fn(client), self.timeout)
+            self.last_alive = time.time()
+            return result
+        except Exception as e:
+            OPCUA_ERRORS.inc(op="request", exception=type(e).__name__)
+            if is_connection_error(e):
+                # 連線層的失敗 -> 交給 supervisor 判斷並重連
+                self._mark_lost(e)
+            raise
+
+    # -------------------------
+    # Internal
+    # -------------------------
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._lost = asyncio.Event()
+        self._up = asyncio.Event()
+        self._task = self._loop.create_task(self._supervise())
+        try:
+            self._loop.run_forever()
+        finally:
+            try:
+                self._loop.close()
+            except Exception:
+                pass
+
+    def _mark_lost(self, exc):
+        self.last_error = f"{type(exc).__name__}: {exc}"
+        if self._lost is not None:
+            self._lost.set()
+
+    async def _run_on_connect(self, callback):
+        try:
+            await callback(self.client)
+        except Exception as e:
+            if is_connection_error(e):
+                self._mark_lost(e)
+            else:
+                print(f"[Warning] {self.name}: on-connect hook 失敗：{e}")
+
+    async def _supervise(self):
+        """Connect, keep the session alive, and reconnect with backoff on loss."""
+        delay = self.backoff_min
+        first = True
+        while not self._stopping:
+            self.state = STATE_CONNECTING
+            client = Client(url=self.url, timeout=self.timeout, watchdog_intervall=self.watchdog)
+            try:
+                with OPCUA_OP_SECONDS.time(op="connect"):
+                    await client.connect()
+            except asyncio.CancelledError:
+                await self._disconnect_quiet(client)
+                raise
+            except Exception as e:
+                OPCUA_ERRORS.inc(op="connect", exception=type(e).__name__)
+                self.state = STATE_DISCONNECTED
+                self.last_error = f"{type(e).__name__}: {e}"
+                print(f"[Waiting] {self.name}: 無法連線 {self.url}（{self.last_error}），{delay:.1f}s 後重試")
+                await self._disconnect_quiet(client)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.backoff_max)
+                continue
+
+            self.client = client
+            self.state = STATE_CONNECTED
+            self.connected_since = self.last_alive = time.time()
+            if not first:
+                self.reconnects += 1
+            first = False
+            delay = self.backoff_min
+            self._lost.clear()
+            print(f"[OK] {self.name}: 已連線 {self.url}")
+
+            try:
+                for callback in list(self._on_connect):
+                    await self._run_on_connect(callback)
+                self._ready.set()
+                self._up.set()
+
+                await self._watch(client)
+            finally:
+                # 連線中斷或停止：client 只在這裡 disconnect（_shutdown 只通知並等待 supervisor 結束）
+                self._ready.clear()
+                self._up.clear()
+                self.state = STATE_IDLE if self._stopping else STATE_DISCONNECTED
+                self.connected_since = None
+                self.client = None
+                await self._disconnect_quiet(client)
+            if not self._stopping:
+                print(f"[Warning] {self.name}: 連線中斷（{self.last_error}），準備重連")
+
+    async def _watch(self, client):
+        """Block until the connection is found dead or a request reported a loss."""
+        state_node = client.get_node(ua.ObjectIds.Server_ServerStatus_State)
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._lost.wait(), self.keepalive)
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                with OPCUA_OP_SECONDS.time(op="keepalive"):
+                    await asyncio.wait_for(state_node.read_value(), self.timeout)
+                self.last_alive = time.time()
+            except Exception as e:
+                OPCUA_ERRORS.inc(op="keepalive", exception=type(e).__name__)
+                self.last_error = f"{type(e).__name__}: {e}"
+                return
+
+    async def _disconnect_quiet(self, client):
+        try:
+            await asyncio.wait_for(client.disconnect(), self.timeout)
+        except Exception:
+            pass
+
+    async def _shutdown(self):
+        """Stop the supervisor; it owns the client and disconnects it on its way out."""
+        self._stopping = True
+        task = self._task
+        if task is not None and not task.done() and task is not asyncio.current_task():
+            if self.client is not None and self._lost is not None:
+                # 已連線：叫醒 _watch，由 supervisor 自己 disconnect 後結束
+                self._lost.set()
+                try:
+                    await asyncio.wait_for(asyncio.shield(task), self.timeout + 1.0)
+                except (asyncio.TimeoutError, Exception):
+                    pass
+            if not task.done():
+                # 連線 / 重連等待中，或 disconnect 逾時：取消（finally 仍會 disconnect）
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self.client = None
+        self.state = STATE_IDLE
+        self._ready.clear()
+        if self._up is not None:
+            self._up.clear()
+
+
+# -------------------------
+# Tag map / NodeId cache
+# -------------------------
+# 讀取時遇到這些 status 代表 NodeId 已失效（server 重建了 address space），需重新解析
+STALE_NODEID_CODES = (ua.StatusCodes.BadNodeIdUnknown, ua.StatusCodes.BadNodeIdInvalid)
+
+
+def parse_browse_path(path) -> List[str]:
+    """Accept ``["0:Objects", "2:SensorData", "2:Weight"]`` or ``"0:Objects/2:SensorData/2:Weight"``."""
+    if isinstance(path, str):
+        return [p for p in path.split("/") if p]
+    return list(path)
+
+
+def load_tags(path, default: Dict[str, Sequence[str]]) -> Dict[str, List[str]]:
+    """
+    Load ``{tag_name: browse_path}`` from a JSON file; fall back to ``default`` if the file is missing.
+    """
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+        print(f"[OK] 載入 tag 設定：{path}（{len(raw)} 個 tag）")
+        return {name: parse_browse_path(p) for name, p in raw.items()}
+    return {name: parse_browse_path(p) for name, p in default.items()}
+
+
+def _make_browse_path(path: Sequence[str]) -> ua.BrowsePath:
+    rpath = ua.RelativePath()
+    for item in path:
+        el = ua.RelativePathElement()
+        el.ReferenceTypeId = ua.NodeId(ua.ObjectIds.HierarchicalReferences)
+        el.IsInverse = False
+        el.IncludeSubtypes = True
+        el.TargetName = ua.QualifiedName.from_string(item)
+        rpath.Elements.append(el)
+    bpath = ua.BrowsePath()
+    bpath.StartingNode = ua.NodeId(ua.ObjectIds.RootFolder)
+    bpath.RelativePath = rpath
+    return bpath
+
+
+class TagMap:
+    """
+    NodeId resolution cache for a configured set of tags.
+
+    refresh() 在每次（重新）連線時呼叫：只有 NamespaceArray 改變或尚未解析時才重新 browse，
+    read() 以一個 Read request 讀取全部（或指定）tag 的 DataValue。
+    """
+
+    def __init__(self, tags: Dict[str, Sequence[str]]):
+        self.paths: Dict[str, List[str]] = {name: parse_browse_path(p) for name, p in tags.items()}
+        self.nodeids: Dict[str, ua.NodeId] = {}
+        self.namespaces: Optional[List[str]] = None
+        self.resolved_at: Optional[float] = None
+
+    @property
+    def names(self) -> List[str]:
+        return list(self.paths)
+
+    async def refresh(self, client):
+        namespaces = await client.get_node(ua.ObjectIds.Server_NamespaceArray).read_value()
+        if self.nodeids and namespaces == self.namespaces:
+            return
+        self.namespaces = namespaces
+        await self.resolve(client)
+
+    async def resolve(self, client):
+        """Resolve every browse path with a single TranslateBrowsePathsToNodeIds call."""
+        names = list(self.paths)
+        with OPCUA_OP_SECONDS.time(op="browse"):
+            results = await client.uaclient.translate_browsepaths_to_nodeids(
+                [_make_browse_path(self.paths[n]) for n in names])
+        nodeids, missing = {}, []
+        for name, res in zip(names, results):
+            if res.StatusCode.is_good() and res.Targets:
+                nodeids[name] = res.Targets[0].TargetId
+            else:
+                missing.append((name, res.StatusCode))
+        for name, code in missing[:MISSING_TAG_REPORT]:
+            print(f"[Warning] 找不到 tag {name}：{'/'.join(self.paths[name])}（{code}）")
+        if len(missing) > MISSING_TAG_REPORT:
+            print(f"[Warning] 另有 {len(missing) - MISSING_TAG_REPORT} 個 tag 找不到（共 {len(missing)} / {len(names)} 個）")
+        self.nodeids = nodeids
+        self.resolved_at = time.time()
+
+    async def read(self, client, names: Optional[Sequence[str]] = None) -> Dict[str, Optional[ua.DataValue]]:
+        """Read the Value attribute of ``names`` (default: all tags) in one round-trip."""
+        missed = not self.nodeids
+        if missed:
+            await self.resolve(client)
+        names = list(self.paths) if names is None else list(names)
+        result = await self._read_once(client, names)
+        stale = [n for n, dv in result.items()
+                 if dv is not None and dv.StatusCode.value in STALE_NODEID_CODES]
+        if stale:
+            # address space 被重建：重新解析後重讀一次
+            missed = True
+            await self.resolve(client)
+            result = await self._read_once(client, names)
+        NODEID_CACHE.inc(result="miss" if missed else "hit")
+        return result
+
+    async def read_values(self, client, names: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        """Like read() but returns plain values (None for bad / missing tags)."""
+        result = await self.read(client, names)
+        return {n: (dv.Value.Value if dv is not None and dv.Value is not None and dv.StatusCode.is_good() else None)
+                for n, dv in result.items()}
+
+    async def _read_once(self, client, names):
+        present = [n for n in names if n in self.nodeids]
+        result: Dict[str, Optional[ua.DataValue]] = {n: None for n in names}
+        if present:
+            with OPCUA_OP_SECONDS.time(op="read"):
+                dvs = await client.uaclient.read_attributes([self.nodeids[n] for n in present], ua.AttributeIds.Value)
+            result.update(zip(present, dvs))
+        return result
+
+
+# -------------------------
+# Subscription snapshot
+# -------------------------
+SUBSCRIPTION_INTERVAL_MS = 100  # publishing interval（毫秒）
+
+
+def quality_of(status_code) -> str:
+    """Map an OPC UA StatusCode to 'good' / 'uncertain' / 'bad' (severity bits 30-31)."""
+    if status_code is None:
+        return "good"
+    severity = (status_code.value >> 30) & 0x3
+    return {0: "good", 1: "uncertain"}.get(severity, "bad")
+
+
+def _iso(ts) -> Optional[str]:
+    return ts.isoformat() if ts is not None else None
+
+
+def datavalue_entry(dv: Optional[ua.DataValue], received_at: Optional[float] = None) -> Optional[dict]:
+    """Flatten a DataValue into the snapshot entry served by the HTTP API."""
+    if dv is None:
+        return None
+    return {
+        "value": dv.Value.Value if dv.Value is not None else None,
+        "quality": quality_of(dv.StatusCode),
+        "source_timestamp": _iso(dv.SourceTimestamp),
+        "server_timestamp": _iso(dv.ServerTimestamp),
+        "received_at": received_at if received_at is not None else time.time(),
+    }
+
+
+class TagSubscription:
+    """
+    Keep an in-memory snapshot of every tag in a TagMap, fed by one OPC UA subscription.
+
+    每次（重新）連線時由 session 的 on-connect hook 建立 subscription；
+    datachange 通知只更新記憶體，讀取端（HTTP handler）不需再對 server 發 request。
+    """
+
+    def __init__(self, session: OpcuaSession, tags: TagMap, interval_ms=SUBSCRIPTION_INTERVAL_MS):
+        self.session = session
+        self.tags = tags
+        self.interval_ms = interval_ms
+        self.snapshot: Dict[str, dict] = {}
+        self.last_update: Optional[float] = None
+        self.notifications = 0
+        self._by_nodeid: Dict[ua.NodeId, str] = {}
+        self._lock = threading.Lock()
+        self._subscription = None
+        # 每筆 datachange 以 {name: entry} 呼叫（在 session loop thread 上執行，不可阻塞）
+        self._listeners: List[Callable[[Dict[str, dict]], None]] = []
+
+    def attach(self):
+        """Register with the session so the subscription is (re)created on every connect."""
+        self.session.add_on_connect(self._subscribe)
+        return self
+
+    def add_listener(self, callback: Callable[[Dict[str, dict]], None]):
+        self._listeners.append(callback)
+
+    @property
+    def confirmed_at(self) -> Optional[float]:
+        """Latest time the snapshot is known to be current (notification or healthy keepalive)."""
+        times = [t for t in (self.last_update, self.session.last_alive) if t is not None]
+        if self.session.state != STATE_CONNECTED or self._subscription is None or not times:
+            return self.last_update
+        return max(times)
+
+    def age(self) -> Optional[float]:
+        confirmed = self.confirmed_at
+        return (time.time() - confirmed) if confirmed is not None else None
+
+    def get(self, names: Optional[Sequence[str]] = None) -> Dict[str, dict]:
+        with self._lock:
+            if names is None:
+                return dict(self.snapshot)
+            return {n: self.snapshot.get(n) for n in names}
+
+    def values(self, names: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        names = self.tags.names if names is None else names
+        snap = self.get(names)
+        return {n: (e["value"] if e is not None and e["quality"] == "good" else None) for n, e in snap.items()}
+
+    async def _subscribe(self, client):
+        self._subscription = None
+        if not self.tags.nodeids:
+            await self.tags.refresh(client)
+        self._by_nodeid = {nodeid: name for name, nodeid in self.tags.nodeids.items()}
+        with OPCUA_OP_SECONDS.time(op="subscribe"):
+            subscription = await client.create_subscription(self.interval_ms, self)
+            nodes = [client.get_node(nodeid) for nodeid in self._by_nodeid]
+            await subscription.subscribe_data_change(nodes)
+        self._subscription = subscription
+        print(f"[OK] {self.session.name}: 已訂閱 {len(nodes)} 個 tag（{self.interval_ms} ms）")
+
+    # asyncua subscription handler
+    def datachange_notification(self, node, val, data):
+        name = self._by_nodeid.get(node.nodeid)
+        if name is None:
+            return
+        now = time.time()
+        entry = datavalue_entry(data.monitored_item.Value, now)
+        with self._lock:
+            self.snapshot[name] = entry
+            self.last_update = now
+            self.notifications += 1
+        for callback in self._listeners:
+            try:
+                callback({name: entry})
+            except Exception as e:
+                print(f"[Warning] {self.session.name}: datachange listener 失敗：{e}")
+
+    def status_change_notification(self, status):
+        print(f"[Warning] {self.session.name}: subscription 狀態改變：{getattr(status, 'Status', status)}")
+        self._subscription = None
+
+
+# -------------------------
+# Fan-out to stream clients
+# -------------------------
+class StreamClient:
+    """One stream consumer: pending changes are coalesced per tag, so memory stays O(#tags)."""
+
+    def __init__(self):
+        self.pending: Dict[str, dict] = {}
+        self.dropped = 0  # 被較新值覆蓋（合併掉）的更新數
+        self._cond = threading.Condition()
+
+    def push(self, changes: Dict[str, dict]):
+        with self._cond:
+            for name, entry in changes.items():
+                if name in self.pending:
+                    self.dropped += 1
+                self.pending[name] = entry
+            self._cond.notify()
+
+    def wait(self, timeout=None) -> Dict[str, dict]:
+        """Block until there are changes (or timeout) and return them all at once."""
+        with self._cond:
+            if not self.pending:
+                self._cond.wait(timeout)
+            changes, self.pending = self.pending, {}
+            return changes
+
+
+class AsyncStreamClient(StreamClient):
+    """StreamClient for a consumer on the session loop: wait() is awaited instead of blocking a thread."""
+
+    def __init__(self):
+        self.pending: Dict[str, dict] = {}
+        self.dropped = 0
+        self._event = asyncio.Event()
+
+    def push(self, changes: Dict[str, dict]):
+        # 只會在 session loop 上被呼叫（subscription 通知），不需要 lock
+        for name, entry in changes.items():
+            if name in self.pending:
+                self.dropped += 1
+            self.pending[name] = entry
+        self._event.set()
+
+    async def wait(self, timeout=None) -> Dict[str, dict]:
+        if not self.pending:
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self._event.clear()
+        changes, self.pending = self.pending, {}
+        return changes
+
+
+class Broadcaster:
+    """
+    Fan out one upstream change feed to many stream clients.
+
+    publish() 只做 dict.update + notify，不會等待任何 client；
+    慢的 client 在下一次 wait() 時一次拿到每個 tag 的最新值。
+    """
+
+    def __init__(self):
+        self._clients: List[StreamClient] = []
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def __len__(self):
+        return len(self._clients)
+
+    def publish(self, changes: Dict[str, dict]):
+        self.published += 1
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            client.push(changes)
+
+    def register(self, client: Optional[StreamClient] = None) -> StreamClient:
+        if client is None:
+            client = StreamClient()
+        with self._lock:
+            self._clients.append(client)
+        return client
+
+    def unregister(self, client: StreamClient):
+        with self._lock:
+            if client in self._clients:
+                self._clients.remove(client)
+
+
+# -------------------------
+# Change tracking
+# -------------------------
+class ChangeTracker:
+    """
+    Assign an increasing sequence number to every value / quality change seen per tag.
+
+    seq 從目前的 epoch 微秒開始，API 重啟後新的 seq 一定比舊 process 發出的大：
+    舊的 ETag 不會誤判成 304，舊的 ?since= 會拿到全部 tag。
+    """
+
+    def __init__(self):
+        self.seq = int(time.time() * 1e6)
+        self._state: Dict[str, Any] = {}
+        self._changed_at: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def update(self, snapshot: Dict[str, Optional[dict]]) -> int:
+        """Compare ``snapshot`` ({key: entry or None}) with the last one seen and return the current seq."""
+        with self._lock:
+            for name, entry in snapshot.items():
+                state = None if entry is None else (entry["value"], entry["quality"])
+                if name not in self._state or self._state[name] != state:
+                    self.seq += 1
+                    self._state[name] = state
+                    self._changed_at[name] = self.seq
+            return self.seq
+
+    def last_change(self, names: Sequence[str]) -> int:
+        """Seq of the latest change among ``names`` (0 when none of them has been seen)."""
+        with self._lock:
+            return max((self._changed_at.get(name, 0) for name in names), default=0)
+
+    def changed_since(self, seq: int) -> List[str]:
+        """Keys changed after ``seq``; all keys when ``seq`` is in the future (issued by an earlier process)."""
+        with self._lock:
+            if seq > self.seq:
+                return list(self._changed_at)
+            return [name for name, at in self._changed_at.items() if at > seq]
+
+
+# -------------------------
+# Request coalescing
+# -------------------------
+class SingleFlight:
+    """
+    Coalesce concurrent identical requests: callers with the same key await one shared upstream call.
+
+    共用的 call 以 asyncio.shield 保護，某個呼叫端逾時 / 取消不會中斷其他人在等的那次讀取。
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Any, asyncio.Future] = {}
+        self.calls = 0   # 實際送出的 upstream call 數
+        self.shared = 0  # 搭便車（直接等既有 call）的呼叫數
+
+    def __len__(self):
+        return len(self._inflight)
+
+    async def do(self, key, fn: Callable[[], Awaitable[Any]]):
+        fut = self._inflight.get(key)
+        if fut is None:
+            self.calls += 1
+            fut = asyncio.ensure_future(fn())
+            self._inflight[key] = fut
+            fut.add_done_callback(lambda f, k=key: self._done(k, f))
+        else:
+            self.shared += 1
+        return await asyncio.shield(fut)
+
+    def _done(self, key, fut):
+        if self._inflight.get(key) is fut:
+            del self._inflight[key]
+        if not fut.cancelled():
+            fut.exception()  # 所有呼叫端都已放棄時，避免 "exception was never retrieved"
@@ -0,0 +1,165 @@
+# opcua_shards.py
+"""
+Sharded simulation: K random-value server processes (one per CPU core), presented to the API as one logical server.
+
+一個 asyncua server process 受 GIL 限制只能用到一個 core；把 Simulation 物件切成 K 段，
+每段由一個獨立的 OPCUA_local_RandomValue_serve.py process 負責（各自的 port），吞吐量就能隨 core 數增加。
+
+- shard_range()：第 index 個 shard 負責的 Simulation 物件範圍（連續的一段，物件名稱維持全域編號）
+- 啟動器（python opcua_shards.py）：啟動 K 個 shard（SHARD_INDEX / SHARD_COUNT / OPCUA_PORT 環境變數），
+  把輸出加上 "[shardN] " 前綴轉出，shard 意外結束時自動重啟；server_UI.py 以一個 ManagedProcess 執行它
+- shard_endpoints()：API 端的 aggregator，每個 shard 一個 Endpoint（不加 endpoint 前綴），
+  /data 的 key 與單一 server 相同（SensorData 的 tag + "Obj0003/Var001"），各 shard 同時讀取
+
+只有 shard 0 負責 SensorData（與錄製 / 重播 / 歷史 / 統計 / 波形），其他 shard 只跑 Simulation。
+
+用法：
+    set OPCUA_SHARDS=4
+    set SIM_OBJECTS=2000
+    python opcua_shards.py          # 4 個 process：port 4840~4843
+    python vue_flask_api.py         # 同樣的 OPCUA_SHARDS / SIM_OBJECTS / SIM_VARIABLES -> 聚合成一個 /data
+"""
+
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# ---------- Config ----------
+# shard 數（0 = 不分片）；啟動器未設定時預設為 CPU core 數
+SHARDS = int(os.environ.get("OPCUA_SHARDS", "0"))
+BASE_PORT = int(os.environ.get("OPCUA_BASE_PORT", "4840"))  # shard i 使用 BASE_PORT + i
+SHARD_HOST = os.environ.get("OPCUA_SHARD_HOST", "localhost")
+SERVER_SCRIPT = os.path.join(BASE_DIR, "OPCUA_local_RandomValue_serve.py")
+# Linux：把 shard i 固定在第 i 個 core（OPCUA_SHARD_PIN=1），避免 process 在 core 之間搬移
+PIN_CORES = os.environ.get("OPCUA_SHARD_PIN", "0") == "1"
+RESTART_DELAY = 2.0  # shard 意外結束後多久重啟（秒）
+# ----------------------------
+
+
+def shard_range(total, shards, index):
+    """``(start, stop)`` of the contiguous slice of ``total`` objects owned by shard ``index`` of ``shards``."""
+    base, extra = divmod(total, shards)
+    start = index * base + min(index, extra)
+    return start, start + base + (1 if index < extra else 0)
+
+
+def shard_url(index, host=SHARD_HOST, base_port=BASE_PORT) -> str:
+    return f"opc.tcp://{host}:{base_port + index}/freeopcua/server/"
+
+
+def simulation_tags(start, stop, variables) -> Dict[str, List[str]]:
+    """{"Obj0003/Var001": browse path} for Simulation objects ``start..stop-1`` × ``variables`` variables."""
+    return {f"Obj{i:04d}/Var{j:03d}": ["0:Objects", "2:Simulation", f"2:Obj{i:04d}", f"2:Var{j:03d}"]
+            for i in range(start, stop) for j in range(variables)}
+
+
+def shard_endpoints(shards, objects, variables, sensor_tags: Dict[str, Sequence[str]], session_name="gateway",
+                    stats: Sequence[str] = (), waves: Optional[Dict[str, Sequence[str]]] = None):
+    """
+    Aggregator endpoints for ``shards`` shards: one unprefixed Endpoint per shard, owning its Simulation slice;
+    shard 0 also owns ``sensor_tags`` (with their rolling statistics ``stats``) and the waveform tags ``waves``.
+    """
+    from opcua_gateway import Endpoint
+
+    endpoints = []
+    for index in range(shards):
+        tags = dict(sensor_tags) if index == 0 else {}
+        tags.update(simulation_tags(*shard_range(objects, shards, index), variables))
+        endpoints.append(Endpoint(f"shard{index}", shard_url(index), tags, session_name=session_name, prefix=False,
+                                  stats=stats if index == 0 else (), stat_tags=list(sensor_tags),
+                                  waves=waves if index == 0 else None))
+    print(f"[OK] Shards：{shards} 個 server（{shard_url(0)} ~ port {BASE_PORT + shards - 1}），"
+          f"{objects} objects × {variables} variables")
+    return endpoints
+
+
+# -------------------------
+# Launcher
+# -------------------------
+class ShardLauncher:
+    """Start, supervise and stop ``shards`` server processes, forwarding their output with a shard prefix."""
+
+    def __init__(self, shards, script=SERVER_SCRIPT, base_port=BASE_PORT):
+        self.shards = shards
+        self.script = script
+        self.base_port = base_port
+        self.procs: List[subprocess.Popen] = [None] * shards
+        self.restarts = [0] * shards
+        self._stopping = threading.Event()
+        self._print_lock = threading.Lock()
+
+    def emit(self, index, line):
+        with self._print_lock:
+            print(f"[shard{index}] {line}", flush=True)
+
+    def start_shard(self, index):
+        env = os.environ.copy()
+        env.update({"SHARD_INDEX": str(index), "SHARD_COUNT": str(self.shards),
+                    "OPCUA_PORT": str(self.base_port + index), "PYTHONIOENCODING": "utf-8", "PYTHONUNBUFFERED": "1"})
+        proc = subprocess.Popen([sys.executable, self.script], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                bufsize=1, universal_newlines=True, encoding="utf-8", errors="replace", env=env)
+        if PIN_CORES and hasattr(os, "sched_setaffinity"):
+            try:
+                os.sched_setaffinity(proc.pid, {index % os.cpu_count()})
+            except OSError as e:
+                self.emit(index, f"[Warning] 無法固定 CPU core：{e}")
+        self.procs[index] = proc
+        threading.Thread(target=self._forward, args=(index, proc), daemon=True).start()
+
+    def _forward(self, index, proc):
+        for line in proc.stdout:
+            self.emit(index, line.rstrip("\n"))
+
+    def run(self):
+        """Start every shard and restart shards that exit unexpectedly until stop() is called."""
+        print(f"[OK] 啟動 {self.shards} 個 shard（port {self.base_port}~{self.base_port + self.shards - 1}）", flush=True)
+        for index in range(self.shards):
+            self.start_shard(index)
+        while not self._stopping.wait(0.5):
+            for index, proc in enumerate(self.procs):
+                if proc.poll() is None or self._stopping.is_set():
+                    continue
+                self.restarts[index] += 1
+                self.emit(index, f"[Error] shard 結束（returncode={proc.returncode}），{RESTART_DELAY:g}s 後重新啟動"
+                                 f"（第 {self.restarts[index]} 次）")
+                if self._stopping.wait(RESTART_DELAY):
+                    break
+                self.start_shard(index)
+        self._terminate()
+
+    def stop(self, *_):
+        self._stopping.set()
+
+    def _terminate(self, timeout=3.0):
+        for proc in self.procs:
+            if proc is not None and proc.poll() is None:
+                proc.terminate()
+        deadline = time.time() + timeout
+        for proc in self.procs:
+            if proc is None:
+                continue
+            try:
+                proc.wait(max(deadline - time.time(), 0.1))
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        print("[Stopped] 所有 shard 已結束", flush=True)
+
+
+def main():
+    launcher = ShardLauncher(SHARDS or os.cpu_count() or 1)
+    # server_UI 的 Stop（SIGTERM）/ Ctrl+C 都先停掉全部 shard 再結束
+    signal.signal(signal.SIGTERM, launcher.stop)
+    signal.signal(signal.SIGINT, launcher.stop)
+    if hasattr(signal, "SIGBREAK"):
+        signal.signal(signal.SIGBREAK, launcher.stop)
+    launcher.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,445 @@
+# opcua_simulator.py
+"""
+Vectorized signal simulation for the random-value OPC UA server.
+
+- SignalBank：N 個 tag 的訊號模型參數存成 NumPy 陣列，每個 tick 一次向量化算出全部數值
+  支援模型：uniform / random_walk / sine / step / noise；block() 一次算出一段等間隔取樣（波形 tag 用）
+- Simulator：把 SignalBank 的數值對應到 OPC UA 節點，每個 tick 以一次 Write service 呼叫寫入全部節點；
+  可設定每個節點的 absolute / percent deadband，只寫入（並通知）變化超過 deadband 的節點
+- TickScheduler：以絕對 deadline 排程多個不同頻率的 group（例如 100 Hz / 10 Hz / 1 Hz），
+  不會因為寫入時間而漂移；落後超過一個週期時跳過並計入 missed，而不是默默延後
+
+用法：
+    bank = SignalBank(seed=1)
+    i = bank.add("sine", low=0, high=100, period=10)
+    bank.build()
+    values = bank.tick()          # np.ndarray, shape (len(bank),)
+    block = bank.block(t0, 100, 0.001)  # shape (len(bank), 100)：t0 起每 1 ms 一個取樣
+"""
+
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, List, Optional, Sequence
+
+import numpy as np
+from asyncua import ua
+
+SIGNAL_MODELS = ("uniform", "random_walk", "sine", "step", "noise")
+
+
+class SignalBank:
+    """Parameters and state for many simulated signals, evaluated in one vectorized step per tick."""
+
+    def __init__(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+        self._specs: List[dict] = []
+        self.names: List[str] = []
+        self.values: Optional[np.ndarray] = None
+        self._t0: Optional[float] = None
+        self._last_t: Optional[float] = None
+
+    def __len__(self):
+        return len(self._specs)
+
+    def add(self, model, low=0.0, high=100.0, period=None, sigma=None, integer=False, name=None) -> int:
+        """
+        Register one signal and return its index.
+
+        period: sine 週期 / step 換階間隔（秒），None 則隨機 5~60 秒
+        sigma:  random_walk 每秒步幅 / noise 標準差，None 則為 (high-low) 的 2%
+        integer: 輸出四捨五入成整數值（仍為 float64）
+        """
+        if model not in SIGNAL_MODELS:
+            raise ValueError(f"Unknown signal model: {model} (choose from {', '.join(SIGNAL_MODELS)})")
+        self._specs.append({
+            "model": SIGNAL_MODELS.index(model),
+            "low": float(low),
+            "high": float(high),
+            "period": float(period) if period else float(self.rng.uniform(5.0, 60.0)),
+            "sigma": float(sigma) if sigma is not None else (float(high) - float(low)) * 0.02,
+            "integer": bool(integer),
+        })
+        self.names.append(name or f"signal{len(self._specs) - 1}")
+        return len(self._specs) - 1
+
+    def build(self):
+        """Freeze the registered signals into NumPy arrays."""
+        n = len(self._specs)
+        self.model = np.array([s["model"] for s in self._specs], dtype=np.int8)
+        self.low = np.array([s["low"] for s in self._specs], dtype=np.float64)
+        self.high = np.array([s["high"] for s in self._specs], dtype=np.float64)
+        self.period = np.array([s["period"] for s in self._specs], dtype=np.float64)
+        self.sigma = np.array([s["sigma"] for s in self._specs], dtype=np.float64)
+        self.integer = np.array([s["integer"] for s in self._specs], dtype=bool)
+        self.phase = self.rng.uniform(0.0, 2 * np.pi, n)
+        self.mid = (self.low + self.high) / 2.0
+        self.amplitude = (self.high - self.low) / 2.0
+        # 每個模型對應的 index（tick 時只做 fancy indexing，不跑 Python 迴圈）
+        self._idx = {m: np.flatnonzero(self.model == i) for i, m in enumerate(SIGNAL_MODELS)}
+        self._any_integer = bool(self.integer.any())
+        # 初始狀態：random_walk 從中間開始、step 先抽一個階
+        self.values = self.mid.copy()
+        step = self._idx["step"]
+        self._epoch = np.full(n, -1, dtype=np.int64)
+        self.values[step] = self._uniform(step)
+        return self
+
+    def _uniform(self, idx):
+        return self.low[idx] + (self.high[idx] - self.low[idx]) * self.rng.random(len(idx))
+
+    def tick(self, t=None) -> np.ndarray:
+        """Advance all signals to time ``t`` (default: now) and return the values array."""
+        if self.values is None:
+            self.build()
+        t = time.time() if t is None else t
+        if self._t0 is None:
+            self._t0 = self._last_t = t
+        dt = max(t - self._last_t, 0.0)
+        self._last_t = t
+        elapsed = t - self._t0
+        v = self.values
+
+        idx = self._idx["uniform"]
+        if len(idx):
+            v[idx] = self._uniform(idx)
+
+        idx = self._idx["random_walk"]
+        if len(idx):
+            step = self.sigma[idx] * np.sqrt(dt) * self.rng.standard_normal(len(idx))
+            v[idx] = np.clip(v[idx] + step, self.low[idx], self.high[idx])
+
+        idx = self._idx["sine"]
+        if len(idx):
+            v[idx] = self.mid[idx] + self.amplitude[idx] * np.sin(
+                2 * np.pi * elapsed / self.period[idx] + self.phase[idx])
+
+        idx = self._idx["step"]
+        if len(idx):
+            epoch = np.floor(elapsed / self.period[idx]).astype(np.int64)
+            changed = idx[epoch != self._epoch[idx]]
+            self._epoch[idx] = epoch
+            if len(changed):
+                v[changed] = self._uniform(changed)
+
+        idx = self._idx["noise"]
+        if len(idx):
+            v[idx] = self.mid[idx] + self.sigma[idx] * self.rng.standard_normal(len(idx))
+
+        if self._any_integer:
+            v[self.integer] = np.round(v[self.integer])
+        return v
+
+    def block(self, t0, n, dt) -> np.ndarray:
+        """
+        Sample all signals at ``t0, t0 + dt, ..., t0 + (n-1)*dt`` and return an array of shape (len(bank), n).
+
+        與連續呼叫 n 次 tick() 的結果分布相同，但整段一次向量化算完；之後的 tick() / block() 從最後一個取樣接續。
+        """
+        if self.values is None:
+            self.build()
+        if self._t0 is None:
+            self._t0 = self._last_t = t0
+        t = t0 + dt * np.arange(n)
+        elapsed = t - self._t0
+        # 每個取樣與前一個取樣的間隔（第一個取樣接續上一次 tick / block）
+        steps = np.full(n, float(dt))
+        steps[0] = max(t0 - self._last_t, 0.0)
+        out = np.empty((len(self), n))
+
+        idx = self._idx["uniform"]
+        if len(idx):
+            out[idx] = self.low[idx, None] + (self.high - self.low)[idx, None] * self.rng.random((len(idx), n))
+
+        idx = self._idx["random_walk"]
+        if len(idx):
+            noise = self.sigma[idx, None] * np.sqrt(steps) * self.rng.standard_normal((len(idx), n))
+            level = self.values[idx]
+            low, high = self.low[idx], self.high[idx]
+            # 每一步都要夾在 low / high 之間，只能沿時間逐步累加（signal 維度仍是向量化）
+            for k in range(n):
+                level = np.clip(level + noise[:, k], low, high)
+                out[idx, k] = level
+
+        idx = self._idx["sine"]
+        if len(idx):
+            out[idx] = self.mid[idx, None] + self.amplitude[idx, None] * np.sin(
+                2 * np.pi * elapsed[None, :] / self.period[idx, None] + self.phase[idx, None])
+
+        idx = self._idx["step"]
+        if len(idx):
+            epoch = np.floor(elapsed[None, :] / self.period[idx, None]).astype(np.int64)
+            previous = np.concatenate([self._epoch[idx, None], epoch[:, :-1]], axis=1)
+            changed = epoch != previous
+            # 換階的取樣抽新值，其餘沿用前一個取樣（forward fill）
+            draws = self.low[idx, None] + (self.high - self.low)[idx, None] * self.rng.random((len(idx), n))
+            fill = np.where(changed, np.arange(n)[None, :], -1)
+            np.maximum.accumulate(fill, axis=1, out=fill)
+            levels = np.where(fill >= 0, np.take_along_axis(draws, np.maximum(fill, 0), axis=1),
+                              self.values[idx, None])
+            out[idx] = levels
+            self._epoch[idx] = epoch[:, -1]
+
+        idx = self._idx["noise"]
+        if len(idx):
+            out[idx] = self.mid[idx, None] + self.sigma[idx, None] * self.rng.standard_normal((len(idx), n))
+
+        if self._any_integer:
+            out[self.integer] = np.round(out[self.integer])
+        self.values[:] = out[:, -1]
+        self._last_t = float(t[-1])
+        return out
+
+
+class Simulator:
+    """
+    Map a SignalBank onto OPC UA variable nodes and write each tick in one Write service call.
+
+    寫入走 server 內部 session 的 Write service（與 client 寫入相同的 callback / subscription 通知），
+    但一個 tick 只有一次 await，而不是每個節點一次 set_value。
+    """
+
+    def __init__(self, server, bank: Optional[SignalBank] = None):
+        self.server = server
+        self.bank = bank
+        self.nodeids: List[ua.NodeId] = []
+        self.deadband: Optional[np.ndarray] = None  # 每個節點的 (absolute, percent)，None = 每次都寫
+        self.last: Optional[np.ndarray] = None      # 上次寫入的值（deadband 比較基準）
+        self.written = 0     # 實際寫入的節點值數
+        self.suppressed = 0  # 因 deadband 省略的節點值數
+        self.latency = 0.0       # 最近一次 Write service 呼叫的時間（秒）
+        self.peak_latency = 0.0  # 上次 take_latency() 之後最長的 Write 時間（秒）
+
+    def bind(self, nodes: Sequence):
+        """Bind bank signals (in order) to nodes / NodeIds (without a bank: the columns passed to write())."""
+        self.nodeids = [getattr(n, "nodeid", n) for n in nodes]
+        if self.bank is not None and len(self.nodeids) != len(self.bank):
+            raise ValueError(f"{len(self.bank)} signals but {len(self.nodeids)} nodes")
+        return self
+
+    def set_deadband(self, absolute=0.0, percent=0.0):
+        """
+        Write only values that moved more than the deadband since the value last written (change-only publishing).
+
+        absolute / percent 可為純量或與綁定節點對齊的陣列；percent 以 SignalBank 的量程（high - low）計算，
+        沒有 bank（例如重播）時以上次寫入值的絕對值計算。0 / 0 表示「值有變才寫」，absolute < 0 表示每次都寫。
+        """
+        n = len(self.nodeids)
+        self.deadband = np.empty((2, n))
+        self.deadband[0] = absolute
+        self.deadband[1] = percent
+        self.last = None
+        return self
+
+    def changed(self, values: np.ndarray) -> np.ndarray:
+        """Boolean mask of bound nodes whose value is outside the deadband (all True without a deadband)."""
+        if self.deadband is None or self.last is None:
+            return np.ones(len(values), dtype=bool)
+        span = (self.bank.high - self.bank.low) if self.bank is not None else np.abs(self.last)
+        # 與 OPC UA DeadbandType 相同，每個節點是 absolute 或 percent 其中之一（percent > 0 時用 percent）
+        limit = np.where(self.deadband[1] > 0, self.deadband[1] / 100.0 * span, self.deadband[0])
+        with np.errstate(invalid="ignore"):
+            return np.isnan(self.last) | (np.abs(values - self.last) > limit)
+
+    async def write_blocks(self, blocks: np.ndarray, t0: float):
+        """
+        Write one block of samples per bound (array) node: ``blocks`` has shape (n_nodes, n_samples).
+
+        SourceTimestamp 設為 block 第一個取樣的時間 t0，client 由它與 SampleInterval 還原每個取樣的時間；
+        一次 Write 帶全部 node 的 block，不套用 deadband。
+        """
+        source = datetime.fromtimestamp(t0, timezone.utc)
+        now = datetime.now(timezone.utc)
+        nodes_to_write = []
+        for nodeid, row in zip(self.nodeids, blocks):
+            wv = _write_value(nodeid, ua.Variant(row.tolist(), ua.VariantType.Double), now)
+            wv.Value.SourceTimestamp = source
+            nodes_to_write.append(wv)
+        self.written += blocks.size
+        return await self._write(nodes_to_write)
+
+    async def write(self, values: np.ndarray, extra: Sequence = (), extra_on_change=False):
+        """
+        Write ``values`` (float64 array aligned with bound nodes) plus ``extra`` ``(nodeid, Variant)`` pairs.
+
+        設定 deadband 時只寫入變化的節點；extra_on_change=True 時沒有任何節點變化就連 extra 也不寫。
+        沒有東西要寫時不呼叫 Write service，回傳空 list。
+        """
+        now = datetime.now(timezone.utc)
+        nodes_to_write = []
+        if self.deadband is None:
+            idx = range(len(self.nodeids))
+            written = values.tolist()
+        else:
+            mask = self.changed(values)
+            if self.last is None:
+                self.last = np.array(values, dtype=np.float64)
+            else:
+                self.last[mask] = values[mask]
+            idx = np.flatnonzero(mask).tolist()
+            written = values[mask].tolist()
+            self.suppressed += len(values) - len(idx)
+        self.written += len(idx)
+        for i, v in zip(idx, written):
+            nodes_to_write.append(_write_value(self.nodeids[i], ua.Variant(v, ua.VariantType.Double), now))
+        if nodes_to_write or not extra_on_change:
+            for nodeid, variant in extra:
+                nodes_to_write.append(_write_value(getattr(nodeid, "nodeid", nodeid), variant, now))
+        if not nodes_to_write:
+            return []
+        return await self._write(nodes_to_write)
+
+    async def _write(self, nodes_to_write):
+        params = ua.WriteParameters()
+        params.NodesToWrite = nodes_to_write
+        start = time.perf_counter()
+        results = await self.server.iserver.isession.write(params)
+        self.latency = time.perf_counter() - start
+        self.peak_latency = max(self.peak_latency, self.latency)
+        return results
+
+    def take_latency(self) -> float:
+        """Longest Write call since the previous call (diagnostics, per publish interval), then reset."""
+        peak, self.peak_latency = self.peak_latency, 0.0
+        return peak
+
+
+def parse_deadband(text):
+    """``"5"`` -> (5, 0)、``"2%"`` -> (0, 2)、``"off"`` / 空字串 -> None（每個 tick 都寫）"""
+    text = (text or "").strip()
+    if text.lower() in ("", "off", "none"):
+        return None
+    if text.endswith("%"):
+        return 0.0, float(text[:-1])
+    return float(text), 0.0
+
+
+def _write_value(nodeid, variant, now) -> ua.WriteValue:
+    wv = ua.WriteValue()
+    wv.NodeId = nodeid
+    wv.AttributeId = ua.AttributeIds.Value
+    wv.Value = ua.DataValue(variant, SourceTimestamp=now, ServerTimestamp=now)
+    return wv
+
+
+# -------------------------
+# Scheduler
+# -------------------------
+MISSED_REPORT_INTERVAL = 5.0  # 同一 group 的 missed tick 警告最多每幾秒印一次
+
+
+class RateGroup:
+    """One periodic task of a TickScheduler plus its timing statistics."""
+
+    def __init__(self, name, rate_hz, callback: Callable[[float], Awaitable[None]]):
+        if rate_hz <= 0:
+            raise ValueError(f"rate_hz must be > 0 (group {name})")
+        self.name = name
+        self.rate_hz = float(rate_hz)
+        self.period = 1.0 / self.rate_hz
+        self.callback = callback
+        self.ticks = 0
+        self.missed = 0           # 因為落後而跳過的 tick 數
+        self.overruns = 0         # callback 執行時間超過一個週期的次數
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.last_lateness = 0.0  # 實際開始時間 - deadline（秒）
+        self.max_lateness = 0.0
+        # take_peaks() 之後的最大值（diagnostics 每個發布週期取一次）
+        self.peak_duration = 0.0
+        self.peak_lateness = 0.0
+        self._peak_ticks = 0
+        self._reported_missed = 0
+        self._reported_at = 0.0
+
+    def stats(self) -> dict:
+        return {
+            "rate_hz": self.rate_hz,
+            "ticks": self.ticks,
+            "missed": self.missed,
+            "overruns": self.overruns,
+            "last_duration": self.last_duration,
+            "max_duration": self.max_duration,
+            "last_lateness": self.last_lateness,
+            "max_lateness": self.max_lateness,
+        }
+
+    def take_peaks(self):
+        """
+        ``(duration, lateness)`` peaks of the ticks since the previous call, then reset;
+        the last tick's values when no tick ran in between (groups slower than the caller).
+        """
+        if self.ticks == self._peak_ticks:
+            return self.last_duration, self.last_lateness
+        peaks = (self.peak_duration, self.peak_lateness)
+        self.peak_duration = self.peak_lateness = 0.0
+        self._peak_ticks = self.ticks
+        return peaks
+
+
+class TickScheduler:
+    """
+    Run several RateGroups on absolute deadlines: tick k of a group is due at start + k * period.
+
+    callback 收到該 tick 的排程時間（wall clock 秒），因此模擬值對應的是 deadline 而非實際執行時間。
+    """
+
+    def __init__(self):
+        self.groups: List[RateGroup] = []
+
+    def add_group(self, name, rate_hz, callback: Callable[[float], Awaitable[None]]) -> RateGroup:
+        group = RateGroup(name, rate_hz, callback)
+        self.groups.append(group)
+        return group
+
+    def stats(self) -> dict:
+        return {g.name: g.stats() for g in self.groups}
+
+    async def run(self):
+        await asyncio.gather(*(self._run_group(g) for g in self.groups))
+
+    async def _run_group(self, group: RateGroup):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        wall_offset = time.time() - start
+        k = 0
+        while True:
+            deadline = start + k * group.period
+            delay = deadline - loop.time()
+            # delay <= 0 時也要讓出 event loop，避免落後時餓死其他 group / server
+            await asyncio.sleep(max(delay, 0))
+            now = loop.time()
+            lateness = now - deadline
+            if lateness >= group.period:
+                # 落後一個週期以上：跳到最近的 deadline，並記錄跳過幾個 tick
+                skipped = int(lateness // group.period)
+                group.missed += skipped
+                k += skipped
+                deadline += skipped * group.period
+                lateness = now - deadline
+                self._report_missed(group, now)
+            group.last_lateness = lateness
+            group.max_lateness = max(group.max_lateness, lateness)
+            group.peak_lateness = max(group.peak_lateness, lateness)
+
+            try:
+                await group.callback(deadline + wall_offset)
+            except Exception as e:
+                print(f"[Error] group {group.name} tick 失敗：{e}")
+            duration = loop.time() - now
+            group.ticks += 1
+            group.last_duration = duration
+            group.max_duration = max(group.max_duration, duration)
+            group.peak_duration = max(group.peak_duration, duration)
+            if duration > group.period:
+                group.overruns += 1
+            k += 1
+
+    @staticmethod
+    def _report_missed(group: RateGroup, now):
+        if now - group._reported_at < MISSED_REPORT_INTERVAL:
+            return
+        print(f"[Warning] group {group.name}（{group.rate_hz:g} Hz）落後，累計跳過 {group.missed} 個 tick"
+              f"（+{group.missed - group._reported_missed}），overruns={group.overruns}")
+        group._reported_missed = group.missed
+        group._reported_at = now
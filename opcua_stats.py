@@ -0,0 +1,157 @@
+# opcua_stats.py
+"""
+Incrementally maintained rolling-window statistics (avg / min / max / std) for many signals at once.
+
+- RollingWindow：一個時間窗（例如 60 秒）切成固定數量的 bucket，每個 bucket 存 count / sum / sumsq / min / max
+  （NumPy 陣列，一列一個 bucket、一欄一個 signal）。add() 只更新目前的 bucket 與 running total（O(1)，與窗內樣本數無關），
+  時間前進時把過期的 bucket 從 total 扣掉再清空；min / max 讀取時取各 bucket 的 min / max（固定 B 個）
+- RollingStats：同一組 signal 的多個時間窗（預設 10s / 1m / 1h），一次 add() 全部更新
+
+時間窗的解析度是 window / buckets（預設 60 個 bucket：1m 窗以 1 秒為單位滑動、1h 窗以 1 分鐘為單位），
+記憶體固定為 windows × buckets × signals，與取樣頻率無關。
+
+用法：
+    stats = RollingStats(3, parse_windows("10s,1m,1h"))
+    stats.add(time.time(), [451.0, 230.0, 780.0])
+    table = stats.aggregate()              # shape (3, len(windows), len(STAT_FUNCTIONS))
+    stats.names()                          # ["Avg_10s", "Min_10s", ..., "Std_1h"]，對應 table.reshape(3, -1) 的欄
+"""
+
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+STAT_FUNCTIONS = ("Avg", "Min", "Max", "Std")
+DEFAULT_WINDOWS = "10s,1m,1h"
+DEFAULT_BUCKETS = 60
+WINDOW_UNITS = {"s": 1.0, "m": 60.0, "h": 3600.0, "d": 86400.0}
+
+
+def parse_windows(text) -> Dict[str, float]:
+    """``"10s,1m,1h"`` -> {"10s": 10.0, "1m": 60.0, "1h": 3600.0}（數字不帶單位視為秒）；空字串 -> {}"""
+    windows = {}
+    for label in filter(None, (x.strip() for x in (text or "").split(","))):
+        unit = label[-1].lower()
+        try:
+            seconds = float(label[:-1]) * WINDOW_UNITS[unit] if unit in WINDOW_UNITS else float(label)
+        except ValueError:
+            raise ValueError(f"invalid window: {label!r} (e.g. 10s, 1m, 1h)")
+        if seconds <= 0:
+            raise ValueError(f"invalid window: {label!r} (must be > 0)")
+        windows[label] = seconds
+    return windows
+
+
+def stat_names(windows) -> List[str]:
+    """Child variable names for ``windows`` (labels), e.g. Avg_1m, in aggregate() column order."""
+    return [f"{fn}_{label}" for label in windows for fn in STAT_FUNCTIONS]
+
+
+class RollingWindow:
+    """Sliding time window over ``n`` signals, split into ``buckets`` fixed-width buckets."""
+
+    def __init__(self, window, n, buckets=DEFAULT_BUCKETS):
+        self.window = float(window)
+        self.buckets = int(buckets)
+        self.width = self.window / self.buckets
+        shape = (self.buckets, n)
+        self.count = np.zeros(shape)
+        self.sum = np.zeros(shape)
+        self.sumsq = np.zeros(shape)
+        self.min = np.full(shape, np.inf)
+        self.max = np.full(shape, -np.inf)
+        self.total_count = np.zeros(n)
+        self.total_sum = np.zeros(n)
+        self.total_sumsq = np.zeros(n)
+        # sum / sumsq 以 (x - shift) 累加（shift = 每個 signal 第一個值），避免 sumsq - sum² 的相消誤差
+        self.shift = np.full(n, np.nan)
+        self.slot: Optional[int] = None  # 目前 bucket 的絕對編號 floor(t / width)
+
+    def add(self, t, values: np.ndarray):
+        self.advance(t)
+        b = self.slot % self.buckets
+        ok = ~np.isnan(values)
+        self.shift = np.where(np.isnan(self.shift) & ok, values, self.shift)
+        d = np.where(ok, values - self.shift, 0.0)
+        self.count[b] += ok
+        self.sum[b] += d
+        self.sumsq[b] += d * d
+        self.total_count += ok
+        self.total_sum += d
+        self.total_sumsq += d * d
+        # fmin / fmax 忽略 NaN
+        np.fmin(self.min[b], values, out=self.min[b])
+        np.fmax(self.max[b], values, out=self.max[b])
+
+    def advance(self, t):
+        """Move the current bucket to time ``t``, evicting the buckets that fell out of the window."""
+        slot = int(t // self.width)
+        if self.slot is None:
+            self.slot = slot
+            return
+        if slot <= self.slot:
+            # 時間沒前進（或倒退）：算在目前的 bucket
+            return
+        for s in range(self.slot + 1, min(slot, self.slot + self.buckets) + 1):
+            b = s % self.buckets
+            self.total_count -= self.count[b]
+            self.total_sum -= self.sum[b]
+            self.total_sumsq -= self.sumsq[b]
+            self.count[b] = 0.0
+            self.sum[b] = 0.0
+            self.sumsq[b] = 0.0
+            self.min[b] = np.inf
+            self.max[b] = -np.inf
+        if slot // self.buckets != self.slot // self.buckets:
+            # 每繞一圈由 bucket 重新加總一次，running total 的浮點誤差不會一直累積
+            self.total_count = self.count.sum(axis=0)
+            self.total_sum = self.sum.sum(axis=0)
+            self.total_sumsq = self.sumsq.sum(axis=0)
+        self.slot = slot
+
+    def aggregate(self) -> np.ndarray:
+        """Array of shape (n, len(STAT_FUNCTIONS)); NaN for signals without samples in the window."""
+        n = self.total_count
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = self.total_sum / n
+            var = np.maximum(self.total_sumsq / n - mean * mean, 0.0)
+            low = self.min.min(axis=0)
+            high = self.max.max(axis=0)
+        empty = n <= 0
+        out = np.column_stack([mean + self.shift, low, high, np.sqrt(var)])
+        out[empty] = np.nan
+        return out
+
+
+class RollingStats:
+    """Several RollingWindows over the same signals, updated together."""
+
+    def __init__(self, n, windows: Dict[str, float], buckets=DEFAULT_BUCKETS):
+        self.n = int(n)
+        self.windows = {label: RollingWindow(seconds, self.n, buckets) for label, seconds in windows.items()}
+        self.samples = 0
+
+    def names(self) -> List[str]:
+        return stat_names(self.windows)
+
+    def add(self, t, values: Sequence[float]):
+        values = np.asarray(values, dtype=np.float64)
+        if values.shape != (self.n,):
+            raise ValueError(f"expected {self.n} values, got {values.shape}")
+        for window in self.windows.values():
+            window.add(t, values)
+        self.samples += 1
+
+    def aggregate(self, t=None) -> np.ndarray:
+        """
+        Statistics at time ``t`` (default: now), shape (n, len(windows), len(STAT_FUNCTIONS)).
+
+        先把每個時間窗推進到 t，沒有新樣本時過期的值也會離開時間窗。
+        """
+        t = time.time() if t is None else t
+        out = np.empty((self.n, len(self.windows), len(STAT_FUNCTIONS)))
+        for k, window in enumerate(self.windows.values()):
+            window.advance(t)
+            out[:, k] = window.aggregate()
+        return out
@@ -0,0 +1,302 @@
+# process_monitor.py
+"""
+Resource sampling and health probes for the processes started by server_UI.py.
+
+- ProcSampler：讀 /proc 取得 CPU% / RSS / thread 數 / 開啟的 fd 數（連同子程序一起算；
+  Flask debug reloader 實際服務的是子程序）。沒有 /proc 時改用 psutil，兩者都沒有就不取樣
+- OpcuaProbe / HttpProbe：主動健康檢查（OPC UA Read ServerStatus.State、HTTP GET /data），回傳 latency；
+  ProbeGroup 把多個 probe（例如每個 shard 一個）當成一個
+- HealthCheck：每個 process 一個背景 thread，定期取樣 + 探測，保留最近 HISTORY_POINTS 點給 sparkline；
+  探測連續失敗達門檻（且已過啟動寬限期）時設定 restart_requested，由 GUI thread 負責重啟
+
+用法：
+    check = HealthCheck("vue", pid_fn=mp.pid, probe=HttpProbe("http://localhost:5000/data")).start()
+    ...
+    if check.restart_requested: ...
+"""
+
+import os
+import threading
+import time
+import urllib.request
+from collections import deque
+from typing import Callable, Dict, Optional
+
+try:
+    import psutil  # optional：沒有 /proc 的平台（Windows / macOS）改用它
+except ImportError:
+    psutil = None
+
+# ---------- Config ----------
+SAMPLE_INTERVAL = 1.0      # 取樣間隔（秒）
+PROBE_INTERVAL = 2.0       # 健康檢查間隔（秒）
+PROBE_TIMEOUT = 2.0        # 單次健康檢查逾時（秒）
+PROBE_FAILURES = 3         # 連續失敗幾次就要求重啟
+PROBE_GRACE = 15.0         # process 啟動後幾秒內不判定失敗（server 建立節點 / Flask 啟動需要時間）
+CHILD_SCAN_INTERVAL = 5.0  # 多久重新掃描一次子程序（掃 /proc 全部 process 較貴）
+HISTORY_POINTS = 60        # sparkline 保留的點數
+# ----------------------------
+
+_HAS_PROC = os.path.isdir("/proc/self")
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _read_stat(pid) -> list:
+    # /proc/<pid>/stat：comm 可能含空白，從最後一個 ')' 之後切欄位（index 0 = state）
+    with open(f"/proc/{pid}/stat") as f:
+        return f.read().rsplit(")", 1)[1].split()
+
+
+def _children_by_scan(pid) -> list:
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                parents[int(entry)] = int(_read_stat(entry)[1])
+            except (OSError, IndexError, ValueError):
+                pass
+    tree, frontier = [], [pid]
+    while frontier:
+        parent = frontier.pop()
+        children = [p for p, pp in parents.items() if pp == parent]
+        tree.extend(children)
+        frontier.extend(children)
+    return tree
+
+
+class ProcSampler:
+    """CPU% / RSS / threads / fds of one process tree, sampled on demand."""
+
+    def __init__(self):
+        self._pid = None
+        self._children = []
+        self._scanned_at = 0.0
+        self._last = None  # (wall time, cpu seconds)
+
+    def sample(self, pid) -> Optional[Dict[str, float]]:
+        """Return ``{"cpu", "rss", "threads", "fds"}`` for ``pid`` and its children (cpu is None on the first sample)."""
+        if pid != self._pid:
+            self._pid, self._children, self._scanned_at, self._last = pid, [], 0.0, None
+        now = time.time()
+        if _HAS_PROC:
+            totals = self._sample_proc(pid, now)
+        elif psutil is not None:
+            totals = self._sample_psutil(pid)
+        else:
+            return None
+        if totals is None:
+            return None
+        cpu_seconds, rss, threads, fds = totals
+        cpu = None
+        if self._last is not None:
+            t_prev, cpu_prev = self._last
+            cpu = 100.0 * (cpu_seconds - cpu_prev) / max(now - t_prev, 1e-6)
+        self._last = (now, cpu_seconds)
+        return {"cpu": cpu, "rss": rss, "threads": threads, "fds": fds}
+
+    def _sample_proc(self, pid, now):
+        if now - self._scanned_at >= CHILD_SCAN_INTERVAL:
+            self._children = _children_by_scan(pid)
+            self._scanned_at = now
+        cpu = rss = threads = fds = 0
+        found = False
+        for p in [pid] + self._children:
+            try:
+                fields = _read_stat(p)
+                cpu += (int(fields[11]) + int(fields[12])) / _CLK_TCK
+                threads += int(fields[17])
+                rss += int(fields[21]) * _PAGE_SIZE
+                found = True
+                fds += len(os.listdir(f"/proc/{p}/fd"))
+            except (OSError, IndexError, ValueError):
+                # 子程序已結束（下次掃描會更新）或沒有權限讀 fd
+                continue
+        return (cpu, rss, threads, fds) if found else None
+
+    def _sample_psutil(self, pid):
+        try:
+            root = psutil.Process(pid)
+            procs = [root] + root.children(recursive=True)
+        except psutil.Error:
+            return None
+        cpu = rss = threads = fds = 0
+        for p in procs:
+            try:
+                t = p.cpu_times()
+                cpu += t.user + t.system
+                rss += p.memory_info().rss
+                threads += p.num_threads()
+                fds += p.num_fds() if hasattr(p, "num_fds") else p.num_handles()
+            except psutil.Error:
+                continue
+        return cpu, rss, threads, fds
+
+
+# -------------------------
+# Probes：成功回傳 latency（秒），失敗 raise
+# -------------------------
+class HttpProbe:
+    """HTTP GET ``url``; any 2xx response within the timeout counts as healthy."""
+
+    def __init__(self, url, timeout=PROBE_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+
+    def __call__(self) -> float:
+        start = time.perf_counter()
+        with urllib.request.urlopen(self.url, timeout=self.timeout) as resp:
+            resp.read()
+        return time.perf_counter() - start
+
+    def close(self):
+        pass
+
+
+class OpcuaProbe:
+    """
+    Read ServerStatus.State over a long-lived OpcuaSession (no connect / disconnect per probe).
+    Server 卡住時 session 的 keepalive 或這次 Read 會逾時，因此視為失敗。
+    """
+
+    def __init__(self, url, timeout=PROBE_TIMEOUT):
+        # 延後 import：沒有 OPC UA probe 的情況下 server_UI 不需要 asyncua
+        from opcua_session import OpcuaSession
+
+        self.url = url
+        self.timeout = timeout
+        # backoff 上限要比 PROBE_GRACE 短，server 重啟後才能及時重連
+        self.session = OpcuaSession(url, timeout=timeout, backoff_max=2.0, name="server_UI-probe")
+
+    def __call__(self) -> float:
+        from asyncua import ua
+
+        async def read_state(client):
+            return await client.get_node(ua.ObjectIds.Server_ServerStatus_State).read_value()
+
+        start = time.perf_counter()
+        state = self.session.run(read_state, timeout=self.timeout + 1.0)
+        if state != ua.ServerState.Running:
+            raise RuntimeError(f"server state {state}")
+        return time.perf_counter() - start
+
+    def close(self):
+        self.session.stop()
+
+
+class ProbeGroup:
+    """Several named probes checked as one: healthy only if every probe is, latency is the slowest one."""
+
+    def __init__(self, probes: Dict[str, Callable[[], float]]):
+        self.probes = dict(probes)
+
+    def __call__(self) -> float:
+        latency = 0.0
+        for name, probe in self.probes.items():
+            try:
+                latency = max(latency, probe())
+            except Exception as e:
+                raise RuntimeError(f"{name}: {type(e).__name__}: {e}") from e
+        return latency
+
+    def close(self):
+        for probe in self.probes.values():
+            probe.close()
+
+
+# -------------------------
+# Health check
+# -------------------------
+class HealthCheck:
+    """Sample one managed process (and optionally probe it) in a background thread."""
+
+    def __init__(self, name, pid_fn: Callable[[], Optional[int]], probe=None, auto_restart=True):
+        self.name = name
+        self.pid_fn = pid_fn
+        self.probe = probe
+        self.auto_restart = auto_restart
+        self.sampler = ProcSampler()
+        self.cpu = deque(maxlen=HISTORY_POINTS)
+        self.rss = deque(maxlen=HISTORY_POINTS)
+        self.latency = deque(maxlen=HISTORY_POINTS)
+        self.last_sample: Optional[Dict[str, float]] = None
+        self.probe_ok: Optional[bool] = None  # None = 尚未探測 / 寬限期內 / process 未執行
+        self.last_latency: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.failures = 0
+        self.restarts = 0
+        self.restart_requested = False
+        self.version = 0  # 每次更新 +1，GUI 用來判斷是否需要重畫
+        self._pid = None
+        self._started_at = 0.0
+        self._probed_at = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"health-{name}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(PROBE_TIMEOUT + 1.0)
+        if self.probe is not None:
+            self.probe.close()
+
+    def in_grace(self) -> bool:
+        return time.time() - self._started_at < PROBE_GRACE
+
+    def _run(self):
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            try:
+                self._tick()
+            except Exception as e:
+                self.last_error = str(e)
+
+    def _tick(self):
+        pid = self.pid_fn()
+        if pid is None:
+            if self._pid is not None:
+                self._pid = None
+                self.last_sample, self.probe_ok, self.failures = None, None, 0
+                if self.probe is not None:
+                    self.probe.close()  # process 停止時不要在背景一直重連
+                self.version += 1
+            return
+        if pid != self._pid:
+            # 新的 process（手動啟動或自動重啟）：清除舊資料並重新計算寬限期
+            self._pid, self._started_at, self.failures, self.probe_ok = pid, time.time(), 0, None
+            self.cpu.clear()
+            self.rss.clear()
+            self.latency.clear()
+
+        sample = self.sampler.sample(pid)
+        self.last_sample = sample
+        if sample is not None:
+            if sample["cpu"] is not None:
+                self.cpu.append(sample["cpu"])
+            self.rss.append(sample["rss"] / 2 ** 20)
+
+        now = time.time()
+        if self.probe is not None and now - self._probed_at >= PROBE_INTERVAL:
+            self._probed_at = now
+            self._run_probe()
+        self.version += 1
+
+    def _run_probe(self):
+        try:
+            latency = self.probe()
+        except Exception as e:
+            self.last_latency = None
+            self.last_error = f"{type(e).__name__}: {e}"
+            if self.in_grace():
+                return
+            self.probe_ok = False
+            self.failures += 1
+            if self.auto_restart and self.failures >= PROBE_FAILURES and not self.restart_requested:
+                self.restart_requested = True
+            return
+        self.probe_ok = True
+        self.failures = 0
+        self.last_latency = latency
+        self.latency.append(latency * 1000.0)
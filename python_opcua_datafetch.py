@@ -0,0 +1,164 @@
+# python_opcua_datafetch.py
+# 資料記錄程式（server_UI.py 的第三個受管程式）：
+#   - 訂閱設定的 tag（SensorData 的 6 個變數 + 可選的 Simulation 變數），通知整批轉成 NumPy 陣列放進記憶體 buffer
+#   - writer thread 每 FLUSH_INTERVAL 秒（或累積 FLUSH_ROWS 筆）一次寫入 SQLite（一個 transaction）或 .opclog columnar 檔
+#   - buffer 滿時延後下一個 Publish request（背壓），不會無限吃記憶體；通知留在 server 端的 monitored item queue
+#   - 檔案依大小（DATAFETCH_ROTATE_MB）與時間（DATAFETCH_ROTATE_S）換新檔：logs/datafetch-<時間>.sqlite|.opclog
+#   - OPCUA_SHARDS > 0 時每個 shard 一個 session（與 vue_flask_api.py 相同的 tag 分配）
+#   - 每 REPORT_INTERVAL 秒印出收到 / 寫入筆數、buffer 使用量與背壓時間
+# 格式與查看方式見 opcua_logger.py（python opcua_logger.py info <檔案>）
+
+import os
+import time
+import signal
+import asyncio
+from typing import Dict, Sequence
+
+import opcua_logger
+from opcua_logger import DataLogger, create_batch_subscription
+from opcua_session import OpcuaSession, TagMap, load_tags
+from opcua_shards import SHARDS, shard_range, shard_url, simulation_tags
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# ---------- Config ----------
+OPCUA_URL = os.environ.get("OPCUA_URL", "opc.tcp://localhost:4840/freeopcua/server/")
+
+# 記錄的 tag 名稱 -> browse path（與 vue_flask_api.py 相同，可用 OPCUA_TAGS_FILE / opcua_tags.json 覆寫）
+DEFAULT_TAGS = {
+    "temperature": ["0:Objects", "2:SensorData", "2:Temperature"],
+    "weight": ["0:Objects", "2:SensorData", "2:Weight"],
+    "tray1": ["0:Objects", "2:SensorData", "2:Tray1_vol"],
+    "tray2": ["0:Objects", "2:SensorData", "2:Tray2_vol"],
+    "tray3": ["0:Objects", "2:SensorData", "2:Tray3_vol"],
+    "tray4": ["0:Objects", "2:SensorData", "2:Tray4_vol"],
+}
+TAGS_FILE = os.environ.get("OPCUA_TAGS_FILE", os.path.join(BASE_DIR, "opcua_tags.json"))
+# Simulation 物件也一起記錄（需與 server 的設定相同，0 = 不記錄）
+SIM_OBJECTS = int(os.environ.get("SIM_OBJECTS", "0"))
+SIM_VARIABLES = int(os.environ.get("SIM_VARIABLES", "10"))
+
+# 儲存：sqlite / columnar（.opclog）
+LOG_FORMAT = os.environ.get("DATAFETCH_FORMAT", "sqlite")
+LOG_DIR = os.environ.get("DATAFETCH_DIR", os.path.join(BASE_DIR, "logs"))
+ROTATE_BYTES = int(float(os.environ.get("DATAFETCH_ROTATE_MB", "256")) * 1024 ** 2)
+ROTATE_SECONDS = float(os.environ.get("DATAFETCH_ROTATE_S", "3600"))
+BUFFER_ROWS = int(os.environ.get("DATAFETCH_BUFFER_ROWS", str(opcua_logger.BUFFER_ROWS)))
+FLUSH_INTERVAL = float(os.environ.get("DATAFETCH_FLUSH_S", str(opcua_logger.FLUSH_INTERVAL)))
+
+# Subscription：publishing interval（ms）、sampling interval（ms，0 = server 每次寫入都取樣）、
+# 每個 monitored item 在 server 端最多保留幾個還沒送出的值（> 1 才不會在 publishing interval 內只剩最後一個值）
+INTERVAL_MS = int(os.environ.get("DATAFETCH_INTERVAL_MS", "100"))
+SAMPLING_MS = float(os.environ.get("DATAFETCH_SAMPLING_MS", "0"))
+QUEUE_SIZE = int(os.environ.get("DATAFETCH_QUEUE_SIZE", "10"))
+# 單一 request 的逾時（秒）：數千個 tag 的 TranslateBrowsePaths / CreateMonitoredItems 在忙碌的 server 上要好幾秒
+REQUEST_TIMEOUT = float(os.environ.get("DATAFETCH_TIMEOUT", "30"))
+WATCHDOG_INTERVAL = 10.0  # asyncua 檢查 server 存活的間隔（秒）
+
+REPORT_INTERVAL = 10.0  # 多久印一次統計（秒）
+# ----------------------------
+
+
+class Source:
+    """One server: an OpcuaSession whose on-connect hook resolves the tags and (re)creates a BatchSubscription."""
+
+    def __init__(self, name, url, tags: Dict[str, Sequence[str]], index: Dict[str, int], logger: DataLogger):
+        self.name = name
+        self.index = index  # tag 名稱 -> logger 的 tag index
+        self.logger = logger
+        self.session = OpcuaSession(url, timeout=REQUEST_TIMEOUT, name=name, watchdog=WATCHDOG_INTERVAL)
+        self.tagmap = TagMap(tags)
+        self.subscription = None
+        self.session.add_on_connect(self.tagmap.refresh)
+        self.session.add_on_connect(self._subscribe)
+
+    async def _subscribe(self, client):
+        self.subscription = None
+        if not self.tagmap.nodeids:
+            await self.tagmap.refresh(client)
+        by_nodeid = {nodeid: self.index[name] for name, nodeid in self.tagmap.nodeids.items()}
+        subscription = await create_batch_subscription(client, INTERVAL_MS, self, by_nodeid, self.logger.put)
+        nodes = [client.get_node(nodeid) for nodeid in by_nodeid]
+        # 一次 request 建立全部 monitored item
+        await subscription.subscribe_data_change(nodes, queuesize=QUEUE_SIZE, sampling_interval=SAMPLING_MS)
+        self.subscription = subscription
+        print(f"[OK] {self.name}: 已訂閱 {len(nodes)} 個 tag（{INTERVAL_MS} ms，queue {QUEUE_SIZE}）")
+
+    # asyncua subscription handler（DataChange 由 BatchSubscription 整批處理，不經過這裡）
+    def status_change_notification(self, status):
+        print(f"[Warning] {self.name}: subscription 狀態改變：{getattr(status, 'Status', status)}")
+        self.subscription = None
+
+
+def source_plan():
+    """[(source name, url, {tag: browse path})] for the configured server or shards."""
+    sensor_tags = load_tags(TAGS_FILE, DEFAULT_TAGS)
+    if SHARDS <= 0:
+        tags = dict(sensor_tags)
+        tags.update(simulation_tags(0, SIM_OBJECTS, SIM_VARIABLES))
+        return [("datafetch", OPCUA_URL, tags)]
+    plan = []
+    for index in range(SHARDS):
+        # 與 opcua_shards.shard_endpoints() 相同：shard 0 負責 SensorData
+        tags = dict(sensor_tags) if index == 0 else {}
+        tags.update(simulation_tags(*shard_range(SIM_OBJECTS, SHARDS, index), SIM_VARIABLES))
+        plan.append((f"datafetch-shard{index}", shard_url(index), tags))
+    return plan
+
+
+def report(logger: DataLogger, last: dict, elapsed) -> dict:
+    stats = logger.stats()
+    rate_in = (stats["received"] - last.get("received", 0)) / elapsed
+    rate_out = (stats["written"] - last.get("written", 0)) / elapsed
+    print(f"[OK] datafetch：收到 {rate_in:,.0f}/s、寫入 {rate_out:,.0f}/s（累計 {stats['written']:,} 筆），"
+          f"buffer {stats['buffered']:,}/{logger.buffer.capacity:,}（峰值 {stats['buffer_peak']:,}），"
+          f"上次寫入 {stats['last_flush'] * 1000:.0f} ms，背壓 {stats['backpressure']:.1f} s"
+          + (f"，寫入失敗 {stats['errors']} 次、丟棄 {stats['dropped']:,} 筆" if stats["errors"] or stats["dropped"]
+             else ""))
+    return stats
+
+
+async def main():
+    plan = source_plan()
+    names = [name for _, _, tags in plan for name in tags]
+    index = {name: i for i, name in enumerate(names)}
+    logger = DataLogger(names, LOG_DIR, fmt=LOG_FORMAT, meta={"sources": {name: url for name, url, _ in plan}},
+                        capacity=BUFFER_ROWS, flush_interval=FLUSH_INTERVAL, rotate_bytes=ROTATE_BYTES,
+                        rotate_seconds=ROTATE_SECONDS)
+    sources = [Source(name, url, tags, index, logger) for name, url, tags in plan]
+    logger.start()
+    print(f"[OK] datafetch：{len(names)} 個 tag、{len(sources)} 個 server -> {LOG_DIR}（{LOG_FORMAT}）")
+
+    # server_UI 的 Stop（SIGTERM）/ Ctrl+C：停止訂閱、寫完 buffer 再結束
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+
+    def request_stop(*_):
+        loop.call_soon_threadsafe(stopping.set)
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    if hasattr(signal, "SIGBREAK"):
+        signal.signal(signal.SIGBREAK, request_stop)
+
+    # 全部 session 跑在這個 loop 上（不另開 thread）
+    for source in sources:
+        await source.session.start_async()
+    last, last_at = {}, time.perf_counter()
+    try:
+        while not stopping.is_set():
+            try:
+                await asyncio.wait_for(stopping.wait(), REPORT_INTERVAL)
+            except asyncio.TimeoutError:
+                now = time.perf_counter()
+                last, last_at = report(logger, last, now - last_at), now
+    finally:
+        for source in sources:
+            await source.session.stop_async()
+        await asyncio.get_running_loop().run_in_executor(None, logger.stop)
+        stats = logger.stats()
+        print(f"[Stopped] datafetch：共寫入 {stats['written']:,} 筆，{len(logger.files)} 個檔案")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
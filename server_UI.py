@@ -15,8 +15,11 @@ import threading
 import queue
 import time
 import signal
+import re
 import tkinter as tk
 from tkinter import ttk, messagebox, scrolledtext
+from process_monitor import HealthCheck, HttpProbe, OpcuaProbe, ProbeGroup
+from opcua_shards import shard_url
 
 # -------------------------
 # CONFIG: 修改這裡以配合你的檔名 / 路徑
@@ -27,30 +30,62 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 # OPCUA_SERVER_SCRIPT = os.path.join(BASE_DIR, "opcua_server.py") # Real Sensor Data on Opcua
 OPCUA_SERVER_SCRIPT = os.path.join(BASE_DIR, "OPCUA_local_RandomValue_serve.py") # Random Value Data on Opcua
 VUE_FLASK_SCRIPT = os.path.join(BASE_DIR, "vue_flask_api.py")
+# VUE_FLASK_SCRIPT = os.path.join(BASE_DIR, "vue_async_api.py") # aiohttp 版（同一個 event loop，高併發）
 DATA_FETCH_SCRIPT = os.path.join(BASE_DIR, "python_opcua_datafetch.py")
 
+# 分片模擬：OPCUA_SHARDS > 1 時 OPC UA Server 改為執行 opcua_shards.py，啟動 N 個 shard（port 4840 起，各自一個 process / core），
+# vue_flask_api 也會收到同樣的 OPCUA_SHARDS，把 N 個 shard 聚合成一個 /data（SIM_OBJECTS / SIM_VARIABLES 以環境變數設定）
+OPCUA_SHARDS = int(os.environ.get("OPCUA_SHARDS", "0"))
+SHARD_LAUNCHER_SCRIPT = os.path.join(BASE_DIR, "opcua_shards.py")
+
+# 健康檢查：OPC UA server 以 Read ServerStatus.State、Flask API 以 GET /data 探測
+OPCUA_PROBE_URL = "opc.tcp://localhost:4840/freeopcua/server/"
+HTTP_PROBE_URL = "http://localhost:5000/data"
+AUTO_RESTART = True  # 健康檢查連續失敗時自動重啟該程式
+
 # -------------------------
 # 內部使用（不要改）
 # -------------------------
 PYTHON_EXE = sys.executable
 READ_INTERVAL_MS = 200   # GUI 每多少毫秒檢查 queue 並更新 terminal
 LOG_LINE_PREFIX = "[{time}] "
+LOG_MAX_LINES = 2000     # 每個 terminal 最多保留幾行（超過就刪掉最舊的）
+QUEUE_MAX_LINES = 10000  # 每個子程序輸出 queue 的上限；滿了就丟棄並計數，避免吃光記憶體
+MAX_LINES_PER_REFRESH = LOG_MAX_LINES  # 每次 refresh 最多處理幾行（更舊的直接略過）
+HEALTH_REFRESH_MS = 1000  # 資源 / 健康狀態（sparkline）多久更新一次畫面
+SPARK_WIDTH, SPARK_HEIGHT = 90, 22
+SHARD_PREFIX = re.compile(r"^\[shard\d+\]\s*")  # opcua_shards.py 轉出的每一行前綴
 
 # -------------------------
 # Process wrapper
 # -------------------------
 class ManagedProcess:
-    def __init__(self, label, script_path):
+    def __init__(self, label, script_path, env=None):
         self.label = label
         self.script = script_path
+        self.env = dict(env or {})  # 額外的環境變數
         self.proc = None
         self.stdout_thread = None
-        self.queue = queue.Queue()
+        self.queue = queue.Queue(maxsize=QUEUE_MAX_LINES)
         self.alive_lock = threading.Lock()
+        self.dropped = 0  # 因 queue 已滿或 UI 跟不上而丟棄的行數
+
+    def put_line(self, line, ts=None):
+        """Queue one output line without blocking; count it as dropped if the queue is full."""
+        try:
+            self.queue.put_nowait((ts or time.strftime("%H:%M:%S"), line))
+        except queue.Full:
+            with self.alive_lock:
+                self.dropped += 1
 
     def is_running(self):
         return self.proc is not None and self.proc.poll() is None
 
+    def pid(self):
+        """PID of the running child, or None (safe to call from other threads)."""
+        proc = self.proc
+        return proc.pid if proc is not None and proc.poll() is None else None
+
     def start(self):
         if self.is_running():
             return True
@@ -61,6 +96,7 @@ class ManagedProcess:
             # optional: ensure child uses utf-8 output (可解 emoji / 編碼問題)
             env = os.environ.copy()
             env.setdefault("PYTHONIOENCODING", "utf-8")
+            env.update(self.env)
 
             self.proc = subprocess.Popen(
                 [PYTHON_EXE, self.script],
@@ -86,8 +122,7 @@ class ManagedProcess:
             return
         try:
             for line in self.proc.stdout:
-                ts = time.strftime("%H:%M:%S")
-                self.queue.put((ts, line.rstrip("\n")))
+                self.put_line(line.rstrip("\n"))
         except Exception:
             pass
         finally:
@@ -97,7 +132,7 @@ class ManagedProcess:
                 rc = self.proc.returncode
             except Exception:
                 rc = None
-            self.queue.put((time.strftime("%H:%M:%S"), f"[Process exited: returncode={rc}]"))
+            self.put_line(f"[Process exited: returncode={rc}]")
 
     def terminate(self, timeout=2.0):
         if not self.proc:
@@ -129,15 +164,36 @@ class ManagerApp:
         root.geometry("1100x720")
 
         # create managed processes
+        # 分片時 OPC UA Server 是 opcua_shards.py（它的子程序就是各個 shard，CPU / RSS 連同子程序一起算）
+        sharded = OPCUA_SHARDS > 1
+        shard_env = {"OPCUA_SHARDS": str(OPCUA_SHARDS)} if sharded else {}
         self.procs = {
-            "opcua": ManagedProcess("OPC UA Server", OPCUA_SERVER_SCRIPT),
-            "vue": ManagedProcess("vue_flask_api", VUE_FLASK_SCRIPT),
+            "opcua": ManagedProcess(f"OPC UA Server ×{OPCUA_SHARDS}" if sharded else "OPC UA Server",
+                                    SHARD_LAUNCHER_SCRIPT if sharded else OPCUA_SERVER_SCRIPT, env=shard_env),
+            "vue": ManagedProcess("vue_flask_api", VUE_FLASK_SCRIPT, env=shard_env),
             "data": ManagedProcess("python_opcua_datafetch", DATA_FETCH_SCRIPT),
         }
 
+        # 每個 process 的資源取樣 + 健康檢查（背景 thread，不會卡住 GUI）
+        # 分片時探測每個 shard，任何一個失敗就重啟整組
+        if sharded:
+            opcua_probe = ProbeGroup({f"shard{i}": OpcuaProbe(shard_url(i)) for i in range(OPCUA_SHARDS)})
+        else:
+            opcua_probe = OpcuaProbe(OPCUA_PROBE_URL)
+        self.health = {
+            "opcua": HealthCheck("opcua", self.procs["opcua"].pid, opcua_probe, AUTO_RESTART),
+            "vue": HealthCheck("vue", self.procs["vue"].pid, HttpProbe(HTTP_PROBE_URL), AUTO_RESTART),
+            "data": HealthCheck("data", self.procs["data"].pid),
+        }
+        self._health_drawn = {}  # key -> 已畫到畫面上的 HealthCheck.version
+
+        self._dropped_shown = {}  # key -> 已在 terminal 提示過的 dropped 數
         self._build_ui()
         # schedule periodic terminal update
         self._refresh_terminals()
+        for check in self.health.values():
+            check.start()
+        self._refresh_health()
 
         # ensure clean shutdown
         root.protocol("WM_DELETE_WINDOW", self._on_close)
@@ -202,6 +258,24 @@ class ManagerApp:
         btn.pack(anchor=tk.W, pady=(0,6))
         mp._ui["button"] = btn
 
+        # 資源 / 健康狀態：一行文字 + CPU / RSS / probe latency 三個 sparkline
+        stats = ttk.Label(card, text="CPU -  RSS -  threads -  fds -", font=("Arial", 9))
+        stats.pack(anchor=tk.W)
+        probe = ttk.Label(card, text="probe: -", font=("Arial", 9))
+        probe.pack(anchor=tk.W)
+        spark_frm = ttk.Frame(card)
+        spark_frm.pack(anchor=tk.W, pady=(2,6))
+        mp._ui["stats"] = stats
+        mp._ui["probe"] = probe
+        mp._ui["sparks"] = {}
+        for col, (name, color) in enumerate((("cpu", "steelblue"), ("rss", "seagreen"), ("latency", "darkorange"))):
+            tk.Label(spark_frm, text=name, font=("Arial", 8), foreground="gray30").grid(row=0, column=col)
+            spark = tk.Canvas(spark_frm, width=SPARK_WIDTH, height=SPARK_HEIGHT, background="white",
+                              highlightthickness=1, highlightbackground="gray80")
+            spark.grid(row=1, column=col, padx=(0,4))
+            line = spark.create_line(0, 0, 0, 0, fill=color)
+            mp._ui["sparks"][name] = (spark, line)
+
         # small note
         note = ttk.Label(card, text="說明: 開啟後可在下方 terminal 看到即時輸出。", font=("Arial", 9))
         note.pack(anchor=tk.W)
@@ -211,7 +285,9 @@ class ManagerApp:
         canvas = mp._ui["canvas"]
         circle = mp._ui["circle"]
         if mp.is_running():
-            canvas.itemconfig(circle, fill="green")
+            # 執行中但健康檢查失敗 -> 橘色
+            healthy = self.health[key].probe_ok is not False
+            canvas.itemconfig(circle, fill="green" if healthy else "orange")
             mp._ui["button"].configure(text="Stop")
         else:
             canvas.itemconfig(circle, fill="red")
@@ -223,13 +299,13 @@ class ManagerApp:
             # stop
             mp.terminate()
             # push message to terminal queue
-            mp.queue.put((time.strftime("%H:%M:%S"), "[Termiated_by_user] 使用者終止程式"))
+            mp.put_line("[Termiated_by_user] 使用者終止程式")
             self._update_indicator(key)
         else:
             # start
             try:
                 mp.start()
-                mp.queue.put((time.strftime("%H:%M:%S"), "[Started]"))
+                mp.put_line("[Started]")
             except FileNotFoundError as e:
                 messagebox.showwarning("啟動失敗", f"{mp.label} 無法啟動：\n{e}")
             except Exception as e:
@@ -248,7 +324,7 @@ class ManagerApp:
         注意：line_text 是不包含 timestamp 的原始 line
         """
         # 先 trim 左右空白（避免前導空白影響判斷）
-        s = line_text.lstrip()
+        s = SHARD_PREFIX.sub("", line_text.lstrip())
         if s.startswith("[Feedback]") or s.startswith("[OK]") or s.startswith("[Started]"):
             return "green"
         if s.startswith("[Warning]") or s.startswith("[Waiting]"):
@@ -257,41 +333,123 @@ class ManagerApp:
             return "red"
         return "default"
 
+    def _drain_queue(self, mp: ManagedProcess):
+        """Take every pending line from the queue, keeping at most MAX_LINES_PER_REFRESH of the newest."""
+        lines = []
+        while True:
+            try:
+                lines.append(mp.queue.get_nowait())
+            except queue.Empty:
+                break
+        skipped = len(lines) - MAX_LINES_PER_REFRESH
+        if skipped > 0:
+            lines = lines[skipped:]
+            with mp.alive_lock:
+                mp.dropped += skipped
+        return lines
+
     def _refresh_terminals(self):
-        # pull from each process queue and append to respective text widget
+        # pull from each process queue and append to respective text widget (one batched insert per pane)
         for key, mp in self.procs.items():
             txt = self.term_texts[key]
-            updated = False
-            while True:
-                try:
-                    ts, line = mp.queue.get_nowait()
-                except queue.Empty:
-                    break
-                # append to text and apply color tag based on message prefix (line itself, not timestamp)
-                tag = self._classify_tag_for_line(line)
+            lines = self._drain_queue(mp)
+
+            # 子程序輸出快過 UI：提示丟棄了幾行
+            dropped = mp.dropped - self._dropped_shown.get(key, 0)
+            if dropped > 0:
+                self._dropped_shown[key] = mp.dropped
+                lines.append((time.strftime("%H:%M:%S"), f"[Warning] 輸出過快，已略過 {dropped} 行（累計 {mp.dropped}）"))
+
+            if lines:
+                # insert(END, text1, tags1, text2, tags2, ...)：一次 Tcl 呼叫插入全部行並套上顏色 tag
+                # color tag 依 line 本身（不含 timestamp）的前綴決定
+                args = []
+                for ts, line in lines:
+                    args.append(LOG_LINE_PREFIX.format(time=ts) + line + "\n")
+                    args.append(self._classify_tag_for_line(line))
 
                 txt.configure(state=tk.NORMAL)
-                # insert full string with timestamp
-                txt.insert(tk.END, LOG_LINE_PREFIX.format(time=ts) + line + "\n")
-                # compute the start/end of the last inserted line then add tag
-                try:
-                    start = txt.index('end-1c linestart')
-                    end = txt.index('end-1c lineend')
-                    txt.tag_add(tag, start, end)
-                except Exception:
-                    # fallback: apply tag to whole text if indexing fails
-                    txt.tag_add(tag, "1.0", tk.END)
-
+                txt.insert(tk.END, *args)
+                # ring buffer：超過 LOG_MAX_LINES 就刪掉最舊的行
+                line_count = int(txt.index("end-1c").split(".")[0]) - 1
+                if line_count > LOG_MAX_LINES:
+                    txt.delete("1.0", f"{line_count - LOG_MAX_LINES + 1}.0")
                 txt.see(tk.END)
                 txt.configure(state=tk.DISABLED)
-                updated = True
             # update indicator based on process state
             self._update_indicator(key)
         # schedule next check
         self.root.after(READ_INTERVAL_MS, self._refresh_terminals)
 
+    def _draw_sparkline(self, spark, line, values):
+        """Redraw one sparkline (scaled to its own min/max)."""
+        values = list(values)
+        if len(values) < 2:
+            spark.coords(line, 0, 0, 0, 0)
+            return
+        lo, hi = min(values), max(values)
+        span = (hi - lo) or 1.0
+        step = (SPARK_WIDTH - 2) / (len(values) - 1)
+        coords = []
+        for i, v in enumerate(values):
+            coords.append(1 + i * step)
+            coords.append(SPARK_HEIGHT - 2 - (v - lo) / span * (SPARK_HEIGHT - 4))
+        spark.coords(line, *coords)
+
+    def _refresh_health(self):
+        for key, check in self.health.items():
+            mp = self.procs[key]
+            if check.restart_requested:
+                self._auto_restart(key, check)
+            if self._health_drawn.get(key) == check.version:
+                continue
+            self._health_drawn[key] = check.version
+
+            sample = check.last_sample
+            if sample is None:
+                mp._ui["stats"].configure(text="CPU -  RSS -  threads -  fds -")
+            else:
+                cpu = "-" if sample["cpu"] is None else f"{sample['cpu']:.0f}%"
+                mp._ui["stats"].configure(text=f"CPU {cpu}  RSS {sample['rss'] / 2 ** 20:.0f} MB  "
+                                               f"threads {sample['threads']}  fds {sample['fds']}")
+            if check.probe is None:
+                probe_text = "probe: 無"
+            elif check.probe_ok is None:
+                probe_text = "probe: 等待中" if mp.is_running() else "probe: -"
+            elif check.probe_ok:
+                probe_text = f"probe: OK {check.last_latency * 1000:.1f} ms"
+            else:
+                probe_text = f"probe: 失敗 x{check.failures}（{check.last_error}）"
+            if check.restarts:
+                probe_text += f"  自動重啟 {check.restarts} 次"
+            mp._ui["probe"].configure(text=probe_text)
+
+            for name, values in (("cpu", check.cpu), ("rss", check.rss), ("latency", check.latency)):
+                spark, line = mp._ui["sparks"][name]
+                self._draw_sparkline(spark, line, values)
+            self._update_indicator(key)
+        self.root.after(HEALTH_REFRESH_MS, self._refresh_health)
+
+    def _auto_restart(self, key, check: HealthCheck):
+        # 重啟一律在 GUI thread 執行（與 Start / Stop 按鈕相同路徑）
+        mp = self.procs[key]
+        check.restart_requested = False
+        if not mp.is_running():
+            return
+        check.restarts += 1
+        mp.put_line(f"[Error] 健康檢查連續失敗 {check.failures} 次（{check.last_error}），自動重新啟動")
+        mp.terminate()
+        try:
+            mp.start()
+            mp.put_line("[Started]")
+        except Exception as e:
+            mp.put_line(f"[Error] 自動重新啟動失敗：{e}")
+        self._update_indicator(key)
+
     def _on_close(self):
         if messagebox.askokcancel("離開", "確定要結束管理程式並終止所有子程序嗎？"):
+            for check in self.health.values():
+                check.stop()
             # terminate children
             for key, mp in self.procs.items():
                 try:
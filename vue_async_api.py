@@ -0,0 +1,274 @@
+# vue_async_api.py
+"""
+Async (aiohttp) version of vue_flask_api.py: same endpoints, same config / tags / gateway / metrics.
+
+- HTTP handler 與 asyncua client 跑在同一個 event loop（不再每個 request 佔一個 worker thread）
+- 同時間相同的 /data 讀取以 SingleFlight 合併成一次 upstream Read
+- 每個 request 有固定的 timeout budget（OPCUA_REQUEST_BUDGET 秒），超過回 504
+- 為了高併發，不印每筆 request 的 log（錯誤仍會印出）
+
+執行：
+    pip install aiohttp
+    python vue_async_api.py
+"""
+
+import asyncio
+import json
+import os
+import time
+
+from aiohttp import web
+
+from opcua_codec import NotAcceptable, negotiate
+from opcua_historian import downsample
+from opcua_metrics import CONTENT_TYPE, REGISTRY, Gauge
+from opcua_session import AsyncStreamClient, SingleFlight
+from vue_flask_api import (
+    DATA_MODE, HTTP_ERRORS, HTTP_IN_FLIGHT, HTTP_LATENCY, MAX_STALENESS, SNAPSHOT_REQUESTS, STREAM_CONNECT_WAIT,
+    STREAM_HEARTBEAT, broadcaster, build_status, conditional_data, encode_waveform, etag_matches, format_stats, gateway,
+    owners, parse_history_args, parse_since, parse_stats_args, parse_waveform_args, read_history, read_waveform,
+    render_data, select_tags,
+)
+
+# ---------- Config ----------
+HOST = "0.0.0.0"
+PORT = 5000
+# 每個 request 從進來到回應的時間上限（秒），包含等待連線與 upstream 讀取
+REQUEST_BUDGET = float(os.environ.get("OPCUA_REQUEST_BUDGET", "3.0"))
+BUDGET_MARGIN = 0.1  # 秒
+# ----------------------------
+
+CORS_HEADERS = {"Access-Control-Allow-Origin": "*", "Access-Control-Expose-Headers": "ETag, X-Data-Seq"}
+
+# 相同的 upstream 讀取（/data 全部 tag、相同區間的 /history）合併成一次
+flight = SingleFlight()
+
+SINGLEFLIGHT = Gauge("http_singleflight_calls", "Upstream reads issued (upstream) or shared by coalescing (shared)",
+                     ("result",))
+SINGLEFLIGHT.set_function(lambda: flight.calls, result="upstream")
+SINGLEFLIGHT.set_function(lambda: flight.shared, result="shared")
+
+
+class BudgetExceeded(Exception):
+    """Raised when a request runs out of its timeout budget."""
+
+
+def remaining(request) -> float:
+    return request["deadline"] - time.perf_counter()
+
+
+async def within_budget(request, aw):
+    """Await ``aw`` for at most the request's remaining budget."""
+    budget = remaining(request)
+    if budget <= 0:
+        raise BudgetExceeded(f"request budget {REQUEST_BUDGET:g}s exceeded")
+    try:
+        return await asyncio.wait_for(aw, budget)
+    except asyncio.TimeoutError:
+        raise BudgetExceeded(f"request budget {REQUEST_BUDGET:g}s exceeded")
+
+
+@web.middleware
+async def observe(request, handler):
+    start = time.perf_counter()
+    request["deadline"] = start + REQUEST_BUDGET
+    HTTP_IN_FLIGHT.inc()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        HTTP_IN_FLIGHT.dec()
+        resource = getattr(request.match_info.route, "resource", None)
+        endpoint = resource.canonical if resource is not None else "unmatched"
+        HTTP_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint, status=str(status))
+
+
+async def read_snapshot(timeout=None, endpoints=None):
+    """
+    Return {key: entry} of ``endpoints`` (default: all): fresh subscription snapshots as-is,
+    other endpoints by one (shared) batched Read.
+    """
+    if DATA_MODE == "subscribe":
+        fresh, stale = gateway.split_fresh(MAX_STALENESS, endpoints)
+        SNAPSHOT_REQUESTS.inc(result="miss" if stale else "hit")
+    else:
+        fresh, stale = [], gateway.endpoints if endpoints is None else endpoints
+    snapshot = gateway.snapshot(fresh)
+    if stale:
+        # 每個 endpoint 各自有 timeout（不超過剩餘的 request budget，慢的 endpoint 只會讓自己的 tag 變 None）；
+        # 相同的 endpoint 組合共用一次讀取
+        key = ("data",) + tuple(ep.label for ep in stale)
+        snapshot.update(await flight.do(key, lambda: gateway.read_async(stale, timeout)))
+    names = gateway.names if endpoints is None else [key for ep in endpoints for key in ep.keys]
+    return {name: snapshot.get(name) for name in names}
+
+
+async def get_data(request):
+    # ?detail=1 / ?since=<seq> / If-None-Match / ?tags= / Accept / ?format= / Accept-Encoding：同 Flask 版
+    detail = request.query.get("detail") in ("1", "true")
+    try:
+        since = parse_since(request.query)
+        tags = select_tags(request.query.get("tags", ""))
+        fmt = negotiate(request.headers.get("Accept"), request.query.get("format"))
+    except NotAcceptable as e:
+        return web.json_response({"error": str(e)}, status=406, headers=CORS_HEADERS)
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400, headers=CORS_HEADERS)
+    try:
+        # 留一點 budget 給組回應，endpoint 逾時時仍能回傳其他 endpoint 的資料
+        snapshot = await within_budget(request, read_snapshot(remaining(request) - BUDGET_MARGIN, owners(tags)))
+        status, data, headers = conditional_data(snapshot, detail, since, request.headers.get("If-None-Match"),
+                                                 fmt, tags)
+        if status == 304:
+            return web.Response(status=304, headers={**headers, **CORS_HEADERS})
+        body, headers = render_data(data, fmt, headers, request.headers.get("Accept-Encoding"))
+        return web.Response(body=body, headers={**headers, **CORS_HEADERS})
+    except Exception as e:
+        HTTP_ERRORS.inc(endpoint="/data", exception=type(e).__name__)
+        print(f"❌ 錯誤: {e}")
+        status = 504 if isinstance(e, BudgetExceeded) else 200
+        return web.json_response({"temperature": None, "weight": None, "error": str(e)}, status=status,
+                                 headers=CORS_HEADERS)
+
+
+async def get_status(request):
+    status = build_status()
+    status["server"] = "aiohttp"
+    status["request_budget"] = REQUEST_BUDGET
+    status["singleflight"] = {"upstream": flight.calls, "shared": flight.shared, "in_flight": len(flight)}
+    return web.json_response(status, headers=CORS_HEADERS)
+
+
+async def get_stream(request):
+    """Server-Sent Events：與 Flask 版相同，先送完整 snapshot，之後只推送有變化的 tag。"""
+    client = broadcaster.register(AsyncStreamClient())
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache",
+                                           "X-Accel-Buffering": "no", **CORS_HEADERS})
+    try:
+        await response.prepare(request)
+        await gateway.wait_connected_async(STREAM_CONNECT_WAIT)
+        values = {name: (e["value"] if e["quality"] == "good" else None)
+                  for name, e in gateway.snapshot().items() if e is not None}
+        await response.write(f"event: snapshot\ndata: {json.dumps(values)}\n\n".encode())
+        while True:
+            changes = await client.wait(STREAM_HEARTBEAT)
+            if not changes:
+                await response.write(b": heartbeat\n\n")
+                continue
+            data = {name: (e["value"] if e["quality"] == "good" else None) for name, e in changes.items()}
+            await response.write(f"data: {json.dumps(data)}\n\n".encode())
+    except (ConnectionResetError, asyncio.CancelledError):
+        # client 斷線
+        pass
+    finally:
+        broadcaster.unregister(client)
+    return response
+
+
+async def get_history(request):
+    """/history?tag=weight&from=<epoch 或 ISO8601>&to=<...>&max_points=500（同 Flask 版）"""
+    tag = request.query.get("tag")
+    if tag not in gateway.names:
+        return web.json_response({"error": f"unknown tag: {tag}", "tags": gateway.names}, status=400,
+                                 headers=CORS_HEADERS)
+    try:
+        t0, t1, max_points = parse_history_args(request.query)
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400, headers=CORS_HEADERS)
+    try:
+        def fetch(client, tagmap, name):
+            return read_history(client, tagmap, name, t0, t1)
+
+        t, v = await within_budget(request, flight.do(("history", tag, t0, t1), lambda: gateway.call_async(tag, fetch)))
+    except Exception as e:
+        HTTP_ERRORS.inc(endpoint="/history", exception=type(e).__name__)
+        print(f"❌ 錯誤: {e}")
+        status = 504 if isinstance(e, BudgetExceeded) else 502
+        return web.json_response({"tag": tag, "error": str(e)}, status=status, headers=CORS_HEADERS)
+    # 大量資料的 downsample 丟到 thread，不卡住 event loop
+    mode, points = await asyncio.get_running_loop().run_in_executor(None, downsample, t, v, t0, t1, max_points)
+    return web.json_response({"tag": tag, "from": t0, "to": t1, "raw_count": int(len(t)), "mode": mode,
+                              "points": points}, headers=CORS_HEADERS)
+
+
+async def get_waveform(request):
+    """/waveform?tag=weight&format=base64|binary|json&dtype=f8|f4（同 Flask 版）"""
+    tag = request.query.get("tag")
+    if tag not in gateway.wave_names:
+        return web.json_response({"error": f"unknown waveform tag: {tag}", "tags": gateway.wave_names}, status=400,
+                                 headers=CORS_HEADERS)
+    try:
+        fmt, dtype = parse_waveform_args(request.query)
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400, headers=CORS_HEADERS)
+    try:
+        t0, dt, samples = await within_budget(
+            request, flight.do(("waveform", tag), lambda: gateway.call_async(tag, read_waveform, waves=True)))
+    except LookupError as e:
+        # server 沒有這個波形節點（沒有設定 WAVE_TAGS）或還沒寫入第一個 block
+        return web.json_response({"tag": tag, "error": str(e)}, status=404, headers=CORS_HEADERS)
+    except Exception as e:
+        HTTP_ERRORS.inc(endpoint="/waveform", exception=type(e).__name__)
+        print(f"❌ 錯誤: {e}")
+        status = 504 if isinstance(e, BudgetExceeded) else 502
+        return web.json_response({"tag": tag, "error": str(e)}, status=status, headers=CORS_HEADERS)
+    headers = {"ETag": f'"{t0!r}"', **CORS_HEADERS}
+    if etag_matches(request.headers.get("If-None-Match", ""), headers["ETag"]):
+        return web.Response(status=304, headers=headers)
+    body, content_type = encode_waveform(tag, t0, dt, samples, fmt, dtype)
+    return web.Response(body=body, content_type=content_type, headers={"Cache-Control": "no-cache", **headers})
+
+
+async def get_stats(request):
+    """/stats?window=1m,1h&tags=weight,tray1（同 Flask 版）"""
+    try:
+        windows, tags = parse_stats_args(request.query)
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400, headers=CORS_HEADERS)
+    try:
+        key = ("stats",) + tuple(ep.label for ep in gateway.endpoints)
+        entries = await within_budget(request, flight.do(
+            key, lambda: gateway.read_async(timeout=remaining(request) - BUDGET_MARGIN, stats=True)))
+    except Exception as e:
+        HTTP_ERRORS.inc(endpoint="/stats", exception=type(e).__name__)
+        print(f"❌ 錯誤: {e}")
+        status = 504 if isinstance(e, BudgetExceeded) else 502
+        return web.json_response({"error": str(e)}, status=status, headers=CORS_HEADERS)
+    return web.json_response(format_stats(entries, windows, tags), headers=CORS_HEADERS)
+
+
+async def get_metrics(request):
+    return web.Response(body=REGISTRY.render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+
+async def _start_gateway(app):
+    await gateway.start_async()
+
+
+async def _stop_gateway(app):
+    await gateway.stop_async()
+
+
+def make_app() -> web.Application:
+    app = web.Application(middlewares=[observe])
+    app.router.add_get("/data", get_data)
+    app.router.add_get("/status", get_status)
+    app.router.add_get("/stream", get_stream)
+    app.router.add_get("/history", get_history)
+    app.router.add_get("/waveform", get_waveform)
+    app.router.add_get("/stats", get_stats)
+    app.router.add_get("/metrics", get_metrics)
+    app.on_startup.append(_start_gateway)
+    app.on_cleanup.append(_stop_gateway)
+    return app
+
+
+if __name__ == "__main__":
+    print(f"🚀 aiohttp API running at http://localhost:{PORT}/data")
+    # access log 每筆 request 都會寫一行，高併發時關掉
+    web.run_app(make_app(), host=HOST, port=PORT, access_log=None, backlog=4096)
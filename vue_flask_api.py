@@ -1,40 +1,479 @@
-from flask import Flask, jsonify
+import os
+import json
+import time
+import base64
+import functools
+import struct
+import zlib
+from datetime import datetime
+import numpy as np
+from flask import Flask, Response, g, jsonify, request, stream_with_context
 from flask_cors import CORS
-from asyncua import Client
-import asyncio
+from opcua_codec import CONTENT_TYPES, NotAcceptable, compress, encode, encode_columnar, match_tags, negotiate
+from opcua_historian import downsample, from_epoch, to_epoch
+from opcua_metrics import CONTENT_TYPE, NODEID_CACHE, REGISTRY, Counter, Gauge, Histogram
+from opcua_gateway import WAVE_INTERVAL, Gateway, load_endpoints
+from opcua_shards import SHARDS, shard_endpoints
+from opcua_session import Broadcaster, ChangeTracker, load_tags
+from opcua_stats import DEFAULT_WINDOWS, STAT_FUNCTIONS, parse_windows, stat_names
 
 app = Flask(__name__)
-CORS(app)
+# 瀏覽器端要讀得到 ETag / X-Data-Seq（?since= 差量模式用）
+CORS(app, expose_headers=["ETag", "X-Data-Seq"])
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# ---------- Config ----------
 OPCUA_URL = "opc.tcp://localhost:4840/freeopcua/server/"
 
+# /data 回傳的 key -> SensorData 節點 browse path
+# 可用 JSON 檔覆寫（預設 opcua_tags.json，或以環境變數 OPCUA_TAGS_FILE 指定），格式：
+#   {"weight": "0:Objects/2:SensorData/2:Weight", ...}
+DEFAULT_TAGS = {
+    "temperature": ["0:Objects", "2:SensorData", "2:Temperature"],
+    "weight": ["0:Objects", "2:SensorData", "2:Weight"],
+    "tray1": ["0:Objects", "2:SensorData", "2:Tray1_vol"],
+    "tray2": ["0:Objects", "2:SensorData", "2:Tray2_vol"],
+    "tray3": ["0:Objects", "2:SensorData", "2:Tray3_vol"],
+    "tray4": ["0:Objects", "2:SensorData", "2:Tray4_vol"],
+}
+TAGS_FILE = os.environ.get("OPCUA_TAGS_FILE", os.path.join(BASE_DIR, "opcua_tags.json"))
+# 多台 server（每條產線的控制器）：endpoint 設定檔存在時，/data 的 key 變成 "<endpoint>/<tag>"
+# 格式見 opcua_gateway.py（預設 opcua_endpoints.json，或以環境變數 OPCUA_ENDPOINTS_FILE 指定）
+ENDPOINTS_FILE = os.environ.get("OPCUA_ENDPOINTS_FILE", os.path.join(BASE_DIR, "opcua_endpoints.json"))
+# 分片模擬（opcua_shards.py）：OPCUA_SHARDS > 0 時改為連到 port 4840 起的 N 個 shard，聚合成一台 server，
+# /data 的 key 為上面的 tag 加上各 shard 的 Simulation 變數（"Obj0003/Var001"）；
+# SIM_OBJECTS / SIM_VARIABLES 需與 shard 的設定相同
+SIM_OBJECTS = int(os.environ.get("SIM_OBJECTS", "0"))
+SIM_VARIABLES = int(os.environ.get("SIM_VARIABLES", "10"))
+
+# 資料來源模式：
+#   "poll"      -> 每個 /data 對 server 做一次批次 Read
+#   "subscribe" -> 一個 subscription 維護記憶體 snapshot，/data 直接從記憶體回應
+DATA_MODE = os.environ.get("OPCUA_DATA_MODE", "poll")
+# subscribe 模式下 snapshot 最多可以多舊（秒）；超過則退回直接讀取
+MAX_STALENESS = float(os.environ.get("OPCUA_MAX_STALENESS", "5.0"))
+# /stream（Server-Sent Events）沒有變化時多久送一次 heartbeat（秒）
+STREAM_HEARTBEAT = 10.0
+# /stream 開始時最多等所有 endpoint 連上幾秒（之後才連上的 endpoint 由後續通知補上）
+STREAM_CONNECT_WAIT = 2.0
+# /history 預設查詢範圍（秒）與回傳點數上限
+HISTORY_DEFAULT_RANGE = 3600.0
+HISTORY_MAX_POINTS = 500
+# /waveform 的波形（array）tag：key -> browse path（server 端 WAVE_TAGS 建立在 Objects/Waveform/<name>）
+# 預設與 server 讀同一個環境變數 WAVE_TAGS（例如 "Weight" -> /waveform?tag=weight；未設定 = 沒有波形 tag）
+# 可用 JSON 檔覆寫（預設 opcua_wave_tags.json，或以環境變數 OPCUA_WAVE_TAGS_FILE 指定），格式同 tag 設定檔
+DEFAULT_WAVE_TAGS = {
+    name.lower(): ["0:Objects", "2:Waveform", f"2:{name}"]
+    for name in (n.strip() for n in os.environ.get("WAVE_TAGS", "").split(",")) if name
+}
+WAVE_TAGS_FILE = os.environ.get("OPCUA_WAVE_TAGS_FILE", os.path.join(BASE_DIR, "opcua_wave_tags.json"))
+# /stats 的時間窗：每個 tag 底下的 <Avg|Min|Max|Std>_<時間窗> 子節點（server 端 STATS_WINDOWS 建立），
+# 需與 server 的設定相同（逗號分隔，或以環境變數 OPCUA_STATS_WINDOWS 指定）
+STATS_WINDOWS = list(parse_windows(os.environ.get("OPCUA_STATS_WINDOWS", DEFAULT_WINDOWS)))
+# ----------------------------
+
+# /waveform?format=binary 的 header：t0（第一個取樣的 epoch 秒）、dt（取樣間隔秒）、count，
+# 補到 24 bytes 讓後面的 float 陣列維持 8-byte 對齊（瀏覽器可直接 new Float64Array(buf, 24, count)）
+WAVE_HEADER = struct.Struct("<ddI4x")
+WAVE_FORMATS = ("base64", "binary", "json")
+WAVE_DTYPES = {"f8": "<f8", "f4": "<f4"}
+# /data 的 log：JSON body 不超過這個大小才整個印出，否則只印格式與大小（上千個 tag 時印 log 比序列化還慢）
+LOG_MAX_BYTES = 2048
+
+# 每個 endpoint 一個常駐的 OPC UA session（背景 event loop + 自動重連），所有 request 共用
+# NodeId 快取：連線時解析一次，之後每個 /data 對每個 endpoint 只需一次批次 Read（各 endpoint 同時進行）
+# subscription 一律建立：餵給 /stream；subscribe 模式下 /data 也從它的 snapshot 回應
+if SHARDS > 0:
+    gateway = Gateway(shard_endpoints(SHARDS, SIM_OBJECTS, SIM_VARIABLES, load_tags(TAGS_FILE, DEFAULT_TAGS),
+                                      session_name="vue_flask_api", stats=stat_names(STATS_WINDOWS),
+                                      waves=load_tags(WAVE_TAGS_FILE, DEFAULT_WAVE_TAGS)))
+else:
+    gateway = Gateway(load_endpoints(ENDPOINTS_FILE, OPCUA_URL, load_tags(TAGS_FILE, DEFAULT_TAGS),
+                                     session_name="vue_flask_api",
+                                     default_waves=load_tags(WAVE_TAGS_FILE, DEFAULT_WAVE_TAGS),
+                                     stats=stat_names(STATS_WINDOWS)))
+broadcaster = Broadcaster()
+# /data 的 ETag 與 ?since= 差量：每個 tag 的 value / quality 變化時 seq 遞增
+tracker = ChangeTracker()
+gateway.add_listener(broadcaster.publish)
+
+# ---------- Metrics（/metrics，Prometheus text format） ----------
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency in seconds", ("endpoint", "status"))
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being served (including open streams)")
+HTTP_ERRORS = Counter("http_errors_total", "Errors raised while serving HTTP requests", ("endpoint", "exception"))
+SNAPSHOT_REQUESTS = Counter("data_snapshot_requests_total",
+                            "/data answered from the subscription snapshot (hit) or by a direct read (miss)",
+                            ("result",))
+CACHE_HIT_RATIO = Gauge("cache_hit_ratio", "Hit ratio of in-process caches", ("cache",))
+
+def _ratio(counter):
+    hit, miss = counter.get(result="hit"), counter.get(result="miss")
+    return hit / (hit + miss) if hit + miss else None
+
+SESSION_CONNECTED = Gauge("opcua_session_connected", "1 if the OPC UA session to the endpoint is connected",
+                          ("endpoint",))
+SESSION_RECONNECTS = Gauge("opcua_session_reconnects", "Successful reconnects of the endpoint session", ("endpoint",))
+CIRCUIT_OPEN = Gauge("opcua_circuit_open", "1 if the endpoint circuit breaker is open / half-open", ("endpoint",))
+SNAPSHOT_AGE = Gauge("data_snapshot_age_seconds", "Seconds since the subscription snapshot was last confirmed",
+                     ("endpoint",))
+NOTIFICATIONS = Gauge("data_subscription_notifications", "Datachange notifications received", ("endpoint",))
+for ep in gateway.endpoints:
+    SESSION_CONNECTED.set_function(lambda ep=ep: 1.0 if ep.session.state == "connected" else 0.0, endpoint=ep.label)
+    SESSION_RECONNECTS.set_function(lambda ep=ep: ep.session.reconnects, endpoint=ep.label)
+    CIRCUIT_OPEN.set_function(lambda ep=ep: 0.0 if ep.breaker.state == "closed" else 1.0, endpoint=ep.label)
+    SNAPSHOT_AGE.set_function(ep.subscription.age, endpoint=ep.label)
+    NOTIFICATIONS.set_function(lambda ep=ep: ep.subscription.notifications, endpoint=ep.label)
+Gauge("stream_clients", "Connected /stream clients").set_function(lambda: len(broadcaster))
+CACHE_HIT_RATIO.set_function(lambda: _ratio(SNAPSHOT_REQUESTS), cache="data_snapshot")
+CACHE_HIT_RATIO.set_function(lambda: _ratio(NODEID_CACHE), cache="nodeid")
+
 @app.route("/data")
 def get_data():
+    # ?detail=1 -> 每個 tag 附帶 quality / source_timestamp
+    # ?since=<seq> -> 只回傳 seq 之後有變化的 tag（seq 取自上一次回應的 X-Data-Seq 或 body 的 "seq"）
+    # If-None-Match: <ETag> -> 沒有任何 tag 變化時回 304（不含 body）
+    # ?tags=weight,tray*,Obj0003/ -> 只回傳選到的 tag（萬用字元，或以 "/" 結尾的前綴）
+    # Accept（或 ?format=json|msgpack|columnar）-> 回應格式；Accept-Encoding: gzip -> 大的回應壓縮
+    detail = request.args.get("detail") in ("1", "true")
+    try:
+        since = parse_since(request.args)
+        tags = select_tags(request.args.get("tags", ""))
+        fmt = negotiate(request.headers.get("Accept"), request.args.get("format"))
+    except NotAcceptable as e:
+        return jsonify({"error": str(e)}), 406
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     try:
-        data = asyncio.run(read_opcua())
-        print(f"✅ 傳回資料: {data}")
-        return jsonify(data)
+        status, data, headers = conditional_data(read_snapshot(owners(tags)), detail, since,
+                                                 request.headers.get("If-None-Match"), fmt, tags)
+        if status == 304:
+            return Response(status=304, headers=headers)
+        body, headers = render_data(data, fmt, headers, request.headers.get("Accept-Encoding"))
+        if fmt == "json" and len(body) <= LOG_MAX_BYTES and "Content-Encoding" not in headers:
+            print(f"✅ 傳回資料: {data}")
+        else:
+            print(f"✅ 傳回資料: {fmt}, {len(body)} bytes")
+        return Response(body, headers=headers)
     except Exception as e:
+        HTTP_ERRORS.inc(endpoint="/data", exception=type(e).__name__)
         print(f"❌ 錯誤: {e}")
         return jsonify({"temperature": None, "weight": None, "error": str(e)})
 
-async def read_opcua():
-    async with Client(url=OPCUA_URL) as client:
-        client.set_security_string("None")  # 關閉安全機制
-        temp_node = await client.nodes.root.get_child(["0:Objects", "2:SensorData", "2:Temperature"])
-        weight_node = await client.nodes.root.get_child(["0:Objects", "2:SensorData", "2:Weight"])
-        tray1_vol_node = await client.nodes.root.get_child(["0:Objects", "2:SensorData", "2:Tray1_vol"])
-        tray2_vol_node = await client.nodes.root.get_child(["0:Objects", "2:SensorData", "2:Tray2_vol"])
-        tray3_vol_node = await client.nodes.root.get_child(["0:Objects", "2:SensorData", "2:Tray3_vol"])
-        tray4_vol_node = await client.nodes.root.get_child(["0:Objects", "2:SensorData", "2:Tray1_vol"])
-
-        temp = await temp_node.read_value()
-        weight = await weight_node.read_value()
-        tray1_vol = await tray1_vol_node.read_value()
-        tray2_vol = await tray2_vol_node.read_value()
-        tray3_vol = await tray3_vol_node.read_value()
-        tray4_vol = await tray4_vol_node.read_value()
-        return {"temperature": temp, "weight": weight, "tray1": tray1_vol, "tray2": tray2_vol, "tray3": tray3_vol, "tray4": tray4_vol}
+@app.route("/status")
+def get_status():
+    return jsonify(build_status())
+
+def build_status():
+    # 連線狀態：idle / connecting / connected / disconnected（每個 endpoint 各自一份，含 circuit breaker）
+    status = {}
+    if len(gateway.endpoints) == 1:
+        # 單一 server 時維持原本的欄位
+        status.update(gateway.endpoints[0].status())
+    status["mode"] = DATA_MODE
+    status["stream_clients"] = len(broadcaster)
+    status["endpoints"] = gateway.status()
+    return status
+
+@app.route("/stream")
+def get_stream():
+    """
+    Server-Sent Events：先送一次完整 snapshot，之後只推送有變化的 tag。
+    每個 client 有自己的合併緩衝，慢的 client 不會拖慢其他 client。
+    """
+    client = broadcaster.register()
+
+    def events():
+        try:
+            gateway.wait_connected(STREAM_CONNECT_WAIT)
+            values = {name: (e["value"] if e["quality"] == "good" else None)
+                      for name, e in gateway.snapshot().items() if e is not None}
+            yield f"event: snapshot\ndata: {json.dumps(values)}\n\n"
+            while True:
+                changes = client.wait(STREAM_HEARTBEAT)
+                if not changes:
+                    yield ": heartbeat\n\n"
+                    continue
+                data = {name: (e["value"] if e["quality"] == "good" else None) for name, e in changes.items()}
+                yield f"data: {json.dumps(data)}\n\n"
+        finally:
+            broadcaster.unregister(client)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(events()), mimetype="text/event-stream", headers=headers)
+
+@app.route("/history")
+def get_history():
+    """
+    /history?tag=weight&from=<epoch 或 ISO8601>&to=<...>&max_points=500
+    透過 OPC UA HistoryRead 取回原始資料，超過 max_points 時在這裡壓成 min/max/avg bucket。
+    """
+    tag = request.args.get("tag")
+    if tag not in gateway.names:
+        return jsonify({"error": f"unknown tag: {tag}", "tags": gateway.names}), 400
+    try:
+        t0, t1, max_points = parse_history_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        t, v = gateway.call(tag, lambda client, tagmap, name: read_history(client, tagmap, name, t0, t1))
+    except Exception as e:
+        HTTP_ERRORS.inc(endpoint="/history", exception=type(e).__name__)
+        print(f"❌ 錯誤: {e}")
+        return jsonify({"tag": tag, "error": str(e)}), 502
+    mode, points = downsample(t, v, t0, t1, max_points)
+    return jsonify({"tag": tag, "from": t0, "to": t1, "raw_count": int(len(t)), "mode": mode, "points": points})
+
+@app.route("/waveform")
+def get_waveform():
+    """
+    /waveform?tag=weight&format=base64|binary|json&dtype=f8|f4
+    最新的一個波形 block：t0（第一個取樣的 epoch 秒）、dt（取樣間隔秒）、count 與取樣值。
+      base64（預設）：JSON，data 為 little-endian float 陣列的 base64
+      binary：application/octet-stream，WAVE_HEADER（24 bytes）後接取樣
+      json：取樣為 JSON 數字陣列（除錯用，體積最大）
+    ETag 為 t0：帶 If-None-Match 輪詢時，server 還沒寫入新 block 就回 304。
+    """
+    tag = request.args.get("tag")
+    if tag not in gateway.wave_names:
+        return jsonify({"error": f"unknown waveform tag: {tag}", "tags": gateway.wave_names}), 400
+    try:
+        fmt, dtype = parse_waveform_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        t0, dt, samples = gateway.call(tag, read_waveform, waves=True)
+    except LookupError as e:
+        # server 沒有這個波形節點（沒有設定 WAVE_TAGS）或還沒寫入第一個 block
+        return jsonify({"tag": tag, "error": str(e)}), 404
+    except Exception as e:
+        HTTP_ERRORS.inc(endpoint="/waveform", exception=type(e).__name__)
+        print(f"❌ 錯誤: {e}")
+        return jsonify({"tag": tag, "error": str(e)}), 502
+    etag = f'"{t0!r}"'
+    if etag_matches(request.headers.get("If-None-Match", ""), etag):
+        return Response(status=304, headers={"ETag": etag})
+    body, content_type = encode_waveform(tag, t0, dt, samples, fmt, dtype)
+    return Response(body, content_type=content_type, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+@app.route("/stats")
+def get_stats():
+    """
+    /stats?window=1m,1h&tags=weight,tray1（兩者皆可省略 = 全部）
+    每個 tag 各時間窗的 avg / min / max / std：server 端逐筆增量維護，這裡每個 endpoint 只做一次批次 Read。
+    時間窗內沒有資料（或 server 沒有建立統計節點）時為 None。
+    """
+    try:
+        windows, tags = parse_stats_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        return jsonify(format_stats(gateway.read(stats=True), windows, tags))
+    except Exception as e:
+        HTTP_ERRORS.inc(endpoint="/stats", exception=type(e).__name__)
+        print(f"❌ 錯誤: {e}")
+        return jsonify({"error": str(e)}), 502
+
+def parse_stats_args(args):
+    """window / tags query 參數（逗號分隔）-> (windows, tags)；未知的時間窗或 tag raise ValueError"""
+    def selection(name, choices):
+        value = args.get(name)
+        if not value:
+            return list(choices)
+        selected = [x.strip() for x in value.split(",") if x.strip()]
+        unknown = [x for x in selected if x not in choices]
+        if unknown:
+            raise ValueError(f"unknown {name}: {', '.join(unknown)} (choose from {', '.join(choices)})")
+        return selected
+    return selection("window", STATS_WINDOWS), selection("tags", gateway.stat_names)
+
+def format_stats(entries, windows, tags):
+    """{"<tag>/<Fn>_<window>": entry} -> {tag: {window: {"avg", "min", "max", "std"}}}（NaN / bad quality 為 None）"""
+    def value(key):
+        e = entries.get(key)
+        if e is None or e["quality"] != "good" or not isinstance(e["value"], (int, float)) or e["value"] != e["value"]:
+            return None
+        return e["value"]
+    return {tag: {w: {fn.lower(): value(f"{tag}/{fn}_{w}") for fn in STAT_FUNCTIONS} for w in windows} for tag in tags}
+
+def parse_waveform_args(args):
+    fmt = args.get("format", "base64")
+    if fmt not in WAVE_FORMATS:
+        raise ValueError(f"invalid format: {fmt!r} (choose from {', '.join(WAVE_FORMATS)})")
+    dtype = args.get("dtype", "f8")
+    if dtype not in WAVE_DTYPES:
+        raise ValueError(f"invalid dtype: {dtype!r} (choose from {', '.join(WAVE_DTYPES)})")
+    return fmt, dtype
+
+async def read_waveform(client, tagmap, tag):
+    """Latest block of a waveform tag in one Read: (t0 epoch seconds, sample interval or None, float64 samples)."""
+    interval = f"{tag}/{WAVE_INTERVAL}"
+    result = await tagmap.read(client, [tag, interval])
+    dv = result[tag]
+    if dv is None or not dv.StatusCode.is_good() or dv.Value is None or dv.Value.Value is None:
+        raise LookupError(f"waveform {tag} not available ({dv.StatusCode if dv is not None else 'node not found'})")
+    iv = result[interval]
+    dt = float(iv.Value.Value) if iv is not None and iv.StatusCode.is_good() and iv.Value.Value is not None else None
+    return to_epoch(dv.SourceTimestamp), dt, np.asarray(dv.Value.Value, dtype=np.float64)
+
+def encode_waveform(tag, t0, dt, samples, fmt="base64", dtype="f8"):
+    """Return (body bytes, content type) of one waveform block."""
+    if fmt == "binary":
+        nan = float("nan")
+        header = WAVE_HEADER.pack(t0 if t0 is not None else nan, dt if dt is not None else nan, len(samples))
+        return header + samples.astype(WAVE_DTYPES[dtype]).tobytes(), "application/octet-stream"
+    payload = {"tag": tag, "t0": t0, "dt": dt, "count": int(len(samples))}
+    if fmt == "json":
+        payload["values"] = samples.tolist()
+    else:
+        payload["dtype"] = WAVE_DTYPES[dtype]
+        payload["data"] = base64.b64encode(samples.astype(WAVE_DTYPES[dtype]).tobytes()).decode("ascii")
+    return json.dumps(payload).encode(), "application/json"
+
+def parse_history_args(args):
+    """from / to / max_points query 參數 -> (t0, t1, max_points)；格式錯誤時 raise ValueError"""
+    t1 = parse_time(args.get("to"), time.time())
+    t0 = parse_time(args.get("from"), t1 - HISTORY_DEFAULT_RANGE)
+    max_points = max(1, int(args.get("max_points", HISTORY_MAX_POINTS)))
+    return t0, t1, max_points
+
+def parse_time(value, default):
+    if value in (None, ""):
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return to_epoch(datetime.fromisoformat(value.replace("Z", "+00:00")))
+    except ValueError:
+        raise ValueError(f"invalid time: {value}（請用 epoch 秒數或 ISO 8601）")
+
+async def read_history(client, tagmap, tag, t0, t1):
+    if tag not in tagmap.nodeids:
+        await tagmap.resolve(client)
+    node = client.get_node(tagmap.nodeids[tag])
+    dvs = await node.read_raw_history(from_epoch(t0), from_epoch(t1))
+    t = np.fromiter((to_epoch(dv.SourceTimestamp) for dv in dvs), dtype=np.float64, count=len(dvs))
+    v = np.fromiter((dv.Value.Value if dv.Value is not None and isinstance(dv.Value.Value, (int, float)) else np.nan
+                     for dv in dvs), dtype=np.float64, count=len(dvs))
+    order = np.argsort(t, kind="stable")
+    return t[order], v[order]
+
+@app.route("/metrics")
+def get_metrics():
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+@app.before_request
+def _ensure_session():
+    # 延後到第一個 request 才啟動，避免 debug reloader 的父程序也建立連線
+    gateway.start()
+    g.request_start = time.perf_counter()
+    HTTP_IN_FLIGHT.inc()
+
+@app.after_request
+def _observe_latency(response):
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    HTTP_LATENCY.observe(time.perf_counter() - g.request_start, endpoint=endpoint, status=str(response.status_code))
+    return response
+
+@app.teardown_request
+def _request_done(exc):
+    if "request_start" in g:
+        HTTP_IN_FLIGHT.dec()
+
+def format_data(snapshot, detail=False):
+    """/data 的回傳格式：detail 時為完整 entry，否則只有 quality 為 good 的值（其餘為 None）"""
+    if detail:
+        return snapshot
+    return {name: (e["value"] if e is not None and e["quality"] == "good" else None) for name, e in snapshot.items()}
+
+def parse_since(args):
+    """?since=<seq> -> int（沒帶為 None）"""
+    since = args.get("since")
+    if since is None:
+        return None
+    try:
+        return int(since)
+    except ValueError:
+        raise ValueError(f"invalid since: {since!r} (expected the integer seq of a previous response)")
+
+def conditional_data(snapshot, detail=False, since=None, if_none_match=None, fmt="json", tags=None):
+    """
+    Return (status, body, headers) for /data: 304 without body when If-None-Match matches the ETag,
+    otherwise the full data, or in delta mode (since given) {"seq", "full", "changes"} with only the changed tags.
+    tags：只回傳這些 key（None = snapshot 全部）；fmt="columnar" 時 body 已是編碼好的 bytes。
+    """
+    seq = tracker.update(snapshot)
+    # ETag 代表 value / quality 的版本（detail 模式下只有時間戳變化不算變化），並區分格式與 tag 選擇；
+    # 有 ?tags= 時只看選到的 tag 最後一次變化，其他 tag 變化不會讓 If-None-Match 失效
+    version = seq if tags is None else tracker.last_change(tags)
+    variant = ("d" if detail else "") + ("" if since is None else f"s{since}")
+    if fmt != "json":
+        variant += f"f{fmt}"
+    if tags is not None:
+        variant += f"t{zlib.crc32(chr(10).join(tags).encode()):08x}"
+    etag = f'"{version}-{variant}"' if variant else f'"{version}"'
+    headers = {"ETag": etag, "X-Data-Seq": str(seq), "Cache-Control": "no-cache"}
+    if if_none_match and etag_matches(if_none_match, etag):
+        return 304, None, headers
+    if tags is not None:
+        snapshot = {n: snapshot.get(n) for n in tags}
+    if since is None:
+        if fmt == "columnar":
+            return 200, encode_columnar(snapshot, seq), headers
+        return 200, format_data(snapshot, detail), headers
+    changed = set(tracker.changed_since(since))
+    names = [n for n in snapshot if n in changed]
+    full = len(names) == len(snapshot)
+    if fmt == "columnar":
+        return 200, encode_columnar({n: snapshot[n] for n in names}, seq, full), headers
+    return 200, {"seq": seq, "full": full, "changes": format_data({n: snapshot[n] for n in names}, detail)}, headers
+
+def render_data(data, fmt, headers, accept_encoding=None):
+    """Encode a /data body in ``fmt`` (gzip when accepted and large); return (bytes, headers)."""
+    body = data if fmt == "columnar" else encode(data, fmt)
+    body, encoding = compress(body, accept_encoding)
+    headers = {**headers, "Content-Type": CONTENT_TYPES[fmt], "Vary": "Accept, Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return body, headers
+
+@functools.lru_cache(maxsize=256)
+def select_tags(query):
+    """?tags= -> tuple of selected keys (None = all); the pattern matching is cached per query string."""
+    if not query:
+        return None
+    return tuple(match_tags(gateway.names, query))
+
+def owners(tags):
+    """Endpoints owning ``tags`` (None = all endpoints): a selection only reads the endpoints it needs."""
+    if tags is None:
+        return None
+    owned = {gateway.find(tag)[0] for tag in tags}
+    return [ep for ep in gateway.endpoints if ep in owned]
+
+def etag_matches(if_none_match, etag):
+    candidates = [t.strip() for t in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+def read_snapshot(endpoints=None):
+    """
+    Return {key: entry} of ``endpoints`` (default: all): fresh subscription snapshots as-is,
+    other endpoints by one batched Read each.
+    """
+    if DATA_MODE == "subscribe":
+        fresh, stale = gateway.split_fresh(MAX_STALENESS, endpoints)
+        SNAPSHOT_REQUESTS.inc(result="miss" if stale else "hit")
+        # snapshot 過舊的 endpoint（斷線或 subscription 尚未建立）-> 退回直接讀取
+        snapshot = gateway.snapshot(fresh)
+        if stale:
+            snapshot.update(gateway.read(stale))
+    else:
+        # 所有 endpoint 同時讀取，最多等最長的 endpoint timeout；失敗的 endpoint 其 tag 為 None
+        snapshot = gateway.read(endpoints)
+    names = gateway.names if endpoints is None else [key for ep in endpoints for key in ep.keys]
+    return {name: snapshot.get(name) for name in names}
 
 if __name__ == "__main__":
     print("🚀 Flask API running at http://localhost:5000/data")